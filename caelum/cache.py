@@ -0,0 +1,125 @@
+"""Binary column cache for parsed weather files.
+
+The first parse of a text file (EPW, TMY3 csv) is written next to it as a
+``<file>.cols`` directory holding one ``.npy`` file per column and a
+``meta.json`` stamp.  Later loads memory-map the columns instead of
+parsing text.  The stamp records the cache format, the parser version and
+the source mtime and size, so an edited or re-downloaded source file is
+parsed again.
+"""
+# Copyright (C) 2015 Nathan Charles
+#
+# This program is free software. See terms in LICENSE file.
+
+import json
+import os
+import shutil
+import tempfile
+import logging
+import numpy as np
+from .tools import UMASK
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+SUFFIX = '.cols'
+
+
+def cache_path(source):
+    """cache directory for a source file."""
+    return source + SUFFIX
+
+
+def _stamp(source, version):
+    """validation stamp for the current state of source."""
+    stat = os.stat(source)
+    return {'format': FORMAT,
+            'version': version,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size}
+
+
+def load(source, version=0, columns=None):
+    """Memory-mapped columns for source.
+
+    Args:
+        source (str): path of parsed text file.
+        version (int): parser version, stale caches are ignored.
+        columns (list): columns to map. Default all.
+
+    Returns:
+        dict: column -> read only array, None if missing or stale.
+    """
+    path = cache_path(source)
+    try:
+        with open(path + '/meta.json') as meta_file:
+            meta = json.load(meta_file)
+        if meta['stamp'] != _stamp(source, version):
+            logger.debug('stale cache %s', path)
+            return None
+        names = [str(i) for i in meta['columns']]
+        if columns is None:
+            columns = names
+        return dict((name, np.load('%s/%s.npy' % (path, names.index(name)),
+                                   mmap_mode='r'))
+                    for name in columns)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def save(source, columns, version=0):
+    """Write columns for source.
+
+    The cache is built in a temporary directory and renamed into place,
+    so concurrent readers see the old cache or the new one, never part of
+    one.  Failures are logged, not raised.
+
+    Args:
+        source (str): path of parsed text file.
+        columns (dict): column -> array, no object arrays.
+        version (int): parser version.
+    """
+    path = cache_path(source)
+    directory = os.path.dirname(os.path.abspath(source))
+    build = None
+    try:
+        meta = {'stamp': _stamp(source, version),
+                'columns': sorted(columns)}
+        build = tempfile.mkdtemp(prefix='.cols', dir=directory)
+        # mkdtemp is owner only, shared caches follow the umask
+        os.chmod(build, 0777 & ~UMASK)
+        for i, name in enumerate(meta['columns']):
+            np.save('%s/%s.npy' % (build, i), np.asarray(columns[name]),
+                    allow_pickle=False)
+        with open(build + '/meta.json', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        if os.path.exists(path):
+            stale = tempfile.mkdtemp(prefix='.cols', dir=directory)
+            os.rename(path, stale + '/old')
+            shutil.rmtree(stale, ignore_errors=True)
+        os.rename(build, path)
+        logger.debug('cached %s', path)
+    except (IOError, OSError) as err:
+        logger.warning('could not cache %s: %s', source, err)
+        if build and os.path.isdir(build):
+            shutil.rmtree(build, ignore_errors=True)
+
+
+def cached(source, parse, version=0, columns=None):
+    """Columns for source from the cache, parsing on a miss.
+
+    Args:
+        source (str): path of parsed text file.
+        parse (function): source -> dict of all columns.
+        version (int): parser version, bump when parse changes.
+        columns (list): columns to return. Default all.
+
+    Returns:
+        dict: column -> array
+    """
+    loaded = load(source, version, columns)
+    if loaded is None:
+        loaded = parse(source)
+        save(source, loaded, version)
+        if columns is not None:
+            loaded = dict((name, loaded[name]) for name in columns)
+    return loaded
@@ -0,0 +1,199 @@
+"""Design conditions from EnergyPlus .ddy and .stat files.
+
+All design conditions are extracted from a station's files in one pass
+and kept in a persistent SQLite index, so repeat lookups read no weather
+files.  Values are degrees Celsius.
+
+Fields:
+    extreme_min, extreme_max: extreme annual dry bulb.  The .ddy files
+        label these "Max Drybulb" and "Min Drybulb" the wrong way around.
+    heating_99.6, heating_99: annual heating dry bulb.
+    cooling_0.4, cooling_1, cooling_2: annual cooling (DB=>MWB) dry bulb.
+    mwb_0.4, mwb_1, mwb_2: mean coincident wet bulb for the above.
+    stat_minimum, stat_twopercent: .stat fallbacks for eere.minimum and
+        eere.twopercent.
+"""
+# Copyright (C) 2015 Nathan Charles
+#
+# This program is free software. See terms in LICENSE file.
+
+import os
+import re
+import sqlite3
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+# bump when parsing changes to invalidate indexed records
+VERSION = 1
+
+FIELDS = ['extreme_min', 'extreme_max', 'heating_99.6', 'heating_99',
+          'cooling_0.4', 'cooling_1', 'cooling_2', 'mwb_0.4', 'mwb_1',
+          'mwb_2', 'stat_minimum', 'stat_twopercent']
+
+NUMBER = '(-?\\d+(?:\\.\\d*)?)'
+# eere.minimum and eere.twopercent have always used these two
+EXTREME_MIN = re.compile('Max Drybulb=(-?\\d+\\.\\d*)')
+TWOPERCENT = re.compile('2%, MaxDB=(\\d+\\.\\d*)')
+EXTREME_MAX = re.compile('Min Drybulb=' + NUMBER)
+HEATING = re.compile('Heating (99\\.6|99)%, M(?:ax|in)DB=' + NUMBER)
+COOLING = re.compile('Cooling \\(DB=>MWB\\) (\\.4|1|2)%, MaxDB=' + NUMBER +
+                     '(?:\\S*\\s+MWB=' + NUMBER + ')?')
+
+
+def parse_ddy(lines):
+    """Design conditions from .ddy lines.
+
+    The last match wins, as in the old line by line scans.
+
+    Returns:
+        dict: field -> float, missing fields omitted
+    """
+    found = {}
+    for line in lines:
+        if 'Drybulb=' in line:
+            for pattern, field in [(EXTREME_MIN, 'extreme_min'),
+                                   (EXTREME_MAX, 'extreme_max')]:
+                value = pattern.search(line)
+                if value:
+                    found[field] = float(value.group(1))
+        if 'DB=' not in line:
+            continue
+        value = HEATING.search(line)
+        if value:
+            found['heating_' + value.group(1)] = float(value.group(2))
+        value = COOLING.search(line)
+        if value:
+            percent = value.group(1).replace('.4', '0.4')
+            if percent != '2':
+                found['cooling_' + percent] = float(value.group(2))
+            if value.group(3):
+                found['mwb_' + percent] = float(value.group(3))
+        value = TWOPERCENT.search(line)
+        if value:
+            found['cooling_2'] = float(value.group(1))
+    return found
+
+
+def parse_stat(lines):
+    """eere.minimum and eere.twopercent fallbacks from .stat lines.
+
+    Returns:
+        dict: field -> float, missing fields omitted
+    """
+    found = {}
+    flag = 0
+    tdata = []
+    for line in lines:
+        if 'stat_minimum' not in found and \
+                line.find('Minimum Dry Bulb') != -1:
+            try:
+                found['stat_minimum'] = float(line[37:-1].split('\xb0')[0])
+            except ValueError:
+                pass
+        if line.find('2%') != -1:
+            flag = 3
+        if flag > 0:
+            tdata.append(line.split('\t'))
+            flag -= 1
+    try:
+        found['stat_twopercent'] = float(tdata[2][5].strip())
+    except (IndexError, ValueError):
+        pass
+    return found
+
+
+def parse(ddy=None, stat=None):
+    """Design conditions from a station's files.
+
+    Args:
+        ddy (str): path to .ddy file or None
+        stat (str): path to .stat file or None
+
+    Returns:
+        dict: every field in FIELDS, None if not found
+    """
+    conditions = dict((field, None) for field in FIELDS)
+    for path, parser in [(ddy, parse_ddy), (stat, parse_stat)]:
+        if path and os.path.exists(path):
+            with open(path) as lines:
+                conditions.update(parser(lines))
+    return conditions
+
+
+def _column(field):
+    """quoted SQL column for a field."""
+    return '"%s"' % field
+
+
+class DesignIndex(object):
+
+    """Persistent SQLite index of parsed design conditions.
+
+    Records carry the parser version and the mtimes of the files they
+    were parsed from, so callers can tell when they are stale.
+
+    Args:
+        path (str): SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        """per thread connection, table created on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            columns = ', '.join('%s REAL' % _column(i) for i in FIELDS)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS design (station_code TEXT '
+                'PRIMARY KEY, version INTEGER, ddy_mtime REAL, '
+                'stat_mtime REAL, %s)' % columns)
+            self._local.connection = connection
+        return connection
+
+    def load(self, codes):
+        """Indexed records for station codes.
+
+        Returns:
+            dict: station_code -> record with FIELDS, 'ddy_mtime' and
+            'stat_mtime'; records of other parser versions are skipped.
+        """
+        connection = self._connect()
+        names = ['station_code', 'ddy_mtime', 'stat_mtime'] + FIELDS
+        records = {}
+        codes = list(codes)
+        for i in range(0, len(codes), 500):
+            chunk = codes[i:i + 500]
+            query = 'SELECT %s FROM design WHERE version = ? AND ' \
+                'station_code IN (%s)' % (
+                    ', '.join(_column(j) for j in names),
+                    ', '.join('?' * len(chunk)))
+            for row in connection.execute(query, [VERSION] + chunk):
+                record = dict(zip(names, row))
+                records[str(record.pop('station_code'))] = record
+        return records
+
+    def store(self, records):
+        """Save records in one transaction.
+
+        Args:
+            records (dict): station_code -> record as returned by load.
+        """
+        names = ['station_code', 'version', 'ddy_mtime', 'stat_mtime'] + \
+            FIELDS
+        query = 'INSERT OR REPLACE INTO design (%s) VALUES (%s)' % (
+            ', '.join(_column(i) for i in names), ', '.join('?' * len(names)))
+        rows = [[code, VERSION, record['ddy_mtime'], record['stat_mtime']] +
+                [record[i] for i in FIELDS]
+                for code, record in records.items()]
+        connection = self._connect()
+        with connection:
+            connection.executemany(query, rows)
+
+    def codes(self):
+        """station codes with records of the current parser version."""
+        return [str(i[0]) for i in self._connect().execute(
+            'SELECT station_code FROM design WHERE version = ?', [VERSION])]
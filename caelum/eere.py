@@ -9,6 +9,10 @@ Examples:
     >>> sum([int(i['GHI (W/m^2)']) for i in EPWdata('418830')])
     1741512
 
+    The same, parsed into columns
+    >>> int(load_epw('418830', ['GHI (W/m^2)'])['GHI (W/m^2)'].sum())
+    1741512
+
     Minimum Design Temperature
     >>> minimum('418830')
     8.8
@@ -23,11 +27,20 @@ from __future__ import absolute_import
 from __future__ import print_function
 import csv
 import datetime
+import collections
+import itertools
+import multiprocessing
+import os
+import numpy as np
 import pytz
 import re
 from geopy import geocoders
-from .tools import download_extract
+from .tools import download_extract, csv_columns, write_atomic, \
+    EERE_STATIONS
+from .cache import cached
 from . import env
+from . import design
+from . import timeaxis
 import logging
 logger = logging.getLogger(__name__)
 
@@ -53,32 +66,120 @@ DATA_EXTENTIONS = {'SWERA': 'epw',
                    'stat': 'stat',
                    'ddy': 'ddy'}
 
-
-def _muck_w_date(record):
-    """muck with the date because EPW starts counting from 1 and goes to 24."""
+EPW_FIELDS = ["Year", "Month", "Day", "Hour", "Minute", "DS",
+              "Dry-bulb (C)", "Dewpoint (C)", "Relative Humidity",
+              "Pressure (Pa)", "ETR (W/m^2)", "ETRN (W/m^2)",
+              "HIR (W/m^2)", "GHI (W/m^2)", "DNI (W/m^2)",
+              "DHI (W/m^2)", "GHIL (lux)", "DNIL (lux)", "DFIL (lux)",
+              "Zlum (Cd/m2)", "Wdir (degrees)", "Wspd (m/s)",
+              "Ts cover", "O sky cover", "CeilHgt (m)",
+              "Present Weather", "Pw codes", "Pwat (cm)",
+              "AOD (unitless)", "Snow Depth (cm)",
+              "Days since snowfall"]
+
+DESIGN_INDEX = 'design_conditions.sqlite'
+DESIGN_TABLE = 'design_conditions.npz'
+_DESIGN_INDEXES = {}
+# (WEATHER_DATA_PATH, station_code) -> indexed design record
+_DESIGN = {}
+
+# derived fields available to EPWdata(fields=...)
+TIME_FIELDS = ['datetime', 'utc_datetime']
+RECORD_TYPES = ['dict', 'tuple', 'namedtuple']
+
+# bump when _parse_epw changes to invalidate cached columns
+EPW_CACHE_VERSION = 1
+
+# column types for EPWdata.to_arrays, float32 unless listed
+EPW_DTYPES = {'Year': np.int16,
+              'Month': np.int16,
+              'Day': np.int16,
+              'Hour': np.int16,
+              'Minute': np.int16,
+              'Present Weather': np.int16,
+              'DS': str,
+              'Pw codes': str}
+
+
+def _epw_datetime(year, month, day, hour, minute):
+    """local datetime from EPW date fields (strings or ints)."""
     # minute 60 is actually minute 0?
-    temp_d = datetime.datetime(int(record['Year']), int(record['Month']),
-                               int(record['Day']), int(record['Hour']) % 24,
-                               int(record['Minute']) % 60)
-    d_off = int(record['Hour'])//24   # hour 24 is actually hour 0
+    temp_d = datetime.datetime(int(year), int(month), int(day),
+                               int(hour) % 24, int(minute) % 60)
+    d_off = int(hour)//24   # hour 24 is actually hour 0
     if d_off > 0:
         temp_d += datetime.timedelta(days=d_off)
     return temp_d
 
 
+def _muck_w_date(record):
+    """muck with the date because EPW starts counting from 1 and goes to 24."""
+    return _epw_datetime(record['Year'], record['Month'], record['Day'],
+                         record['Hour'], record['Minute'])
+
+
+def _converter(field):
+    """python type for an EPW field in lean records."""
+    dtype = EPW_DTYPES.get(field, np.float32)
+    if dtype == str:
+        return str
+    if dtype == np.int16:
+        return int
+    return float
+
+
+def _record_type(fields):
+    """namedtuple for a field projection, names made identifiers."""
+    names = [re.sub('\\W+', '_', i).strip('_') for i in fields]
+    return collections.namedtuple('EPWRecord', names, rename=True)
+
+
+def _parse_epw(filename, fields=None):
+    """EPW fields and local 'datetime' as columns.
+
+    Args:
+        filename (str): EPW file
+        fields (list): fields to parse, date fields are always included.
+    """
+    if fields is None:
+        fields = EPW_FIELDS
+    date_fields = EPW_FIELDS[:5]
+    wanted = [EPW_FIELDS.index(i) for i in set(fields) | set(date_fields)]
+    with open(filename) as epw:
+        for _ in range(8):
+            epw.readline()
+        text = epw.read()
+    # extra columns of newer EPW files are dropped
+    numeric = [i for i in wanted if EPW_DTYPES.get(EPW_FIELDS[i]) != str]
+    strings = [i for i in wanted if i not in numeric]
+    parsed = csv_columns(text, numeric, strings)
+    columns = {}
+    for i in wanted:
+        name = EPW_FIELDS[i]
+        columns[name] = parsed[i].astype(EPW_DTYPES.get(name, np.float32))
+    columns['datetime'] = timeaxis.epw_times(*[columns[i]
+                                                for i in date_fields])
+    return columns
+
+
 def _eere_url(station_code):
     """build EERE EPW url for station code."""
     baseurl = 'http://apps1.eere.energy.gov/buildings/energyplus/weatherdata/'
     return baseurl + _station_info(station_code)['url']
 
 
+def _download(station_code):
+    """download and extract the station's epw, ddy and stat files."""
+    return download_extract(_eere_url(station_code),
+                            set(DATA_EXTENTIONS.values()))
+
+
 def _station_info(station_code):
     """filename based meta data for a station code."""
-    url_file = open(env.SRC_PATH + '/eere.csv')
-    for line in csv.DictReader(url_file):
-        if line['station_code'] == station_code:
-            return line
-    raise KeyError('Station not found')
+    try:
+        return EERE_STATIONS[station_code]
+    except KeyError:
+        raise KeyError('Station not found')
 
 
 def _basename(station_code, fmt=None):
@@ -91,6 +192,181 @@ def _basename(station_code, fmt=None):
     return basename
 
 
+def _mtime(path):
+    """modification time or None if missing."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _design_paths(station_code):
+    """local .ddy and .stat paths for a station."""
+    return ['%s/%s' % (env.WEATHER_DATA_PATH, _basename(station_code, i))
+            for i in ['ddy', 'stat']]
+
+
+def _design_index():
+    """design condition index for the current WEATHER_DATA_PATH."""
+    path = '%s/%s' % (env.WEATHER_DATA_PATH, DESIGN_INDEX)
+    if path not in _DESIGN_INDEXES:
+        _DESIGN_INDEXES[path] = design.DesignIndex(path)
+    return _DESIGN_INDEXES[path]
+
+
+def design_conditions(codes, download=False):
+    """Design conditions for many stations.
+
+    Values come from memory, then the persistent index, and only then
+    from parsing the station's .ddy and .stat files; see `caelum.design`
+    for the fields.  Values are parsed again if a file changed.
+
+    Args:
+        codes (list): Weather Station Codes
+        download (bool): download missing station files.
+
+    Returns:
+        dict: station_code -> dict of design.FIELDS in degrees Celcius,
+        None where not found
+    """
+    results = {}
+    misses = {}
+    for code in codes:
+        ddy, stat = _design_paths(code)
+        mtimes = (_mtime(ddy), _mtime(stat))
+        if download and mtimes[0] is None:
+            logger.info("File not found")
+            _download(code)
+            mtimes = (_mtime(ddy), _mtime(stat))
+        if mtimes == (None, None):
+            results[code] = design.parse()
+            continue
+        record = _DESIGN.get((env.WEATHER_DATA_PATH, code))
+        if record is None or \
+                (record['ddy_mtime'], record['stat_mtime']) != mtimes:
+            misses[code] = (ddy, stat, mtimes)
+        else:
+            results[code] = dict((i, record[i]) for i in design.FIELDS)
+    if not misses:
+        return results
+    index = _design_index()
+    indexed = index.load(misses)
+    parsed = {}
+    for code, (ddy, stat, mtimes) in misses.items():
+        record = indexed.get(code)
+        if record is None or \
+                (record['ddy_mtime'], record['stat_mtime']) != mtimes:
+            record = design.parse(ddy, stat)
+            record['ddy_mtime'], record['stat_mtime'] = mtimes
+            parsed[code] = record
+        _DESIGN[(env.WEATHER_DATA_PATH, code)] = record
+        results[code] = dict((i, record[i]) for i in design.FIELDS)
+    if parsed:
+        index.store(parsed)
+    return results
+
+
+def _parse_design(job):
+    """pool worker, (code, ddy, stat) -> (code, record, error)."""
+    code, ddy, stat = job
+    try:
+        return code, design.parse(ddy, stat), None
+    except Exception as err:
+        return code, None, '%s: %s' % (type(err).__name__, err)
+
+
+def build_design_table(codes=None, output=None, processes=None,
+                       download=False, chunk=200):
+    """Design conditions for the EERE catalog as one columnar table.
+
+    Stations are parsed from local .ddy and .stat files by a process
+    pool.  Parsed stations are saved to the design condition index as the
+    run goes, so an interrupted run resumes where it stopped and a repeat
+    run parses only changed files.  A failing station is logged and
+    reported, it does not stop the run.
+
+    Args:
+        codes (list): Weather Station Codes. Default all of eere.csv.
+        output (str): .npz file, default design_conditions.npz in
+            WEATHER_DATA_PATH.
+        processes (int): worker processes, default one per cpu, 1 parses
+            in this process.
+        download (bool): download missing station files first, serially.
+        chunk (int): stations per index write and progress message.
+
+    Returns:
+        tuple: (table, errors).  table is a dict of 'station_code' and
+        design.FIELDS arrays in degrees Celcius, NaN where not found.
+        errors is station_code -> message for stations left out.
+    """
+    if codes is None:
+        codes = [i for i in EERE_STATIONS if i]
+    if output is None:
+        output = '%s/%s' % (env.WEATHER_DATA_PATH, DESIGN_TABLE)
+    index = _design_index()
+    indexed = index.load(codes)
+    records = {}
+    errors = {}
+    mtimes = {}
+    jobs = []
+    for code in codes:
+        try:
+            ddy, stat = _design_paths(code)
+            if download and not os.path.exists(ddy):
+                _download(code)
+        except Exception as err:
+            errors[code] = '%s: %s' % (type(err).__name__, err)
+            logger.warning('%s: %s', code, errors[code])
+            continue
+        mtimes[code] = (_mtime(ddy), _mtime(stat))
+        record = indexed.get(code)
+        if mtimes[code] == (None, None):
+            errors[code] = 'no .ddy or .stat file'
+        elif record is not None and \
+                (record['ddy_mtime'], record['stat_mtime']) == mtimes[code]:
+            records[code] = record
+        else:
+            jobs.append((code, ddy, stat))
+    logger.info('%s stations indexed, %s to parse, %s missing', len(records),
+                len(jobs), len(errors))
+
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_parse_design, jobs, chunksize=16)
+    else:
+        results = itertools.imap(_parse_design, jobs)
+    parsed = {}
+    try:
+        for done, (code, record, error) in enumerate(results, 1):
+            if error:
+                logger.warning('%s: %s', code, error)
+                errors[code] = error
+            else:
+                record['ddy_mtime'], record['stat_mtime'] = mtimes[code]
+                parsed[code] = records[code] = record
+            if len(parsed) >= chunk:
+                index.store(parsed)
+                parsed = {}
+            if done % chunk == 0 or done == len(jobs):
+                logger.info('parsed %s of %s stations', done, len(jobs))
+    finally:
+        if parsed:
+            index.store(parsed)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    found = [i for i in codes if i in records]
+    table = {'station_code': np.array(found, dtype=str)}
+    for field in design.FIELDS:
+        table[field] = np.array([records[i][field] for i in found],
+                                dtype=np.float64)
+    write_atomic(output, lambda npz: np.savez(npz, **table))
+    logger.info('wrote %s stations to %s', len(found), output)
+    return table, errors
+
+
 def twopercent(station_code):
     """Two percent high design temperature for a location.
 
@@ -102,34 +378,9 @@ def twopercent(station_code):
     Returns:
         float degrees Celcius
     """
+    conditions = design_conditions([station_code])[station_code]
     # (DB=>MWB) 2%, MaxDB=
-    temp = None
-    try:
-        fin = open('%s/%s' % (env.WEATHER_DATA_PATH,
-                              _basename(station_code, 'ddy')))
-        for line in fin:
-            value = re.search("""2%, MaxDB=(\\d+\\.\\d*)""", line)
-            if value:
-                temp = float(value.groups()[0])
-    except IOError:
-        pass
-
-    if not temp:
-        # (DB=>MWB) 2%, MaxDB=
-        try:
-            fin = open('%s/%s' % (env.WEATHER_DATA_PATH,
-                                  _basename(station_code, 'stat')))
-            flag = 0
-            tdata = []
-            for line in fin:
-                if line.find('2%') is not -1:
-                    flag = 3
-                if flag > 0:
-                    tdata.append(line.split('\t'))
-                    flag -= 1
-            temp = float(tdata[2][5].strip())
-        except IOError:
-            pass
+    temp = conditions['cooling_2'] or conditions['stat_twopercent']
     if temp:
         return temp
     else:
@@ -147,33 +398,12 @@ def minimum(station_code):
     Returns:
         float degrees Celcius
     """
-    temp = None
-    fin = None
-    try:
-        fin = open('%s/%s' % (env.WEATHER_DATA_PATH,
-                              _basename(station_code, 'ddy')))
-    except IOError:
-        logger.info("File not found")
-        download_extract(_eere_url(station_code))
-        fin = open('%s/%s' % (env.WEATHER_DATA_PATH,
-                              _basename(station_code, 'ddy')))
-    for line in fin:
-        value = re.search('Max Drybulb=(-?\\d+\\.\\d*)', line)
-        if value:
-            temp = float(value.groups()[0])
-    if not temp:
-        try:
-            fin = open('%s/%s' % (env.WEATHER_DATA_PATH,
-                                  _basename(station_code, 'stat')))
-            for line in fin:
-                if line.find('Minimum Dry Bulb') is not -1:
-                    return float(line[37:-1].split('\xb0')[0])
-        except IOError:
-            pass
-    if temp:
-        return temp
-    else:
-        raise Exception("Error: Minimum Temperature not found")
+    conditions = design_conditions([station_code], True)[station_code]
+    if conditions['extreme_min']:
+        return conditions['extreme_min']
+    if conditions['stat_minimum'] is not None:
+        return conditions['stat_minimum']
+    raise Exception("Error: Minimum Temperature not found")
 
 
 class EPWdata(object):
@@ -186,32 +416,33 @@ class EPWdata(object):
 
     """
 
-    def __init__(self, station_code, DST=False):
+    def __init__(self, station_code, DST=False, fields=None, record='dict'):
         """Data for a weather station.
 
+        By default each record is a dict of every field as a string plus
+        'datetime' and 'utc_datetime'.  With fields only those columns are
+        parsed, typed (int, float or str) and returned; the time fields
+        are computed only if listed.
+
         Args:
             station_code (str): Station code of weather station
             DST (bool): Weather timestands in daylight savings. Default False
+            fields (list): EPW fields and/or TIME_FIELDS. Default all.
+            record (str): 'dict', 'tuple' or 'namedtuple' records when
+                fields is given; tuples follow the order of fields.
         """
+        if record not in RECORD_TYPES:
+            raise ValueError('record must be one of %s' % RECORD_TYPES)
         filename = env.WEATHER_DATA_PATH + '/' + _basename(station_code)
+        self.filename = filename
         self.csvfile = None
         try:
             self.csvfile = open(filename)
         except IOError:
             logger.info("File not found")
-            download_extract(_eere_url(station_code))
+            _download(station_code)
             self.csvfile = open(filename)
         logging.debug('opened %s', self.csvfile.name)
-        fieldnames = ["Year", "Month", "Day", "Hour", "Minute", "DS",
-                      "Dry-bulb (C)", "Dewpoint (C)", "Relative Humidity",
-                      "Pressure (Pa)", "ETR (W/m^2)", "ETRN (W/m^2)",
-                      "HIR (W/m^2)", "GHI (W/m^2)", "DNI (W/m^2)",
-                      "DHI (W/m^2)", "GHIL (lux)", "DNIL (lux)", "DFIL (lux)",
-                      "Zlum (Cd/m2)", "Wdir (degrees)", "Wspd (m/s)",
-                      "Ts cover", "O sky cover", "CeilHgt (m)",
-                      "Present Weather", "Pw codes", "Pwat (cm)",
-                      "AOD (unitless)", "Snow Depth (cm)",
-                      "Days since snowfall"]
         station_meta = self.csvfile.readline().split(',')
         self.station_name = station_meta[1]
         self.CC = station_meta[3]
@@ -230,7 +461,33 @@ class EPWdata(object):
         dummy = ""
         for _ in range(7):
             dummy += self.csvfile.readline()
-        self.epw_data = csv.DictReader(self.csvfile, fieldnames=fieldnames)
+        self.fields = fields
+        self.record = record
+        if fields is None:
+            self.epw_data = csv.DictReader(self.csvfile,
+                                           fieldnames=EPW_FIELDS)
+        else:
+            self._lean_setup(fields, record)
+
+    def _lean_setup(self, fields, record):
+        """readers and converters for a field projection."""
+        for field in fields:
+            if field not in EPW_FIELDS and field not in TIME_FIELDS:
+                raise KeyError('unknown EPW field %s' % field)
+        self.epw_data = csv.reader(self.csvfile)
+        self._columns = [(EPW_FIELDS.index(i), _converter(i))
+                         for i in fields if i in EPW_FIELDS]
+        self._times = [i for i in fields if i in TIME_FIELDS]
+        # position of each output field in the parsed values
+        order = [i for i in fields if i in EPW_FIELDS] + self._times
+        self._order = [order.index(i) for i in fields]
+        self._reorder = order != list(fields)
+        if record == 'namedtuple':
+            self._make = _record_type(fields)._make
+        elif record == 'dict':
+            self._make = lambda values: dict(zip(fields, values))
+        else:
+            self._make = tuple
 
     def __iter__(self):
         """iterate."""
@@ -240,8 +497,10 @@ class EPWdata(object):
         """Weather data record.
 
         Yields:
-            dict
+            dict, or tuple/namedtuple with fields
         """
+        if self.fields is not None:
+            return self._lean_next()
         record = self.epw_data.next()
         local_time = _muck_w_date(record)
         record['datetime'] = local_time
@@ -256,9 +515,79 @@ class EPWdata(object):
         return record
         # 'LOCATION,BEEK,-,NLD,IWEC Data,063800,50.92,5.78,1.0,116.0'
 
+    def _lean_next(self):
+        """record of the projected fields only."""
+        row = self.epw_data.next()
+        values = [convert(row[i]) for i, convert in self._columns]
+        if self._times:
+            local_time = _epw_datetime(*row[:5])
+            for field in self._times:
+                if field == 'datetime':
+                    values.append(local_time)
+                elif self.DST:
+                    values.append(self.local_tz.localize(local_time)
+                                  .astimezone(pytz.UTC))
+                else:
+                    values.append(local_time -
+                                  datetime.timedelta(hours=self.TZ))
+        if self._reorder:
+            values = [values[i] for i in self._order]
+        return self._make(values)
+
+    def to_arrays(self, fields=None, cache=True):
+        """Whole file as columns, without building a record per hour.
+
+        Reads the file independently of iteration.  With cache the whole
+        file is parsed once and later calls memory-map the columns from
+        a sidecar cache, see `caelum.cache`.  Cached loads are well over
+        10x faster than iterating records; a text parse is about 3x for
+        every field and 8 to 11x for a few, see `tests.bench`.
+
+        Args:
+            fields (list): EPW fields to return. Default all.
+            cache (bool): use and fill the binary column cache.
+
+        Returns:
+            dict: field -> array (float32 or int16, str for DS and Pw
+            codes) plus datetime64[m] 'datetime' and 'utc_datetime'.
+            Cached arrays are read only.
+        """
+        if fields is None:
+            fields = EPW_FIELDS
+        if cache:
+            parsed = cached(self.filename, _parse_epw, EPW_CACHE_VERSION,
+                            list(fields) + ['datetime'])
+        else:
+            parsed = _parse_epw(self.filename, fields)
+        columns = dict((i, parsed[i]) for i in fields)
+        local_time = parsed['datetime']
+        columns['datetime'] = local_time
+        if self.DST:
+            columns['utc_datetime'] = np.array(
+                [self.local_tz.localize(i).astimezone(pytz.UTC)
+                 .replace(tzinfo=None) for i in local_time.astype(object)],
+                dtype='datetime64[m]')
+        else:
+            columns['utc_datetime'] = timeaxis.to_utc(local_time, self.TZ)
+        return columns
+
     def __del__(self):
         """clean up open files."""
-        self.csvfile.close()
+        if getattr(self, 'csvfile', None) is not None:
+            self.csvfile.close()
+
+
+def load_epw(station_code, fields=None):
+    """EPW weather data for a station as columns.
+
+    Args:
+        station_code (str): Station code of weather station
+        fields (list): EPW fields to parse. Default all.
+
+    Returns:
+        dict: field -> array, see EPWdata.to_arrays
+    """
+    return EPWdata(station_code).to_arrays(fields)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
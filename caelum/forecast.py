@@ -1,22 +1,109 @@
-"""Forecast IO API."""
+"""Forecast IO API.
+
+Responses are cached per rounded location and time bucket, so data,
+hourly and current for a place share one metered API call.  Requests
+for many places run concurrently, spaced by LIMIT or a rate given per
+call.
+
+Example:
+    >>> columns = hourly_many([(40., -78.), (39.74, -105.18)])
+"""
+import copy
 import json
-import urllib2
 import os
 import datetime
+import threading
+import time
+import numpy as np
+from .tools import fetch_many, RateLimit
 
 APIKEY = os.getenv('FORECASTIO')
 if not APIKEY:
     print "WARNING: forecast.io key not set."
     print "Realtime weather data not availible."
 
+BASEURL = 'https://api.forecast.io/forecast/%s/%s,%s?solar'
+# seconds responses are reused, and the bucket they are keyed by
+CACHE_TTL = 900
+# decimal places of cache keys
+PRECISION = 3
+# API calls per second
+RATE = 10
+LIMIT = RateLimit(RATE)
+
+SOLAR = [('ghi', 'GHI (W/m^2)'), ('dni', 'DNI (W/m^2)'),
+         ('dhi', 'DHI (W/m^2)'), ('etr', 'ETR (W/m^2)')]
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _key(place, now):
+    """cache key of a place for the time bucket of now."""
+    lat, lon = place
+    return (round(lat, PRECISION), round(lon, PRECISION),
+            int(now // CACHE_TTL))
+
+
+def _url(place):
+    """forecast url for place."""
+    lat, lon = place
+    return BASEURL % (APIKEY, lat, lon)
+
+
+def _responses(places, ttl, rate):
+    """decoded responses for places, shared with the cache."""
+    limit = LIMIT if rate is None else RateLimit(rate)
+    now = time.time()
+    keys = [_key(place, now) for place in places]
+    missing = {}
+    with _CACHE_LOCK:
+        for key in [i for i in _CACHE if i[2] != int(now // CACHE_TTL)]:
+            del _CACHE[key]
+        for key, place in zip(keys, places):
+            entry = _CACHE.get(key)
+            if (entry is None or now - entry[0] >= ttl) and \
+                    key not in missing:
+                missing[key] = place
+    if missing:
+        pending = missing.items()
+        responses = fetch_many([_url(place) for _, place in pending],
+                               limit=limit)
+        with _CACHE_LOCK:
+            for (key, _), response in zip(pending, responses):
+                _CACHE[key] = (now, json.loads(response.body))
+    with _CACHE_LOCK:
+        return [_CACHE[key][1] for key in keys]
+
+
+def data_many(places, ttl=CACHE_TTL, rate=None):
+    """get forecast data for many places.
+
+    Places missing from the cache are fetched concurrently, started no
+    faster than LIMIT allows.
+
+    Args:
+        places (list): (lat, lon) tuples.
+        ttl (float): maximum age in seconds of cached responses.
+        rate (float): API calls per second for this call instead of the
+            shared LIMIT.
+
+    Returns:
+        list: decoded response for each place, a copy the caller may
+        change.
+    """
+    return [copy.deepcopy(i) for i in _responses(places, ttl, rate)]
+
+
+def clear_cache():
+    """forget cached responses."""
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
 
 def data(place):
     """get forecast data."""
-    lat, lon = place
-    url = "https://api.forecast.io/forecast/%s/%s,%s?solar" % (APIKEY, lat,
-                                                               lon)
-    w_data = json.loads(urllib2.urlopen(url).read())
-    return w_data
+    return data_many([place])[0]
 
 
 def mangle(data_point):
@@ -38,31 +125,58 @@ def mangle(data_point):
         temp_dict['ETR (W/m^2)'] = 0.0
     return temp_dict
 
+
+def mangle_many(data_points):
+    """mangle many data points into columns.
+
+    The columns hold what mangle gives for each point.  Numeric fields
+    are float arrays, NaN where a point lacks the field; other fields are
+    object arrays, None where missing.
+
+    Returns:
+        dict: field -> array, 'utc_datetime' as datetime64[s]
+    """
+    names = set()
+    for point in data_points:
+        names.update(point)
+    names.discard('solar')
+    columns = {}
+    for name in names:
+        values = [point.get(name) for point in data_points]
+        try:
+            columns[name] = np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            columns[name] = np.array(values, dtype=object)
+    columns['utc_datetime'] = np.array(
+        [point['time'] for point in data_points],
+        dtype=np.int64).astype('datetime64[s]')
+    solar = [point.get('solar', {}) for point in data_points]
+    for key, name in SOLAR:
+        columns[name] = np.array([i.get(key, 0.0) for i in solar],
+                                 dtype=np.float64)
+    return columns
+
 # these functions should probably be class methods
 
 
 def hourly(place):
     """return data as list of dicts with all data filled in."""
     # time in utc?
-    lat, lon = place
-    url = "https://api.forecast.io/forecast/%s/%s,%s?solar" % (APIKEY, lat,
-                                                               lon)
-    w_data = json.loads(urllib2.urlopen(url).read())
-    hourly_data = w_data['hourly']['data']
-    mangled = []
-    for i in hourly_data:
-        mangled.append(mangle(i))
-    return mangled
+    return [mangle(i) for i in data(place)['hourly']['data']]
+
+
+def hourly_many(places, ttl=CACHE_TTL, rate=None):
+    """hourly forecasts for many places as columns.
+
+    See mangle_many for the columns and data_many for the arguments.
+    """
+    return [mangle_many(i['hourly']['data'])
+            for i in _responses(places, ttl, rate)]
 
 
 def current(place):
     """return data as list of dicts with all data filled in."""
-    lat, lon = place
-    url = "https://api.forecast.io/forecast/%s/%s,%s?solar" % (APIKEY, lat,
-                                                               lon)
-    w_data = json.loads(urllib2.urlopen(url).read())
-    currently = w_data['currently']
-    return mangle(currently)
+    return mangle(data(place)['currently'])
 
 if __name__ == '__main__':
     LAT, LON = (40., -78.0)
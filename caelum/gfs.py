@@ -1,21 +1,64 @@
 """Download GFS grib2 files.
 
+Only the messages for the wanted products and levels are fetched, as
+byte ranges read from the .idx inventory; small gaps between them are
+fetched too when that saves a request (see plan).  Ranges are fetched in
+parallel over pooled connections and written at their place in a
+preallocated file, and a manifest of completed segments lets an
+interrupted download resume.
+
 Example:
     Download latest to ~/gfs/[GFS TIMESTAMP]
 
     >>> gfs.download(datetime.datetime.now(),gfs.pgrb2)
 
+    Several forecast offsets at once
+
+    >>> gfs.download_many([datetime.datetime.now()], range(0, 13, 3))
+
+    Temperature series at a place, values shaped (site, time, variable)
+
+    >>> series = gfs.point_series(datetime.datetime.now(),
+    ...                           [(39.74, -105.18)], ['TMP'],
+    ...                           ['2 m above ground'])
+
+    Hourly by monotone cubic interpolation
+
+    >>> hourly = gfs.resample(series, '1H', 'pchip')
+
 """
 # Copyright (C) 2015 Nathan Charles
 #
 # This program is free software. See terms in LICENSE file.
 
-import urllib2
+import collections
 import datetime
 import csv
+import hashlib
+import json
 import os
+import struct
+import threading
+import time
+import logging
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from .tools import fetch, fetch_many, write_atomic, FetchError
+from . import grib2
+from . import timeaxis
+logger = logging.getLogger(__name__)
 
 DATA_PATH = os.environ['HOME'] + "/gfs"
+BASEURL = 'http://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod/gfs.%s/%s'
+# seconds a saved .idx is used before revalidating with the server
+INVENTORY_TTL = 3600
+# bytes over-fetched rather than make another range request, see plan
+REQUEST_COST = 2 ** 15
+
+Message = collections.namedtuple(
+    'Message', 'number offset date variable level forecast end')
+Plan = collections.namedtuple('Plan', 'segments bytes wanted requests')
+Series = collections.namedtuple('Series', 'times variables values')
 
 
 def _verify_path(path):
@@ -30,14 +73,14 @@ _verify_path(DATA_PATH)
 
 def baseurl(gfs_timestamp, filename):
     """build url."""
-    url = 'http://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod/gfs.%s/'\
-          '%s' % (gfs_timestamp, filename)
-    return url
+    return BASEURL % (gfs_timestamp, filename)
 
 
 def _join(segments):
     """simply list by joining adjacent segments."""
     new = []
+    if not segments:
+        return new
     start = segments[0][0]
     end = segments[0][1]
     for i in range(len(segments)-1):
@@ -49,40 +92,299 @@ def _join(segments):
     return new
 
 
-def _filter_messages(messages, products=None, levels=None):
+class Inventory(object):
+
+    """Typed .idx inventory of a grib2 file.
+
+    Messages are indexed by variable and level, so selecting products and
+    levels is a lookup.  Fields keep the .idx column order; `end` is the
+    offset of the next message, None for the last.
+
+    Args:
+        messages (list): Message tuples in file order.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.variables = collections.defaultdict(list)
+        self.levels = collections.defaultdict(list)
+        for i, message in enumerate(messages):
+            self.variables[message.variable].append(i)
+            self.levels[message.level].append(i)
+
+    @classmethod
+    def parse(cls, text):
+        """Inventory from .idx text.
+
+        Sub-messages such as 54.1 and 54.2 share an offset; they all end
+        at the next larger offset.
+        """
+        rows = [i for i in csv.reader(text.splitlines(), delimiter=':') if i]
+        ends = [None] * len(rows)
+        end = None
+        for i in range(len(rows) - 1, -1, -1):
+            ends[i] = end
+            if i and rows[i - 1][1] != rows[i][1]:
+                end = int(rows[i][1])
+        messages = []
+        for row, end in zip(rows, ends):
+            messages.append(Message(
+                row[0], int(row[1]),
+                datetime.datetime.strptime(row[2][2:], '%Y%m%d%H'), row[3],
+                row[4], row[5], end))
+        return cls(messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def select(self, products=None, levels=None):
+        """messages for products and levels, all if None or empty."""
+        selected = None
+        for wanted, index in [(products, self.variables),
+                              (levels, self.levels)]:
+            if wanted:
+                found = set()
+                for i in wanted:
+                    found.update(index.get(i, ()))
+                selected = found if selected is None else selected & found
+        if selected is None:
+            return list(self.messages)
+        return [self.messages[i] for i in sorted(selected)]
+
+    def segments(self, products=None, levels=None):
+        """joined (start, end) byte segments for products and levels."""
+        segments = []
+        for message in self.select(products, levels):
+            segment = (message.offset, message.end)
+            if not segments or segments[-1] != segment:
+                segments.append(segment)
+        return _join(segments)
+
+
+def _filter_messages(inventory, products=None, levels=None):
     """filter messages for desired products and levels."""
-    if products is None:
-        products = []
-    if levels is None:
-        levels = []
-    segments = []
-    bounds = len(messages)
-    for i, message in enumerate(messages):
-        if (message[3] in products or len(products) == 0) and \
-                (message[4] in levels or len(levels) == 0):
-            start = int(message[1])
-            if i == (bounds - 1):
-                end = None
+    return inventory.segments(products, levels)
+
+
+def _range(start, end):
+    """byte range spec for a segment, end exclusive or None for the rest."""
+    if end is None:
+        return '%s-' % start
+    return '%s-%s' % (start, end - 1)
+
+
+def _content_range(value):
+    """(first, last) byte from a Content-Range header."""
+    first, last = value.split()[1].split('/')[0].split('-')
+    return int(first), int(last)
+
+
+def _parts(response):
+    """(first byte, data) for each part of a ranged response."""
+    if response.status == 200:
+        return [(0, response.body)]
+    content_type = response.headers.get('content-type', '')
+    if not content_type.startswith('multipart/byteranges'):
+        return [(_content_range(response.headers['content-range'])[0],
+                 response.body)]
+    boundary = '--' + content_type.split('boundary=')[1].strip('"')
+    parts = []
+    for part in response.body.split(boundary)[1:]:
+        head, _, data = part.partition('\r\n\r\n')
+        for line in head.splitlines():
+            if line.lower().startswith('content-range:'):
+                first, last = _content_range(line.split(':', 1)[1])
+                parts.append((first, data[:last - first + 1]))
+    return parts
+
+
+class _Window(object):
+
+    """file-like writer at a fixed offset of a file shared by threads.
+
+    The sha1 of the data is kept for the manifest.  Fetcher retries seek
+    back to 0 and truncate; the retry overwrites the same bytes so
+    truncate does nothing.
+    """
+
+    def __init__(self, target, lock, offset):
+        self.target = target
+        self.lock = lock
+        self.offset = offset
+        self.position = 0
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        with self.lock:
+            self.target.seek(self.offset + self.position)
+            self.target.write(data)
+        self.position += len(data)
+        self.sha1.update(data)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = position
+        if position == 0:
+            self.sha1 = hashlib.sha1()
+
+    def truncate(self):
+        pass
+
+
+def _write_parts(response, target, lock, batch):
+    """write segments of a buffered response at their file offsets.
+
+    Returns:
+        list: (start, data) written
+    """
+    parts = _parts(response)
+    written = []
+    for start, end, position in batch:
+        for first, data in parts:
+            if first <= start < first + len(data):
+                stop = len(data) if end is None else end - first
+                segment = data[start - first:stop]
+                with lock:
+                    target.seek(position)
+                    target.write(segment)
+                written.append((start, segment))
+                break
+        else:
+            raise FetchError('Range %s missing' % _range(start, end),
+                             response.url, response.status)
+    return written
+
+
+class _Manifest(object):
+
+    """Completed segments of a download, saved as <file>.manifest.
+
+    The manifest names the url and the planned segments.  A later
+    download of the same plan keeps the segments whose bytes still match
+    their sha1, so only missing or damaged segments are fetched again.
+
+    Args:
+        filename (str): downloaded file.
+        url (str): source url.
+        segments (list): planned (start, end) segments.
+    """
+
+    def __init__(self, filename, url, segments):
+        self.path = filename + '.manifest'
+        self.url = url
+        self.plan = [list(i) for i in segments]
+        self.done = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest['url'] != url or manifest['plan'] != self.plan:
+                return
+            with open(filename, 'rb') as target:
+                for start, (position, length, digest) in \
+                        manifest['done'].items():
+                    target.seek(position)
+                    if hashlib.sha1(target.read(length)).hexdigest() == \
+                            digest:
+                        self.done[start] = [position, length, digest]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.done = {}
+
+    def record(self, segments):
+        """save completed (start, position, length, sha1) segments."""
+        with self.lock:
+            for start, position, length, digest in segments:
+                self.done[str(start)] = [position, length, digest]
+            manifest = {'url': self.url, 'plan': self.plan,
+                        'done': self.done}
+            write_atomic(self.path, lambda manifest_file: json.dump(
+                manifest, manifest_file))
+
+    def __contains__(self, start):
+        return str(start) in self.done
+
+
+def _fetch_files(files, multirange=1):
+    """download segments of many files concurrently, resuming.
+
+    Each file is preallocated and every segment is written at its place,
+    so segments can arrive in any order.  Completed segments are recorded
+    in the file's manifest as they finish; segments a previous run
+    completed and that still verify are not fetched again.
+
+    Args:
+        files (list): (filename, url, segments) with segments as returned
+            by _filter_messages.
+        multirange (int): ranges per request, more than 1 uses
+            multipart/byteranges responses.
+    """
+    lock = threading.Lock()
+    targets = []
+    requests = []
+    jobs = []
+    try:
+        for filename, url, segments in files:
+            manifest = _Manifest(filename, url, segments)
+            placed = []
+            position = 0
+            for start, end in segments:
+                if start not in manifest:
+                    placed.append((start, end, position))
+                if end is not None:
+                    position += end - start
+            if manifest.done:
+                logger.info('Resuming %s, %s of %s segments to fetch',
+                            filename, len(placed), len(segments))
+                target = open(filename, 'r+b')
             else:
-                end = int(messages[i+1][1])
-            segments.append((start, end))
-    return _join(segments)
+                target = open(filename, 'wb')
+                target.truncate(position)
+            targets.append(target)
+            size = max(1, multirange)
+            for i in range(0, len(placed), size):
+                batch = placed[i:i + size]
+                headers = {'Range': 'bytes=' + ','.join(
+                    _range(start, end) for start, end, _ in batch)}
+                if len(batch) == 1:
+                    # a 200 would write the whole file at this offset
+                    requests.append((url, headers, (206,)))
+                    window = _Window(target, lock, batch[0][2])
+                else:
+                    requests.append((url, headers))
+                    window = None
+                jobs.append((target, batch, manifest, window))
+
+        def done(i, response):
+            """write or check a response and record its segments."""
+            target, batch, manifest, window = jobs[i]
+            if window is None:
+                written = [(start, len(data), hashlib.sha1(data).hexdigest())
+                           for start, data in _write_parts(response, target,
+                                                           lock, batch)]
+            else:
+                written = [(batch[0][0], window.position,
+                            window.sha1.hexdigest())]
+            with lock:
+                target.flush()
+            positions = dict((start, position) for start, _, position
+                             in batch)
+            manifest.record([(start, positions[start], length, digest)
+                             for start, length, digest in written])
+
+        fetch_many(requests, [i[3] for i in jobs], done)
+    finally:
+        for target in targets:
+            target.close()
 
 
-def _download_segments(filename, url, segments):
+def _download_segments(filename, url, segments, multirange=1):
     """download segments into a single file."""
-    gribfile = open(filename, 'w')
-    for start, end in segments:
-        req = urllib2.Request(url)
-        req.add_header('User-Agent',
-                       'caelum/0.1 +https://github.com/nrcharles/caelum')
-        if end:
-            req.headers['Range'] = 'bytes=%s-%s' % (start, end)
-        else:
-            req.headers['Range'] = 'bytes=%s' % (start)
-        opener = urllib2.build_opener()
-        gribfile.write(opener.open(req).read())
-    gribfile.close()
+    _fetch_files([(filename, url, segments)], multirange)
 
 
 def sflux(closest, offset):
@@ -96,9 +398,55 @@ def pgrb2(closest, offset):
     return 'gfs.t%02dz.pgrb2.1p00.f%03d' % (closest, offset)
 
 
+def _run(timestamp, dataset, offset):
+    """(gfs_timestamp, filename) of the closest earlier run."""
+    closest = timestamp.hour//6*6
+    gfs_timestamp = '%s%02d' % (timestamp.strftime('%Y%m%d'), closest)
+    return gfs_timestamp, dataset(closest, offset)
+
+
+def plan(index, products=None, levels=None, request_cost=REQUEST_COST,
+         multirange=1):
+    """Byte ranges to fetch for products and levels.
+
+    Wanted messages that are adjacent are always joined.  A gap between
+    wanted messages is fetched too when it is smaller than request_cost,
+    the bytes one extra range is judged to cost in latency and overhead;
+    0 fetches exactly the wanted messages.
+
+    Args:
+        index (Inventory): file inventory.
+        request_cost (int): bytes worth one range request.
+        multirange (int): byte ranges per request.
+
+    Returns:
+        Plan: segments, bytes planned, bytes wanted and requests.  The
+        size of the last message is unknown and not counted.
+    """
+    wanted = index.segments(products, levels)
+    segments = []
+    for start, end in wanted:
+        if segments and segments[-1][1] is not None and \
+                start - segments[-1][1] < request_cost:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    tail = index.messages[-1].offset if index.messages else 0
+    return Plan(segments, _size(segments, tail), _size(wanted, tail),
+                -(-len(segments) // max(1, multirange)))
+
+
+def _size(segments, tail):
+    """bytes of segments, open ended ones counted up to tail."""
+    return sum((tail if end is None else end) - start
+               for start, end in segments)
+
+
 def download(timestamp, dataset, path=None, products=None,
-             levels=None, offset=0):
-    """save GFS grib file to DATA_PATH.
+             levels=None, offset=0, multirange=1, request_cost=REQUEST_COST):
+    """save GFS grib file to DATA_PATH/<gfs_timestamp>/.
+
+    An interrupted download resumes, see download_many.
 
     Args:
         dataset(function): naming convention function.  eg. pgrb2
@@ -107,42 +455,320 @@ def download(timestamp, dataset, path=None, products=None,
         products(list): TMP, etc. if None downloads all.
         layers(list): surface, etc. if None downloads all.
         offset(int): should be multiple of 3
+        multirange(int): byte ranges per request.
+        request_cost(int): see plan.
+    """
+    download_many([timestamp], [offset], dataset, path, products, levels,
+                  multirange, request_cost)
+
+
+def plan_many(timestamps, offsets, dataset=pgrb2, path=None, products=None,
+              levels=None, multirange=1, request_cost=REQUEST_COST):
+    """Plan downloads without fetching grib data, see download_many.
+
+    Returns:
+        list: (filename, url, Plan) for each file
     """
     if path is None:
         path = DATA_PATH
-    closest = timestamp.hour//6*6
-    filename = dataset(closest, offset)
-    gfs_timestamp = '%s%02d' % (timestamp.strftime('%Y%m%d'), closest)
+    runs = []
+    for timestamp in timestamps:
+        for offset in offsets:
+            run = _run(timestamp, dataset, offset)
+            if run not in runs:
+                runs.append(run)
+    plans = []
+    for (gfs_timestamp, filename), index in zip(runs,
+                                                 inventories(runs, path)):
+        dl_path = path + '/%s/' % gfs_timestamp
+        plans.append((dl_path + filename, baseurl(gfs_timestamp, filename),
+                      plan(index, products, levels, request_cost,
+                           multirange)))
+    return plans
+
+
+def download_many(timestamps, offsets, dataset=pgrb2, path=None,
+                  products=None, levels=None, multirange=1,
+                  request_cost=REQUEST_COST):
+    """save GFS grib files for every timestamp and offset concurrently.
+
+    Inventories are fetched or revalidated together, then the segments of
+    all files share one bounded pool of connections.  Completed segments
+    are recorded with their sha1 in <file>.manifest, so a repeat or
+    interrupted download only fetches segments that are missing or fail
+    verification.
+
+    Args:
+        timestamps(list): datetimes, see download.
+        offsets(list): forecast offsets, multiples of 3.
+        multirange(int): byte ranges per request.
+        request_cost(int): see plan.
+
+    Returns:
+        list: saved filenames
+    """
+    plans = plan_many(timestamps, offsets, dataset, path, products, levels,
+                      multirange, request_cost)
+    logger.info('Planned %s bytes (%s wanted) in %s requests for %s files',
+                sum(i[2].bytes for i in plans),
+                sum(i[2].wanted for i in plans),
+                sum(i[2].requests for i in plans), len(plans))
+    for filename, _, _ in plans:
+        _verify_path(os.path.dirname(filename))
+    _fetch_files([(filename, url, i.segments) for filename, url, i in plans],
+                 multirange)
+    return [i[0] for i in plans]
+
+
+_INVENTORIES = {}
+
+
+def _load_inventory(local):
+    """saved inventory, parsed once per file version."""
+    mtime = os.stat(local).st_mtime
+    memo = _INVENTORIES.get(local)
+    if memo is None or memo[0] != mtime:
+        with open(local) as idx:
+            memo = (mtime, Inventory.parse(idx.read()))
+        _INVENTORIES[local] = memo
+    return memo[1]
 
-    url = baseurl(gfs_timestamp, filename)
-    index = url + '.idx'
-    messages = message_index(index)
-    segments = _filter_messages(messages, products, levels)
-    dl_path = path + '/%s/' % gfs_timestamp
-    _verify_path(dl_path)
-    _download_segments(path + filename, url, segments)
+
+def inventories(runs, path=None, ttl=INVENTORY_TTL):
+    """Inventories of GFS files, saved under DATA_PATH/<gfs_timestamp>/.
+
+    A saved inventory is used without a request for ttl seconds, then
+    revalidated with its ETag or Last-Modified, so only changed
+    inventories are downloaded again.  Requests run concurrently.
+
+    Args:
+        runs (list): (gfs_timestamp, filename) tuples.
+        path (str): if None defaults to DATA_PATH
+        ttl (float): seconds before revalidating.
+
+    Returns:
+        list: Inventory for each run
+    """
+    if path is None:
+        path = DATA_PATH
+    now = time.time()
+    results = [None] * len(runs)
+    stale = []
+    for i, (gfs_timestamp, filename) in enumerate(runs):
+        local = '%s/%s/%s.idx' % (path, gfs_timestamp, filename)
+        try:
+            with open(local + '.json') as meta_file:
+                meta = json.load(meta_file)
+            if now - meta['checked'] < ttl:
+                results[i] = _load_inventory(local)
+                continue
+        except (IOError, OSError, ValueError, KeyError):
+            meta = {}
+        headers = {}
+        if os.path.exists(local):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last-modified'):
+                headers['If-Modified-Since'] = meta['last-modified']
+        stale.append((i, local, baseurl(gfs_timestamp, filename) + '.idx',
+                      headers))
+    responses = fetch_many([(url, headers) for _, _, url, headers in stale])
+    for (i, local, url, headers), response in zip(stale, responses):
+        _verify_path(os.path.dirname(local))
+        if response.status != 304:
+            write_atomic(local, lambda idx: idx.write(response.body))
+        meta = {'checked': now,
+                'etag': response.headers.get('etag'),
+                'last-modified': response.headers.get('last-modified')}
+        write_atomic(local + '.json', lambda meta_file: json.dump(
+            meta, meta_file))
+        results[i] = _load_inventory(local)
+    return results
+
+
+def inventory(timestamp, dataset=pgrb2, offset=0, path=None,
+              ttl=INVENTORY_TTL):
+    """Inventory of one GFS file, see inventories."""
+    return inventories([_run(timestamp, dataset, offset)], path, ttl)[0]
 
 
 def message_index(index_url):
-    """get message index of components for urllib2.
+    """get message index of components.
 
     Args:
         url(string):
 
     Returns:
-        list: messages
+        list: Message tuples
+    """
+    return Inventory.parse(fetch(index_url).body).messages
+
+
+def _locator(filename):
+    """source offset -> offset in a downloaded file, None if absent.
+
+    The manifest plan gives where each fetched segment starts in the
+    file; a file without a manifest is taken to be complete.
     """
-    idx = csv.reader(urllib2.urlopen(index_url), delimiter=':')
-    messages = []
-    for line in idx:
-        messages.append(line)
-    return messages
+    try:
+        with open(filename + '.manifest') as manifest_file:
+            plan = json.load(manifest_file)['plan']
+    except (IOError, ValueError, KeyError):
+        plan = [[0, None]]
+    placed = []
+    position = 0
+    for start, end in plan:
+        placed.append((start, end, position))
+        if end is not None:
+            position += end - start
+
+    def locate(offset):
+        for start, end, position in placed:
+            if start <= offset and (end is None or offset < end):
+                return position + offset - start
+        return None
+    return locate
+
+
+def extract_points(filename, products, levels, lats, lons, index=None,
+                   weights=None):
+    """Values at points from a downloaded grib2 file.
+
+    Messages are located through the inventory saved beside the file
+    (<file>.idx) and the download manifest, and only the wanted ones are
+    read and decoded, one at a time.  Values are bilinearly interpolated;
+    the weights are computed once per grid.
+
+    Args:
+        filename (str): file saved by download.
+        products (list): TMP, etc. if None all.
+        levels (list): surface, etc. if None all.
+        lats, lons (array): point coordinates in degrees.
+        index (Inventory): default the saved inventory.
+        weights (dict): interpolation weights by grid, pass the same dict
+            to calls for the same points to reuse them.
+
+    Returns:
+        tuple: (messages, values), values shaped (points, messages)
+    """
+    if index is None:
+        index = _load_inventory(filename + '.idx')
+    locate = _locator(filename)
+    messages = index.select(products, levels)
+    values = np.empty((len(lats), len(messages)))
+    if weights is None:
+        weights = {}
+    fields = (None, None)
+    with open(filename, 'rb') as grib:
+        for k, message in enumerate(messages):
+            offset = locate(message.offset)
+            if offset is None:
+                raise KeyError('message %s not downloaded' % message.number)
+            if fields[0] != offset:
+                fields = (offset, grib2.read(grib, offset))
+            part = 0
+            if '.' in message.number:
+                part = int(message.number.split('.')[1]) - 1
+            field = fields[1][part]
+            grid = (field.values.shape, field.lats[0], field.lats[1],
+                    field.lons[0], field.lons[1])
+            if grid not in weights:
+                weights[grid] = grib2.bilinear(field, lats, lons)
+            values[:, k] = grib2.interpolate(field, lats, lons,
+                                             weights[grid])
+    return messages, values
+
+
+def point_series(run_time, places, products, levels,
+                 offsets=range(0, 385, 3), dataset=pgrb2, path=None,
+                 multirange=1, request_cost=REQUEST_COST, keep=True):
+    """Forecast series at many places from one GFS run.
+
+    Offsets are handled one at a time: the next file downloads while the
+    current one is decoded, and only the extracted values are kept, so
+    memory stays flat as the horizon grows.  An offset whose file or
+    messages are missing or cut short is logged and left NaN; packing
+    grib2 cannot decode raises NotImplementedError.
+
+    Args:
+        run_time(datetime): time in the run, see download.
+        places(list): (latitude, longitude) tuples.
+        products(list): TMP, etc.
+        levels(list): surface, etc.
+        offsets(list): forecast offsets, multiples of 3.
+        keep(bool): keep downloaded files, else remove each after use.
+
+    Returns:
+        Series: times (datetime64[h] valid times), variables ((product,
+        level) pairs, first matching message) and values shaped (site,
+        time, variable), NaN where missing.
+    """
+    offsets = list(offsets)
+    lats = np.array([i[0] for i in places], dtype=np.float64)
+    lons = np.array([i[1] for i in places], dtype=np.float64)
+    variables = [(i, j) for i in products for j in levels]
+    columns = dict((variable, i) for i, variable in enumerate(variables))
+    values = np.empty((len(places), len(offsets), len(variables)))
+    values.fill(np.nan)
+    gfs_timestamp = _run(run_time, dataset, 0)[0]
+    times = np.datetime64(datetime.datetime.strptime(
+        gfs_timestamp, '%Y%m%d%H'), 'h') + np.array(offsets, dtype=int) \
+        .astype('timedelta64[h]')
+    weights = {}
+
+    def fetch_offset(offset):
+        """plan and download one offset."""
+        return download_many([run_time], [offset], dataset, path, products,
+                             levels, multirange, request_cost)[0]
+
+    pool = ThreadPool(1)
+    try:
+        pending = None
+        if offsets:
+            pending = pool.apply_async(fetch_offset, (offsets[0],))
+        for k, offset in enumerate(offsets):
+            result = pending
+            if k + 1 < len(offsets):
+                pending = pool.apply_async(fetch_offset, (offsets[k + 1],))
+            try:
+                filename = result.get()
+            except (IOError, KeyError) as err:
+                logger.warning('Offset %s not available: %s', offset, err)
+                continue
+            try:
+                messages, extracted = extract_points(
+                    filename, products, levels, lats, lons, weights=weights)
+            except (IOError, KeyError, struct.error) as err:
+                logger.warning('Offset %s not decoded: %s', offset, err)
+            else:
+                found = set()
+                for j, message in enumerate(messages):
+                    variable = (message.variable, message.level)
+                    if variable in columns and variable not in found:
+                        values[:, k, columns[variable]] = extracted[:, j]
+                        found.add(variable)
+            if not keep:
+                for i in [filename, filename + '.manifest']:
+                    if os.path.exists(i):
+                        os.remove(i)
+    finally:
+        pool.terminate()
+        pool.join()
+    return Series(times, variables, values)
+
+
+def resample(series, freq='1H', method='linear', horizon=None,
+             out_of_range='nan'):
+    """point_series Series on a regular time grid, see timeaxis.resample."""
+    times, values = timeaxis.resample(series.times, series.values, freq,
+                                      method, horizon=horizon,
+                                      out_of_range=out_of_range, axis=1)
+    return Series(times, series.variables, values)
 
 if __name__ == '__main__':
     START = datetime.datetime.now()
-    PRODUCTS = ['TCDC', 'SNOWC', 'TMP', 'ALBDO', 'UGRD', 'VGRD']
-    LEVELS = ['surface', 'entire atmosphere (considered as a single layer)',
-              'low cloud layer', '1 hybrid level']
+    PRODUCTS = ['TMP', 'UGRD', 'VGRD']
+    LEVELS = ['surface', '2 m above ground']
+    PLACES = [(39.74, -105.18), (40.0, -78.0)]
 
-    for j in range(5):
-        download(START, sflux, products=PRODUCTS, levels=LEVELS, offset=j*3)
+    print point_series(START, PLACES, PRODUCTS, LEVELS, range(0, 13, 3))
@@ -0,0 +1,328 @@
+"""Minimal GRIB2 decoder.
+
+Decodes grid definition template 3.0 (regular latitude/longitude), data
+representation templates 5.0 (simple packing), 5.2 and 5.3 (complex
+packing, with spatial differencing for 5.3) and section 6 bitmaps.
+NCEP GFS products are complex packed with spatial differencing.  Other
+templates, eg. JPEG2000 (5.40), raise NotImplementedError; such files
+can be repacked with ``wgrib2 -set_grib_type c3``.
+
+Values are Y = (R + X * 2^E) / 10^D for reference value R, packed value
+X, binary scale E and decimal scale D.  Points missing from a bitmap or
+marked missing in complex packing are NaN.
+
+Example:
+    with open(filename, 'rb') as grib:
+        field = read(grib, offset)[0]
+    interpolate(field, [39.74], [-105.18])
+"""
+# Copyright (C) 2015 Nathan Charles
+#
+# This program is free software. See terms in LICENSE file.
+
+import collections
+import struct
+import numpy as np
+
+# values (nj, ni) in scan order, lats (nj,), lons (ni,) in degrees
+Field = collections.namedtuple('Field', 'values lats lons')
+
+Grid = collections.namedtuple('Grid', 'ni nj la1 lo1 di dj scan')
+Packing = collections.namedtuple('Packing', 'count reference binary decimal '
+                                            'bits groups')
+# complex packing, templates 5.2 and 5.3 (order 0 for 5.2)
+Groups = collections.namedtuple('Groups', 'count width_reference width_bits '
+                                          'length_reference length_increment '
+                                          'last_length length_bits missing '
+                                          'order extra')
+
+MISSING = 0xffffffff
+PACKED_TYPES = {8: '>u1', 16: '>u2', 32: '>u4'}
+
+
+def _signed(value, bits):
+    """GRIB sign and magnitude integer to int."""
+    sign = 1 << (bits - 1)
+    if value & sign:
+        return -(value & (sign - 1))
+    return value
+
+
+def _grid(section):
+    """section 3, grid definition template 3.0."""
+    template = struct.unpack('>H', section[12:14])[0]
+    if template != 0:
+        raise NotImplementedError('grid template 3.%s' % template)
+    ni, nj, basic, subdivisions, la1, lo1 = struct.unpack('>6I',
+                                                          section[30:54])
+    la2, lo2, di, dj = struct.unpack('>4I', section[55:71])
+    scan = ord(section[71])
+    if scan & 0x10:
+        raise NotImplementedError('boustrophedonic scanning')
+    unit = 1e-6
+    if basic not in (0, MISSING) and subdivisions not in (0, MISSING):
+        unit = float(basic) / subdivisions
+    return Grid(ni, nj, _signed(la1, 32) * unit, _signed(lo1, 32) * unit,
+                di * unit, dj * unit, scan)
+
+
+def _packing(section):
+    """section 5, data representation templates 5.0, 5.2 and 5.3."""
+    count, template = struct.unpack('>IH', section[5:11])
+    if template not in (0, 2, 3):
+        raise NotImplementedError(
+            'data representation template 5.%s, repack eg. with wgrib2 '
+            '-set_grib_type c3' % template)
+    reference, binary, decimal, bits = struct.unpack('>fHHB', section[11:20])
+    groups = None
+    if template != 0:
+        values = struct.unpack('>BIIIBBIBIB', section[22:47])
+        missing = values[0]
+        if missing > 2:
+            raise NotImplementedError('missing value management %s' %
+                                      missing)
+        order = extra = 0
+        if template == 3:
+            order, extra = struct.unpack('>BB', section[47:49])
+            if order not in (1, 2):
+                raise NotImplementedError('spatial differencing order %s' %
+                                          order)
+        groups = Groups(values[3], values[4], values[5], values[6],
+                        values[7], values[8], values[9], missing, order,
+                        extra)
+    return Packing(count, reference, _signed(binary, 16),
+                   _signed(decimal, 16), bits, groups)
+
+
+def _bitmap(section, previous):
+    """section 6, None if every point is present."""
+    indicator = ord(section[5])
+    if indicator == 255:
+        return None
+    if indicator == 254:
+        return previous
+    if indicator != 0:
+        raise NotImplementedError('predefined bitmap %s' % indicator)
+    return np.unpackbits(np.frombuffer(section[6:], np.uint8)).astype(bool)
+
+
+def unpack(data, count, bits):
+    """count unsigned integers of bits width from packed bytes."""
+    if bits == 0:
+        return np.zeros(count, np.int64)
+    if bits in PACKED_TYPES:
+        return np.frombuffer(data, PACKED_TYPES[bits], count).astype(
+            np.int64)
+    packed = np.unpackbits(np.frombuffer(data, np.uint8))[:count * bits]
+    return packed.reshape(count, bits).dot(
+        2 ** np.arange(bits - 1, -1, -1, dtype=np.int64))
+
+
+def unpack_bits(data, starts, widths):
+    """unsigned integers of up to 32 bits at any bit offsets.
+
+    Args:
+        data (str): packed bytes.
+        starts (array): bit offset of each value.
+        widths (array): bits of each value.
+
+    Returns:
+        int64 array
+    """
+    buf = np.frombuffer(data + '\0' * 5, np.uint8)
+    first = starts >> 3
+    # five bytes hold any 32 bit value whatever its bit offset
+    window = np.zeros(len(starts), np.int64)
+    for i in range(5):
+        window = (window << 8) | buf.take(first + i)
+    return (window >> (40 - (starts & 7) - widths)) & ((1 << widths) - 1)
+
+
+def _complex(data, packing):
+    """section 7 of complex packing, (integers, missing mask or None)."""
+    groups = packing.groups
+    position = 0
+    extra = []
+    for _ in range(groups.order + 1 if groups.order else 0):
+        raw = data[position:position + groups.extra]
+        extra.append(_signed(int(raw.encode('hex') or '0', 16),
+                             8 * groups.extra))
+        position += groups.extra
+    arrays = []
+    for bits in [packing.bits, groups.width_bits, groups.length_bits]:
+        size = (groups.count * bits + 7) // 8
+        arrays.append(unpack(data[position:position + size], groups.count,
+                             bits))
+        position += size
+    references, widths, lengths = arrays
+    widths += groups.width_reference
+    lengths = groups.length_reference + groups.length_increment * lengths
+    if groups.count:
+        lengths[-1] = groups.last_length
+    if lengths.sum() != packing.count:
+        raise ValueError('group lengths do not add up to %s values' %
+                         packing.count)
+    if groups.count and widths.max() > 32:
+        raise NotImplementedError('groups wider than 32 bits')
+    widths = np.repeat(widths, lengths)
+    starts = np.cumsum(widths) - widths + 8 * position
+    packed = unpack_bits(data, starts, widths)
+    references = np.repeat(references, lengths)
+    missing = None
+    if groups.missing:
+        # all ones marks a primary and all ones less one a secondary
+        # missing value, in the group reference when the width is 0
+        wide = widths > 0
+        marker = np.where(wide, packed, references) + 1
+        limit = np.where(wide, 1 << widths, 1 << packing.bits)
+        missing = marker == limit
+        if groups.missing == 2:
+            missing |= marker + 1 == limit
+    integers = references + packed
+    if groups.order:
+        present = integers if missing is None else integers[~missing]
+        present = _undifference(present, groups.order, extra[:-1], extra[-1])
+        if missing is None:
+            integers = present
+        else:
+            integers[~missing] = present
+    return integers, missing
+
+
+def _undifference(values, order, first, minimum):
+    """values from spatial differences of order 1 or 2."""
+    values = values + minimum
+    count = min(order, len(values))
+    values[:count] = first[:count]
+    if order == 2 and count == 2:
+        # second differences to first differences
+        values[1] -= values[0]
+        values[1:] = np.cumsum(values[1:])
+    return np.cumsum(values)
+
+
+def _field(grid, packing, bitmap, section):
+    """section 7, decoded and shaped to the grid."""
+    if grid is None or packing is None:
+        raise ValueError('data section before grid or packing')
+    missing = None
+    if packing.groups is None:
+        integers = unpack(section[5:], packing.count, packing.bits)
+    else:
+        integers, missing = _complex(section[5:], packing)
+    values = (packing.reference + integers * 2.0 ** packing.binary) / \
+        10.0 ** packing.decimal
+    if missing is not None:
+        values[missing] = np.nan
+    points = grid.ni * grid.nj
+    if bitmap is not None:
+        full = np.empty(points)
+        full.fill(np.nan)
+        full[bitmap[:points]] = values
+        values = full
+    if grid.scan & 0x20:
+        values = values.reshape(grid.ni, grid.nj).T
+    else:
+        values = values.reshape(grid.nj, grid.ni)
+    lat_step = grid.dj if grid.scan & 0x40 else -grid.dj
+    lon_step = -grid.di if grid.scan & 0x80 else grid.di
+    return Field(values, grid.la1 + lat_step * np.arange(grid.nj),
+                 grid.lo1 + lon_step * np.arange(grid.ni))
+
+
+def decode(data):
+    """Fields of one GRIB2 message.
+
+    A message may repeat sections 2 to 7; each data section is a field,
+    so field k is sub-message k + 1 of the .idx inventory.
+
+    Args:
+        data (str): message bytes.
+
+    Returns:
+        list: Field for each data section
+    """
+    if data[:4] != 'GRIB' or ord(data[7]) != 2:
+        raise ValueError('not a GRIB2 message')
+    length = struct.unpack('>Q', data[8:16])[0]
+    position = 16
+    grid = packing = bitmap = None
+    fields = []
+    while position < length - 4:
+        size, number = struct.unpack('>IB', data[position:position + 5])
+        section = data[position:position + size]
+        if number == 3:
+            grid = _grid(section)
+        elif number == 5:
+            packing = _packing(section)
+        elif number == 6:
+            bitmap = _bitmap(section, bitmap)
+        elif number == 7:
+            fields.append(_field(grid, packing, bitmap, section))
+        position += size
+    return fields
+
+
+def read(grib, offset):
+    """Fields of the message at offset of an open file."""
+    grib.seek(offset)
+    head = grib.read(16)
+    if len(head) < 16 or head[:4] != 'GRIB' or ord(head[7]) != 2:
+        raise ValueError('no GRIB2 message at %s' % offset)
+    length = struct.unpack('>Q', head[8:16])[0]
+    return decode(head + grib.read(length - 16))
+
+
+def bilinear(field, lats, lons):
+    """Bilinear interpolation weights for points on a field's grid.
+
+    Longitudes wrap on global grids; points outside other grids get NaN.
+    Weights depend only on the grid, so they can be reused for every
+    field on it.
+
+    Returns:
+        tuple: (flat indexes, weights), each shaped (4, points)
+    """
+    nj, ni = field.values.shape
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lat_step = field.lats[1] - field.lats[0]
+    lon_step = field.lons[1] - field.lons[0]
+    fj = (lats - field.lats[0]) / lat_step
+    fi = (lons - field.lons[0]) / lon_step
+    wrap = abs(abs(ni * lon_step) - 360) < 1e-6
+    if wrap:
+        fi = np.mod(fi, ni)
+    outside = (fj < -1e-9) | (fj > nj - 1 + 1e-9)
+    if not wrap:
+        outside |= (fi < -1e-9) | (fi > ni - 1 + 1e-9)
+    j0 = np.clip(np.floor(fj), 0, max(nj - 2, 0)).astype(np.int64)
+    i0 = np.clip(np.floor(fi), 0, ni - 1 if wrap else max(ni - 2, 0)).astype(
+        np.int64)
+    tj = np.clip(fj - j0, 0, 1)
+    ti = np.clip(fi - i0, 0, 1)
+    j1 = np.minimum(j0 + 1, nj - 1)
+    i1 = (i0 + 1) % ni if wrap else np.minimum(i0 + 1, ni - 1)
+    index = np.array([j0 * ni + i0, j0 * ni + i1, j1 * ni + i0,
+                      j1 * ni + i1])
+    weight = np.array([(1 - tj) * (1 - ti), (1 - tj) * ti, tj * (1 - ti),
+                       tj * ti])
+    weight[:, outside] = np.nan
+    return index, weight
+
+
+def interpolate(field, lats, lons, weights=None):
+    """Field values at points by bilinear interpolation.
+
+    Args:
+        field (Field): decoded field.
+        lats, lons (array): point coordinates in degrees.
+        weights (tuple): from bilinear, computed if None.
+
+    Returns:
+        array of values, NaN outside the grid
+    """
+    if weights is None:
+        weights = bilinear(field, lats, lons)
+    index, weight = weights
+    return (field.values.ravel()[index] * weight).sum(axis=0)
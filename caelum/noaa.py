@@ -1,102 +1,241 @@
-"""wrapper around NOAA GFS api"""
+"""wrapper around NOAA NDFD api
+
+Forecasts are parsed once into numpy columns and cached per rounded
+location and NDFD issue hour, so repeat calls for a place, or for places
+in the same grid cell, do not refetch.  Many places are requested
+together with the NDFD list query.
+
+Example:
+    >>> forecast_many([(39.74, -105.18), (38.9, -77.04)])[0]['temperature']
+"""
 import logging
 logger = logging.getLogger(__name__)
 
-import urllib2
-import xml.etree.ElementTree as ET
-from scipy.interpolate import interp1d
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import collections
 import datetime
+import threading
+import time
+import numpy as np
+from cStringIO import StringIO
+from .tools import fetch_many
+from . import timeaxis
+
+URL = 'http://graphical.weather.gov/xml/SOAP_server/ndfdXMLclient.php'
+ELEMENTS = 'Unit=e&temp=temp&wspd=wspd&sky=sky&wx=wx&rh=rh&' + \
+    'product=time-series&Submit=Submit'
+# points per list query
+BATCH = 200
+# NDFD is reissued hourly
+CACHE_TTL = 3600
+# decimal places of cache keys, NDFD grid cells are 2.5 km
+PRECISION = 2
+
+# NDFD (parameter, type) -> (column, scale)
+PARAMETERS = {('temperature', 'hourly'): ('temperature', 1.),
+              # knots to mph
+              ('wind-speed', 'sustained'): ('windSpeed', 1.15),
+              # percent to fraction
+              ('cloud-amount', 'total'): ('cloudCover', 0.01),
+              ('humidity', 'relative'): ('relativeHumidity', 1.)}
+# columns share the times of this parameter
+BASE = ('temperature', 'hourly')
+TIMES = 'start-valid-time'
+UTC = 'utc_datetime'
+NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+# strings as sent, times datetime64[s] UTC
+Layout = collections.namedtuple('Layout', 'strings times')
+Parameter = collections.namedtuple('Parameter',
+                                   'location name kind units values')
+Response = collections.namedtuple('Response', 'locations layouts parameters')
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _key(place, now):
+    """cache key of a place for the issue hour of now."""
+    lat, lon = place
+    return (round(lat, PRECISION), round(lon, PRECISION), int(now // 3600))
+
+
+def parse_dwml(xml):
+    """NDFD DWML response by time layout.
+
+    Values of each parameter are converted to floats in one numpy call,
+    nil values are NaN.  Parameters without values, such as weather, are
+    left out.
+
+    Args:
+        xml (str): response body.
+
+    Returns:
+        Response: locations [(location key, lat, lon)] in document order,
+        layouts {layout key: Layout} and parameters {layout key:
+        [Parameter]}.
+    """
+    locations = []
+    layouts = {}
+    parameters = collections.defaultdict(list)
+    for _, element in ET.iterparse(StringIO(xml)):
+        if element.tag == 'location':
+            point = element.find('point')
+            lat = lon = np.nan
+            if point is not None:
+                lat = float(point.get('latitude'))
+                lon = float(point.get('longitude'))
+            locations.append((element.findtext('location-key'), lat, lon))
+            element.clear()
+        elif element.tag == 'time-layout':
+            strings = np.array([i.text for i in element.iterfind(TIMES)],
+                               dtype='S25')
+            layouts[element.findtext('layout-key')] = Layout(
+                strings, timeaxis.isotimes(strings))
+            element.clear()
+        elif element.tag == 'parameters':
+            location = element.get('applicable-location')
+            for child in element:
+                layout = child.get('time-layout')
+                texts = [i.text if i.text and i.get(NIL) != 'true' else 'nan'
+                         for i in child.iterfind('value')]
+                if layout is None or not texts:
+                    continue
+                parameters[layout].append(Parameter(
+                    location, child.tag, child.get('type'),
+                    child.get('units'), np.array(texts).astype(np.float64)))
+            element.clear()
+    return Response(locations, layouts, dict(parameters))
+
+
+def parse(xml):
+    """Columns for each location of an NDFD DWML time series response.
+
+    Times are those of the hourly temperature layout; parameters on other
+    layouts are aligned to them, NaN where missing.
+
+    Args:
+        xml (str): response body.
+
+    Returns:
+        list: dict column -> array for each location, in request order
+    """
+    response = parse_dwml(xml)
+    found = collections.defaultdict(dict)
+    for layout, items in response.parameters.items():
+        for parameter in items:
+            found[parameter.location].setdefault(
+                (parameter.name, parameter.kind), (layout, parameter.values))
+    empty = Layout(np.array([], dtype='S25'),
+                   np.array([], dtype='datetime64[s]'))
+    results = []
+    for location, _, _ in response.locations:
+        items = found.get(location, {})
+        base = response.layouts[items[BASE][0]] if BASE in items else empty
+        columns = {TIMES: base.strings, UTC: base.times}
+        for key, (column, scale) in PARAMETERS.items():
+            values = np.empty(len(base.times))
+            values.fill(np.nan)
+            if key in items:
+                layout, data = items[key]
+                times = response.layouts[layout].times[:len(data)]
+                if len(times):
+                    index = np.minimum(np.searchsorted(times, base.times),
+                                       len(times) - 1)
+                    hit = times[index] == base.times
+                    values[hit] = data[index[hit]] * scale
+            columns[column] = values
+        for values in columns.values():
+            values.flags.writeable = False
+        results.append(columns)
+    return results
+
+
+def _list_url(places):
+    """NDFD list query url for places."""
+    points = '+'.join('%s,%s' % (lat, lon) for lat, lon in places)
+    return '%s?whichClient=NDFDgenLatLonList&listLatLon=%s&%s' % (
+        URL, points, ELEMENTS)
+
+
+def forecast_many(places, ttl=CACHE_TTL):
+    """NOAA weather forecasts for many locations.
+
+    Places missing from the cache are fetched BATCH at a time with the
+    NDFD list query, concurrently.
+
+    Args:
+        places (list): (lat, lon) tuples.
+        ttl (float): maximum age in seconds of cached forecasts.
+
+    Returns:
+        list: read only dict of columns for each place, 'start-valid-time'
+        strings, 'utc_datetime' datetime64[s] and 'temperature',
+        'windSpeed', 'cloudCover' and 'relativeHumidity' floats.
+    """
+    now = time.time()
+    keys = [_key(place, now) for place in places]
+    missing = {}
+    with _CACHE_LOCK:
+        for key in [i for i in _CACHE if i[2] != int(now // 3600)]:
+            del _CACHE[key]
+        for key, place in zip(keys, places):
+            entry = _CACHE.get(key)
+            if (entry is None or now - entry[0] >= ttl) and \
+                    key not in missing:
+                missing[key] = place
+    if missing:
+        pending = missing.items()
+        batches = [pending[i:i + BATCH]
+                   for i in range(0, len(pending), BATCH)]
+        urls = [_list_url([place for _, place in batch]) for batch in batches]
+        for url in urls:
+            logger.debug(url)
+        for batch, response in zip(batches, fetch_many(urls)):
+            columns = parse(response.body)
+            if len(columns) != len(batch):
+                raise ValueError('NDFD returned %s locations for %s' %
+                                 (len(columns), len(batch)))
+            with _CACHE_LOCK:
+                for (key, _), found in zip(batch, columns):
+                    _CACHE[key] = (now, found)
+    with _CACHE_LOCK:
+        return [_CACHE[key][1] for key in keys]
+
+
+def clear_cache():
+    """forget cached forecasts."""
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
 
 def forecast(place, series=True):
     """NOAA weather forecast for a location"""
-    lat, lon = place
-    url = "http://graphical.weather.gov/xml/SOAP_server/ndfdXMLclient.php?" + \
-            "whichClient=NDFDgen&" + "lat=%s&lon=%s&" % (lat, lon) + \
-            "Unit=e&temp=temp&wspd=wspd&sky=sky&wx=wx&rh=rh&" + \
-            "product=time-series&Submit=Submit"
-    logger.debug(url)
-    res = urllib2.urlopen(url).read()
-    root = ET.fromstring(res)
-    time_series = [(i.text) for i in \
-            root.findall('./data/time-layout')[0].iterfind('start-valid-time')]
-    logger.debug(res)
-    #knots to mph
-    wind_speed = [eval(i.text)*1.15 for i in \
-            root.findall('./data/parameters/wind-speed')[0].iterfind('value')]
-    cloud_cover = [eval(i.text)/100.0 for i in \
-            root.findall('./data/parameters/cloud-amount')[0].iterfind('value')]
-    temperature = [eval(i.text) for i in \
-            root.findall('./data/parameters/temperature')[0].iterfind('value')]
+    columns = forecast_many([place])[0]
+    names = ['cloudCover', 'temperature', 'windSpeed', TIMES]
     if not series:
-        return {'cloudCover':cloud_cover[0], \
-                'temperature':temperature[0], \
-                'windSpeed':wind_speed[0], \
-                'start-valid-time':time_series[0]}
-    else:
-        return {'cloudCover':cloud_cover, \
-                'temperature':temperature, \
-                'windSpeed':wind_speed, \
-                'start-valid-time':time_series}
+        return dict((i, columns[i][0].item()) for i in names)
+    return dict((i, columns[i].tolist()) for i in names)
 
 def _str_time(string):
     """unused fuction?"""
     fmt = '%Y-%m-%dT%H:%M:00'
     return datetime.datetime.strptime(string[0:19], fmt)
 
-def _cast_float(temp_dt):
-    """returns utc timestamp"""
-    if type(temp_dt) == str:
-        fmt = '%Y-%m-%dT%H:%M:00'
-        base_dt = temp_dt[0:19]
-        tz_offset = eval(temp_dt[19:22])
-        temp_dt = datetime.datetime.strptime(base_dt, fmt) - \
-                datetime.timedelta(hours=tz_offset)
-    return (temp_dt - datetime.datetime(1970, 1, 1)).total_seconds()
-
 def herp_derp_interp(place):
-    """simple interpolation of GFS forecast"""
-    lat, lon = place
-    #begin=2014-02-14T00%3A00%3A00&end=2018-02-22T00%3A00%3A00
-    fmt = '%Y-%m-%dT00:00:00'
-    fmt = '%Y-%m-%dT%H:%M:00'
-    begin = (datetime.datetime.now()-datetime.timedelta(hours=12)).strftime(fmt)
-    #end=(datetime.datetime.now()+datetime.timedelta(hours=48)).strftime(fmt)
-    url = "http://graphical.weather.gov/xml/SOAP_server/ndfdXMLclient.php?" + \
-            "whichClient=NDFDgen&lat=%s&lon=%s&" % (lat, lon) + \
-            "Unit=e&temp=temp&wspd=wspd&sky=sky&wx=wx&rh=rh&" + \
-            "product=time-series&begin=%s&end=2018-02-22T00:00:00" % begin + \
-            "&Submit=Submit"""
-    res = urllib2.urlopen(url).read()
-    root = ET.fromstring(res)
-
-    time_series = [_cast_float(i.text) for i in \
-            root.findall('./data/time-layout')[0].iterfind('start-valid-time')]
-    #knots to mph
-    wind_speed = [eval(i.text)*1.15 for i in \
-            root.findall('./data/parameters/wind-speed')[0].iterfind('value')]
-    cloud_cover = [eval(i.text)/100.0 for i in \
-            root.findall('./data/parameters/cloud-amount')[0].iterfind('value')]
-    temperature = [eval(i.text) for i in \
-            root.findall('./data/parameters/temperature')[0].iterfind('value')]
-
-    ws_interp = interp1d(time_series, wind_speed, kind='cubic')
-    cc_interp = interp1d(time_series, cloud_cover, kind='cubic')
-    t_interp = interp1d(time_series, temperature, kind='cubic')
-    start_date = datetime.datetime.utcfromtimestamp(time_series[0])
-
-    series = []
-    for i in range(48):
-        try:
-            temp_dict = {}
-            forecast_dt = start_date + datetime.timedelta(hours=i)
-            temp_dict['utc_datetime'] = forecast_dt
-            temp_dict['windSpeed'] = ws_interp(_cast_float(forecast_dt)).item()
-            temp_dict['temperature'] = t_interp(_cast_float(forecast_dt)).item()
-            temp_dict['cloudCover'] = cc_interp(_cast_float(forecast_dt)).item()
-            series.append(temp_dict)
-        except:
-            pass
-    return series
+    """simple interpolation of NDFD forecast, hourly for 48 hours"""
+    columns = forecast_many([place])[0]
+    names = ['windSpeed', 'temperature', 'cloudCover']
+    times = columns[UTC]
+    grid, values = timeaxis.resample(
+        times, np.column_stack([columns[i] for i in names]), '1H', 'cubic',
+        horizon='48H')
+    inside = grid <= times[-1]
+    return [dict(zip(names, row), utc_datetime=when) for when, row in
+            zip(grid[inside].astype(object), values[inside].tolist())]
 
 if __name__ == '__main__':
     from solpy import geo
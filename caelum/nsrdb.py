@@ -1,17 +1,78 @@
 # Copyright (C) 2012 Nathan Charles
 #
 # This program is free software. See terms in LICENSE file.
-"""look at NSRDB historical data"""
+"""look at NSRDB historical data
+
+Each station year is a NSRDB_StationData_<year>0101_<year>1231_<usaf>.csv
+file found under one of PATH.  Files are located through a persistent
+index of PATH (see FileIndex) rather than a directory walk per file.
+`load` parses the years of a station, in parallel worker processes when
+there are enough of them, into one (year, hour of year, field) array,
+and the monthly, annual and exceedance figures of `report` are computed
+from it.
+
+Examples:
+    available_years('724666')  # sorted years with a file, e.g. [1991, ...]
+    stack = load('724666', range(1991, 2011))
+    annual(stack)[:, 0]  # kWh/m^2 per year of the first field
+    report('724666', plot=True)
+"""
+import collections
 import csv
 import datetime
+import itertools
+import json
+import multiprocessing
 import os
+import re
+import threading
+import time
+import logging
 import numpy as np
-from solpy import tools
+import pytz
+from .tools import csv_columns, noaa_stations, write_atomic, EERE_META
+from . import env
+from . import timeaxis
+logger = logging.getLogger(__name__)
 
 # path to data defaults to cwd unless NCDCDATA enviromental variable is set
 CWD = os.getcwd()
 PATH = [os.getenv('NCDCDATA', CWD)]
 
+BASENAME = 'NSRDB_StationData_%s0101_%s1231_%s.csv'
+FILE_PATTERN = re.compile('^NSRDB_StationData_(\\d{4})0101_\\d{4}1231_'
+                          '(\\d{6})\\.csv$')
+# file index of PATH, kept in WEATHER_DATA_PATH
+INDEX = 'nsrdb_index.json'
+# bump when the index layout changes
+INDEX_VERSION = 1
+# seconds between refreshes triggered by missing files
+REFRESH = 60
+YEARS = range(1991, 2011)
+# load starts worker processes by default only when the years parsed
+# away from this process outnumber this, about what starting them costs
+POOL_YEARS = 8
+# hours in a leap year, shorter years are NaN padded
+HOURS = 8784
+MISSING = -9900
+DATE_FIELDS = ['YYYY-MM-DD', 'HH:MM (LST)']
+# TMY3 style names for the modeled irradiance fields
+ALIASES = {'GHI (W/m^2)': 'Glo Mod (Wh/m^2)',
+           'DHI (W/m^2)': 'Dif Mod (Wh/m^2)',
+           'DNI (W/m^2)': 'Dir Mod (Wh/m^2)'}
+# standard time is taken on this date for zone names
+STANDARD_DATE = datetime.datetime(2010, 1, 1)
+# first hour of each month in a common and a leap year
+MONTH_HOURS = np.array([
+    np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]) * 24,
+    np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]) * 24])
+
+# values shaped (year, hour of year, field), NaN where missing
+Stack = collections.namedtuple('Stack', 'usaf years fields values')
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
 
 def strptime(string, timezone=0):
     """necessary because of 24:00 end of day labeling"""
@@ -40,21 +101,205 @@ def normalize_date(tmy_date, year):
         datetime.timedelta(days=day, hours=hour, minutes=minute)
 
 
+class FileIndex(object):
+
+    """Persistent index of NSRDB files under data roots.
+
+    Each directory's mtime, NSRDB files and subdirectories are kept in a
+    JSON file.  A refresh stats every directory but lists only those
+    whose mtime changed, since adding or removing a file changes only
+    its own directory's mtime.  The file may be shared by indexes of
+    other roots, so a save keeps their records.
+
+    Args:
+        roots (list): data directories, earlier roots win.
+        path (str): JSON index file.
+    """
+
+    def __init__(self, roots, path):
+        self.roots = list(roots)
+        self.path = path
+        self._dirs = None
+        self._files = None
+        self._years = None
+        self._refreshed = 0.
+        self._lock = threading.Lock()
+
+    def _read(self):
+        """saved directory records, empty if missing or stale."""
+        try:
+            with open(self.path) as index_file:
+                saved = json.load(index_file)
+        except (IOError, ValueError):
+            return {}
+        if saved.get('version') != INDEX_VERSION:
+            return {}
+        return saved['dirs']
+
+    def _scan(self, directory, saved):
+        """record of one directory, reused if its mtime is unchanged."""
+        mtime = os.stat(directory).st_mtime
+        record = saved.get(directory)
+        if record is not None and record['mtime'] == mtime:
+            return record
+        files = []
+        dirs = []
+        for name in sorted(os.listdir(directory)):
+            match = FILE_PATTERN.match(name)
+            if match:
+                files.append([match.group(2), int(match.group(1)), name])
+            elif os.path.isdir(os.path.join(directory, name)):
+                dirs.append(name)
+        return {'mtime': mtime, 'files': files, 'dirs': dirs}
+
+    def _own(self, saved, inside=True):
+        """records of saved under the roots, or outside them."""
+        roots = [os.path.join(os.path.abspath(i), '') for i in self.roots]
+        return dict((directory, record) for directory, record in
+                    saved.items() if inside == any(
+                        os.path.join(directory, '').startswith(i)
+                        for i in roots))
+
+    def refresh(self):
+        """bring the index up to date with the roots and save it."""
+        with self._lock:
+            saved = self._dirs if self._dirs is not None else self._read()
+            dirs = {}
+            files = {}
+            pending = [os.path.abspath(i) for i in reversed(self.roots)]
+            while pending:
+                directory = pending.pop()
+                if directory in dirs or not os.path.isdir(directory):
+                    continue
+                record = self._scan(directory, saved)
+                dirs[directory] = record
+                for usaf, year, name in record['files']:
+                    files.setdefault((usaf, year),
+                                     os.path.join(directory, name))
+                pending.extend(os.path.join(directory, i)
+                               for i in reversed(record['dirs']))
+            if dirs != self._own(saved):
+                merged = self._own(self._read(), False)
+                merged.update(dirs)
+                write_atomic(self.path, lambda index_file: json.dump(
+                    {'version': INDEX_VERSION, 'dirs': merged}, index_file))
+            years = {}
+            for usaf, year in sorted(files):
+                years.setdefault(usaf, []).append(year)
+            self._dirs = dirs
+            self._files = files
+            self._years = years
+            self._refreshed = time.time()
+            logger.debug('Indexed %s NSRDB files in %s directories',
+                         len(files), len(dirs))
+
+    def _load(self):
+        """files, refreshed on first use."""
+        if self._files is None:
+            self.refresh()
+        return self._files
+
+    def filename(self, usaf, year):
+        """path of a station year, None if not found.
+
+        A miss refreshes the index, at most once every REFRESH seconds.
+        """
+        path = self._load().get((usaf, int(year)))
+        if path is None and time.time() - self._refreshed > REFRESH:
+            self.refresh()
+            path = self._files.get((usaf, int(year)))
+        return path
+
+    def years(self, usaf):
+        """sorted years with a file for a station."""
+        self._load()
+        return list(self._years.get(usaf, []))
+
+    def stations(self):
+        """usaf -> sorted years for every indexed station."""
+        self._load()
+        return dict((str(usaf), list(years)) for usaf, years in
+                    self._years.items())
+
+
+def file_index():
+    """FileIndex of PATH saved in the current WEATHER_DATA_PATH."""
+    key = (tuple(PATH), os.path.join(env.WEATHER_DATA_PATH, INDEX))
+    with _INDEXES_LOCK:
+        if key not in _INDEXES:
+            _INDEXES[key] = FileIndex(*key)
+        return _INDEXES[key]
+
+
+def filename(usaf, year):
+    """NSRDB file for a station year, None if not found."""
+    return file_index().filename(usaf, year)
+
+
+def available_years(usaf):
+    """years with NSRDB data for a station."""
+    return file_index().years(usaf)
+
+
+def _standard_offset(timezone):
+    """standard time UTC offset in hours.
+
+    Args:
+        timezone (str): hours, eg. '-5', or a zone name, eg.
+            'America/New_York', as in eere_meta.csv.
+
+    Raises:
+        pytz.UnknownTimeZoneError: unknown zone name, a KeyError.
+    """
+    try:
+        return float(timezone)
+    except ValueError:
+        pass
+    # NSRDB times are local standard time, so daylight saving is removed
+    when = pytz.timezone(timezone).localize(STANDARD_DATE)
+    return (when.utcoffset() - when.dst()).total_seconds() / 3600.
+
+
+def station_info(usaf):
+    """Name, time zone and place of a station.
+
+    From eere_meta.csv, else the old NOAA list, which has no time zone.
+
+    Returns:
+        dict: name, timezone (standard time hours, None if unknown),
+        latitude and longitude
+
+    Raises:
+        KeyError: station in neither catalog.
+    """
+    if usaf in EERE_META:
+        row = EERE_META[usaf]
+        return {'name': row['weather_station'],
+                'timezone': _standard_offset(row['TZ']),
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude'])}
+    for row in noaa_stations():
+        if row['station_code'] == usaf:
+            logger.warning('Time zone of %s unknown', usaf)
+            return {'name': row['station_name'], 'timezone': None,
+                    'latitude': row['LAT'], 'longitude': row['LON']}
+    raise KeyError('station not found')
+
+
 class Data():
     """data generator"""
     def __init__(self, usaf, year=2010):
-        basefile = "NSRDB_StationData_%s0101_%s1231_%s.csv" % \
-            (year, year, usaf)
-        filename = tools.find_file(basefile, PATH)
-        self.usaf_info = geo.station_info(usaf)
-        self.timezone = int(self.usaf_info['TZ'])
-        self.place = (float(self.usaf_info['Latitude']),
-                      float(self.usaf_info['Longitude']))
-        self.csvfile = None
-        try:
-            self.csvfile = open(filename)
-        except:
-            print "File not found"
+        path = filename(usaf, year)
+        if path is None:
+            raise IOError('%s not found in %s' % (
+                BASENAME % (year, year, usaf), PATH))
+        self.usaf_info = station_info(usaf)
+        self.timezone = self.usaf_info['timezone']
+        if self.timezone is None:
+            raise KeyError('time zone of %s unknown' % usaf)
+        self.place = (self.usaf_info['latitude'],
+                      self.usaf_info['longitude'])
+        self.csvfile = open(path)
         self.tmy_data = csv.DictReader(self.csvfile)
 
     def __iter__(self):
@@ -68,88 +313,212 @@ class Data():
         return t
 
     def __del__(self):
-        self.csvfile.close()
+        if getattr(self, 'csvfile', None) is not None:
+            self.csvfile.close()
+
+
+def _parse_year(job):
+    """(year, hours by field) of one station year, None if missing.
+
+    Rows are placed by hour of year from the date and time strings, so
+    the 24:00 hour stays in its own year.
+    """
+    path, year, fields = job
+    if path is None:
+        return year, None
+    with open(path) as nsrdb_file:
+        fieldnames = nsrdb_file.readline().rstrip('\r\n').split(',')
+        text = nsrdb_file.read()
+    names = [ALIASES.get(i, i) for i in fields]
+    positions = [fieldnames.index(i) for i in names]
+    dates, times = [fieldnames.index(i) for i in DATE_FIELDS]
+    parsed = csv_columns(text, positions, [dates, times])
+    local = timeaxis.strptimes(parsed[dates], timeaxis.NSRDB,
+                               times=parsed[times])
+    start = np.datetime64('%s-01-01T00:00' % year, 'm')
+    hour = (local - start).astype('timedelta64[h]').astype(np.int64) - 1
+    values = np.empty((HOURS, len(fields)))
+    values.fill(np.nan)
+    inside = (hour >= 0) & (hour < HOURS)
+    for j, position in enumerate(positions):
+        column = parsed[position]
+        column[column <= MISSING] = np.nan
+        values[hour[inside], j] = column[inside]
+    return year, values
+
+
+def load(usaf, years=YEARS, fields=('GHI (W/m^2)',), processes=None):
+    """Station years stacked into one array.
+
+    Args:
+        usaf (str): USAF code.
+        years (list): years to load.
+        fields (list): NSRDB fields, or the GHI, DNI and DHI TMY3 names of
+            the modeled irradiance.
+        processes (int): worker processes, 1 parses in this process.
+            Default one per cpu if enough years to pay for starting them,
+            see POOL_YEARS.
+
+    Returns:
+        Stack: values shaped (year, HOURS, field) in Wh/m^2, hour 0 ending
+        at 01:00 LST on January 1.  Missing hours and years are NaN.
+    """
+    years = list(years)
+    fields = list(fields)
+    values = np.empty((len(years), HOURS, len(fields)))
+    values.fill(np.nan)
+    index = file_index()
+    jobs = [(index.filename(usaf, year), year, fields) for year in years]
+    if processes is None:
+        cpus = multiprocessing.cpu_count()
+        if len(jobs) * (cpus - 1) < POOL_YEARS * cpus:
+            processes = 1
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_parse_year, jobs)
+    else:
+        results = itertools.imap(_parse_year, jobs)
+    try:
+        for year, found in results:
+            if found is None:
+                logger.warning('NSRDB %s %s not found', usaf, year)
+                continue
+            values[years.index(year)] = found
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return Stack(usaf, np.array(years), fields, values)
+
+
+def monthly_totals(stack):
+    """monthly totals in kWh/m^2 shaped (year, month, field)."""
+    totals = np.empty((len(stack.years), 12, len(stack.fields)))
+    for i, year in enumerate(stack.years):
+        bounds = MONTH_HOURS[int(year % 4 == 0 and (year % 100 != 0 or
+                                                    year % 400 == 0))]
+        sums = np.add.reduceat(np.nan_to_num(stack.values[i]), bounds[:-1])
+        present = np.add.reduceat(np.isfinite(stack.values[i]), bounds[:-1])
+        totals[i] = np.where(present > 0, sums / 1000., np.nan)
+    return totals
+
+
+def annual(stack):
+    """annual totals in kWh/m^2 shaped (year, field), NaN if no data."""
+    present = np.isfinite(stack.values).any(axis=1)
+    return np.where(present, np.nansum(stack.values, axis=1) / 1000.,
+                    np.nan)
+
+
+def statistics(stack):
+    """Interannual statistics of annual totals, years without data left out.
+
+    Returns:
+        dict: arrays by field of 'mean', 'std', 'variability' (std /
+        mean), 'p50' and 'p90' (exceeded in 50% and 90% of years), and
+        'high' and 'low' (means of the two highest and lowest years).
+    """
+    totals = annual(stack)
+    result = dict((i, np.empty(len(stack.fields))) for i in [
+        'mean', 'std', 'variability', 'p50', 'p90', 'high', 'low'])
+    for j in range(len(stack.fields)):
+        years = np.sort(totals[np.isfinite(totals[:, j]), j])
+        if not len(years):
+            for values in result.values():
+                values[j] = np.nan
+            continue
+        result['mean'][j] = years.mean()
+        result['std'][j] = years.std(ddof=1) if len(years) > 1 else 0.
+        result['variability'][j] = result['std'][j] / result['mean'][j]
+        result['p50'][j] = np.percentile(years, 50)
+        result['p90'][j] = np.percentile(years, 10)
+        result['high'][j] = years[-2:].mean()
+        result['low'][j] = years[:2].mean()
+    return result
 
 
 def monthly(usaf, year, field='GHI (W/m^2)'):
     """monthly insolation"""
-    m = []
-    lastm = 1
-    usafdata = Data(usaf, year)
-    t = 0
-    for r in usafdata:
-        r['GHI (W/m^2)'] = r['Glo Mod (Wh/m^2)']
-        r['DHI (W/m^2)'] = r['Dif Mod (Wh/m^2)']
-        r['DNI (W/m^2)'] = r['Dir Mod (Wh/m^2)']
-        if r['datetime'].month != lastm:
-            m.append(t/1000.)
-            t = 0
-            lastm = r['utc_datetime'].month
-        t += float(r[field])
-    return m
-
-
-def report(usaf):
-    """generate report for usaf base"""
+    stack = load(usaf, [year], [field], processes=1)
+    return monthly_totals(stack)[0, :, 0].tolist()
+
+
+def _plot(usaf, stack, text, tmy3tot):
+    """annual GHI chart saved as <usaf>_annual_GHI.pdf."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from scipy.interpolate import interp1d
+    totals = annual(stack)[:, 0]
+    found = np.isfinite(totals)
+    x = stack.years[found]
+    y = totals[found]
     fig = plt.figure()
     ax = fig.add_subplot(111)
-    station_info = geo.station_info(usaf)
-    y = {}
-    for i in range(1991, 2011):
-        monthData = monthly(usaf, i)
-        t = sum(monthData)
-        y[i] = t
-        print t
-    tmy3tot = tmy3.total(usaf)
-    average = sum([v for k, v in y.items()])/20.
-    s = sorted(y.items(), key=lambda t: t[1])
-    o = sorted(y.items(), key=lambda t: t[0])
-    twohigh = s[-1][1] + s[-2][1]
-    twolow = s[0][1] + s[1][1]
-    mintol = 1-twolow/2./average
-    plustol = twohigh/2./average-1
-    txt = ""
-    txt += "%s\n" % station_info['Site Name']
-    txt += 'TMY3/hist: %s/' % int(round(tmy3tot))
-    txt += '%s\n' % int(round(average))
-    txt += "high/low av: %s/" % int(round(twohigh/2.))
-    txt += "%s\n" % int(round(twolow/2.))
-    txt += "+%s/-%s%% " % (round(plustol*100, 0), round(mintol*100, 0))
-    txt += "(-%s%% of TMY3)" % round((1-twolow/2./tmy3tot)*100, 0)
-    print txt
-    x = np.array([k for k, v in o])
-    y = np.array([v for k, v in o])
-
     rx = x[1:]
-    ry = [(v + y[i+1])/2 for i, v in enumerate(y[:-1])]
-    fit = pylab.polyfit(x, y, 3)
-    fit_fn = pylab.poly1d(fit)
+    ry = (y[:-1] + y[1:]) / 2
+    fit_fn = np.poly1d(np.polyfit(x, y, 3))
     f = interp1d(x, y, kind='cubic')
     f2 = interp1d(rx, ry, kind='cubic')
     xnew = np.linspace(min(x), max(x), 200)
     x2 = np.linspace(min(rx), max(rx), 200)
-    # ax.plot(x,y)
     ax.plot(xnew, f(xnew), label="Annual GHI")
     ax.plot(xnew, fit_fn(xnew), label='trendline')
     ax.plot(x2, f2(x2), label='2 Year Ave')
-    ax.plot([min(x), max(x)], [tmy3tot, tmy3tot], linestyle='--')
-    leg = plt.legend(title=txt, loc=4, fancybox=True)
+    if tmy3tot is not None:
+        ax.plot([min(x), max(x)], [tmy3tot, tmy3tot], linestyle='--')
+    leg = plt.legend(title=text, loc=4, fancybox=True)
     leg.get_frame().set_alpha(0.5)
-    # fig.text(min(x),min(y)-min(y)*.1,txt)
-    # fig.text(.1,.1,txt)
     plt.tight_layout()
     fig.savefig('%s_annual_GHI.pdf' % (usaf), format='pdf')
+    plt.close(fig)
+
+
+def report(usaf, years=YEARS, plot=False, processes=None):
+    """Annual GHI report for a usaf base.
+
+    Args:
+        usaf (str): USAF code.
+        years (list): years of NSRDB data.
+        plot (bool): also save <usaf>_annual_GHI.pdf, needs matplotlib.
+        processes (int): see load.
+
+    Returns:
+        str: summary text
+    """
+    from . import tmy3
+    name = station_info(usaf)['name']
+    stack = load(usaf, years, processes=processes)
+    stats = dict((k, v[0]) for k, v in statistics(stack).items())
+    try:
+        tmy3tot = tmy3.total(usaf)
+    except (IOError, KeyError):
+        logger.warning('No TMY3 data for %s', usaf)
+        tmy3tot = None
+    average = stats['mean']
+    txt = ""
+    txt += "%s\n" % name
+    if tmy3tot is not None:
+        txt += 'TMY3/hist: %s/' % int(round(tmy3tot))
+    else:
+        txt += 'hist: '
+    txt += '%s\n' % int(round(average))
+    txt += "high/low av: %s/" % int(round(stats['high']))
+    txt += "%s\n" % int(round(stats['low']))
+    txt += "+%s/-%s%% " % (round((stats['high'] / average - 1) * 100, 0),
+                           round((1 - stats['low'] / average) * 100, 0))
+    if tmy3tot is not None:
+        txt += "(-%s%% of TMY3)" % round((1 - stats['low'] / tmy3tot) *
+                                          100, 0)
+    txt += "\nP50/P90: %s/%s, variability %s%%" % (
+        int(round(stats['p50'])), int(round(stats['p90'])),
+        round(stats['variability'] * 100, 1))
+    if plot:
+        _plot(usaf, stack, txt, tmy3tot)
+    return txt
 
 if __name__ == "__main__":
-    from solpy import geo
-    from solpy import tmy3
-    tilt = 32.0
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    from scipy.interpolate import interp1d
-    # from scipy import stats
-    import pylab
     usaf_stations = []
     usaf_stations.append('912850')
     usaf_stations.append('725115')  # MDT
@@ -158,4 +527,4 @@ if __name__ == "__main__":
     usaf_stations.append('724060')  # ,BALTIMORE BLT-WASHNGTN INT'L
     #
     for station in usaf_stations:
-        report(station)
+        print report(station, plot=True)
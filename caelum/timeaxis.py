@@ -0,0 +1,275 @@
+"""Vectorized time axes for weather files.
+
+Whole columns of date fields or date strings become datetime64[m] arrays
+in one pass.  The conventions of the per record functions are followed
+exactly, including "hour 24" end of day labeling:
+
+* `epw_times` matches eere._muck_w_date (hour 24 is midnight of the
+  next day, minute 60 is minute 0 of the same hour).
+* `strptimes` matches tmy3.strptime and nsrdb.strptime (hours and
+  minutes are added to midnight, so 24:00 rolls over).
+
+Examples:
+    >>> epw_times([1999], [12], [31], [24], [60])
+    array(['2000-01-01T00:00'], dtype='datetime64[m]')
+
+    >>> strptimes(['12/31/1988 24:00'], TMY3, timezone=-7)
+    array(['1989-01-01T07:00'], dtype='datetime64[m]')
+
+    >>> isotimes(['2015-01-01T06:00:00-07:00'])
+    array(['2015-01-01T13:00:00'], dtype='datetime64[s]')
+
+`resample` evaluates series on a regular grid of times, all variables in
+one call:
+
+    >>> resample(np.array(['2015-01-01T00', '2015-01-01T06'],
+    ...                   dtype='datetime64[h]'), [0., 6.], '2H')[1]
+    array([0., 2., 4., 6.])
+
+"""
+# Copyright (C) 2015 Nathan Charles
+#
+# This program is free software. See terms in LICENSE file.
+
+import datetime
+import re
+import numpy as np
+from scipy.interpolate import interp1d, PchipInterpolator
+
+# (start, stop) of year, month, day, hour, minute
+TMY3 = ((6, 10), (0, 2), (3, 5), (11, 13), (14, 16))   # MM/DD/YYYY HH:MM
+NSRDB = ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16))  # YYYY-MM-DD HH:MM
+# YYYY-MM-DDTHH:MM:SS then +HH:MM, -HH:MM, Z or nothing
+ISO = ((0, 4), (5, 7), (8, 10), (11, 13), (14, 16), (17, 19))
+ISO_OFFSET = ((20, 22), (23, 25))
+
+FREQUENCY = re.compile('^(\\d*)(D|H|min|T|S)$')
+UNITS = {'D': 'D', 'H': 'h', 'min': 'm', 'T': 'm', 'S': 's'}
+# method -> fewest samples it can fit
+METHODS = {'linear': 2, 'cubic': 4, 'pchip': 2}
+OUT_OF_RANGE = ('nan', 'clip', 'extrapolate', 'raise')
+
+
+def offset(hours):
+    """timedelta64[m] for an hour offset such as a time zone."""
+    return np.timedelta64(int(round(hours * 60)), 'm')
+
+
+def dates(year, month, day):
+    """datetime64[D] from year, month and day columns."""
+    year, month, day = [np.asarray(i, dtype=np.int64)
+                        for i in (year, month, day)]
+    months = (year - 1970) * 12 + month - 1
+    return months.astype('datetime64[M]').astype('datetime64[D]') + \
+        (day - 1).astype('timedelta64[D]')
+
+
+def epw_times(year, month, day, hour, minute=0):
+    """EPW date field columns to local time.
+
+    Args:
+        year, month, day, hour, minute (array): EPW fields, hour 1-24.
+
+    Returns:
+        datetime64[m] array
+    """
+    hour = np.asarray(hour, dtype=np.int64)
+    minute = np.asarray(minute, dtype=np.int64)
+    days = dates(year, month, day) + (hour // 24).astype('timedelta64[D]')
+    return days.astype('datetime64[m]') + \
+        (hour % 24 * 60 + minute % 60).astype('timedelta64[m]')
+
+
+def _chars(strings, width):
+    """fixed width string column as a matrix of digit values."""
+    chars = np.asarray(strings, dtype='S%s' % width)
+    return chars.view(np.uint8).reshape(-1, width).astype(np.int64) - 48
+
+
+def _fields(chars, layout):
+    """integer columns of digit matrix positions in layout."""
+    fields = []
+    for start, stop in layout:
+        digits = chars[:, start:stop]
+        if ((digits < 0) | (digits > 9)).any():
+            raise ValueError('malformed date string')
+        fields.append(np.dot(digits, 10 ** np.arange(stop - start - 1, -1,
+                                                     -1)))
+    return fields
+
+
+def strptimes(strings, layout=TMY3, timezone=0, times=None):
+    """Date time string column to datetime64.
+
+    Args:
+        strings (array): date time strings, or dates if times is given.
+        layout (tuple): positions of year, month, day, hour and minute,
+            eg. TMY3 or NSRDB.
+        timezone (float): hours subtracted, as in tmy3.strptime.
+        times (array): 'HH:MM' strings to join to date strings.
+
+    Returns:
+        datetime64[m] array
+
+    Raises:
+        ValueError: non digit characters in a date or time field.
+    """
+    if times is not None:
+        date_width = layout[3][0] - 1
+        chars = np.hstack((_chars(strings, date_width),
+                           np.zeros((len(strings), 1), np.int64),
+                           _chars(times, 5)))
+    else:
+        chars = _chars(strings, layout[4][1])
+    year, month, day, hour, minute = _fields(chars, layout)
+    return dates(year, month, day).astype('datetime64[m]') + \
+        (hour * 60 + minute).astype('timedelta64[m]') - offset(timezone)
+
+
+def isotimes(strings):
+    """ISO 8601 date time string column to UTC.
+
+    Args:
+        strings (array): 'YYYY-MM-DDTHH:MM:SS' strings with a '+HH:MM' or
+            '-HH:MM' offset, 'Z' or no offset for UTC.
+
+    Returns:
+        datetime64[s] array
+
+    Raises:
+        ValueError: malformed strings.
+    """
+    chars = _chars(strings, 25)
+    year, month, day, hour, minute, second = _fields(chars, ISO)
+    sign = chars[:, 19] + 48
+    shifted = (sign == ord('+')) | (sign == ord('-'))
+    if not (shifted | (sign == ord('Z')) | (sign == 0)).all():
+        raise ValueError('malformed time zone')
+    minutes = np.zeros(len(chars), dtype=np.int64)
+    if shifted.any():
+        hours, extra = _fields(chars[shifted], ISO_OFFSET)
+        minutes[shifted] = np.where(sign[shifted] == ord('-'), -1, 1) * \
+            (hours * 60 + extra)
+    return dates(year, month, day).astype('datetime64[s]') + \
+        (hour * 3600 + (minute - minutes) * 60 + second).astype(
+            'timedelta64[s]')
+
+
+def to_utc(local, timezone):
+    """local standard time to UTC.
+
+    Args:
+        local (array): datetime64 local times.
+        timezone (float): hours east of UTC.
+    """
+    return local - offset(timezone)
+
+
+def timedelta(freq):
+    """timedelta64 for a frequency such as '1H', '30min' or '15T'.
+
+    timedelta and timedelta64 values are returned as timedelta64.
+    """
+    if isinstance(freq, np.timedelta64):
+        return freq
+    if isinstance(freq, datetime.timedelta):
+        return np.timedelta64(int(freq.total_seconds()), 's')
+    match = FREQUENCY.match(str(freq).strip())
+    if not match:
+        raise ValueError('unknown frequency %r' % (freq,))
+    return np.timedelta64(int(match.group(1) or 1), UNITS[match.group(2)])
+
+
+def _seconds(times):
+    """datetime64 array to float seconds since the epoch."""
+    return np.asarray(times, dtype='datetime64[s]').astype(np.int64) \
+        .astype(np.float64)
+
+
+def _fit(x, y, grid, method):
+    """columns of y (sample, column) at grid, extrapolating."""
+    if method == 'linear':
+        i = np.clip(np.searchsorted(x, grid, 'right') - 1, 0, len(x) - 2)
+        t = ((grid - x[i]) / (x[i + 1] - x[i]))[:, None]
+        return y[i] + t * (y[i + 1] - y[i])
+    if method == 'cubic':
+        return interp1d(x, y, 'cubic', axis=0, assume_sorted=True,
+                        fill_value='extrapolate')(grid)
+    return PchipInterpolator(x, y, axis=0, extrapolate=True)(grid)
+
+
+def resample(times, values, freq='1H', method='linear', start=None,
+             horizon=None, out_of_range='nan', axis=0):
+    """Series values on a regular time grid.
+
+    Every variable is evaluated on the whole grid at once.  NaN samples
+    are left out of the fit of their own variable only.
+
+    Args:
+        times (array): increasing datetime64 sample times.
+        values (array): samples, time along axis, any other shape.
+        freq: grid step, see timedelta.
+        method (str): 'linear', 'cubic' (spline) or 'pchip' (monotone
+            cubic, no overshoot).
+        start (datetime64): first grid time, default first sample.
+        horizon: grid length as for freq, default through the last
+            sample.  Grid times are start + k * freq < start + horizon.
+        out_of_range (str): grid times outside a variable's samples are
+            'nan', 'clip' (nearest sample), 'extrapolate' (by method) or
+            'raise' ValueError.
+        axis (int): time axis of values.
+
+    Returns:
+        tuple: (grid datetime64 array, values with the grid on axis)
+    """
+    if method not in METHODS:
+        raise ValueError('unknown method %r' % (method,))
+    if out_of_range not in OUT_OF_RANGE:
+        raise ValueError('unknown out_of_range %r' % (out_of_range,))
+    times = np.asarray(times, dtype='datetime64')
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), axis, 0)
+    if values.shape[0] != len(times):
+        raise ValueError('%s times for %s samples' % (len(times),
+                                                      values.shape[0]))
+    x = _seconds(times)
+    if (np.diff(x) <= 0).any():
+        raise ValueError('times must be increasing')
+    step = timedelta(freq)
+    start = times[0] if start is None else np.datetime64(start)
+    if horizon is None:
+        count = (times[-1] - start) // step + 1 if len(times) else 0
+    else:
+        count = -(-timedelta(horizon) // step)
+    grid = start + np.arange(max(count, 0)) * step
+    shape = values.shape[1:]
+    y = values.reshape(len(x), -1)
+    at = _seconds(grid)
+    result = np.empty((len(grid), y.shape[1]))
+    result.fill(np.nan)
+    first = np.zeros(y.shape[1], dtype=np.int64)
+    last = np.zeros(y.shape[1], dtype=np.int64)
+    fits = np.zeros(y.shape[1], dtype=bool)
+    finite = np.isfinite(y)
+    full = finite.all(axis=0)
+    if full.any() and len(x) >= METHODS[method]:
+        result[:, full] = _fit(x, y[:, full], at, method)
+        last[full] = len(x) - 1
+        fits |= full
+    for k in np.flatnonzero(~full):
+        rows = np.flatnonzero(finite[:, k])
+        if len(rows) >= METHODS[method]:
+            result[:, k] = _fit(x[rows], y[rows, k:k + 1], at, method)[:, 0]
+            first[k], last[k] = rows[0], rows[-1]
+            fits[k] = True
+    below = at[:, None] < x[first]
+    above = at[:, None] > x[last]
+    if out_of_range == 'raise' and (fits & (below | above)).any():
+        raise ValueError('grid outside the samples')
+    if out_of_range == 'clip':
+        columns = np.arange(y.shape[1])
+        result = np.where(below, y[first, columns], result)
+        result = np.where(above, y[last, columns], result)
+        result[:, ~fits] = np.nan
+    elif out_of_range == 'nan':
+        result[below | above] = np.nan
+    return grid, np.moveaxis(result.reshape((len(grid),) + shape), 0, axis)
@@ -7,18 +7,47 @@ Examples:
     >>> round(total('724666', 'DNI (W/m^2)')/365.,2)
     5.11
 
+    >>> station('724666')['latitude']
+    39.742
+
+    Monthly mean and 90th percentile GHI and DNI at two stations
+
+    >>> aggregate(['724666', '725650'], ['GHI (W/m^2)', 'DNI (W/m^2)'],
+    ...           by='month', stats=['mean', 'p90']).values.shape
+    (2, 12, 2, 2)
+
 """
 import csv
 # Copyright (C) 2015 Nathan Charles
 #
 # This program is free software. See terms in LICENSE file.
 
+import collections
 import datetime
 import os
 import logging
+import threading
+import numpy as np
 logger = logging.getLogger(__name__)
-from .tools import download
+from .tools import download, csv_columns, noaa_stations, EERE_META, \
+    TMY3_STATIONS
+from .cache import cached
 from . import env
+from . import timeaxis
+
+# bump when _parse_tmy3 changes to invalidate cached columns
+TMY3_CACHE_VERSION = 1
+DATE_FIELDS = ['Date (MM/DD/YYYY)', 'Time (HH:MM)']
+
+# first day of year of each month, TMY3 has no leap days
+DAY_OF_YEAR = np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+REDUCERS = {'sum': np.nansum, 'mean': np.nanmean, 'min': np.nanmin,
+            'max': np.nanmax}
+Aggregate = collections.namedtuple('Aggregate',
+                                   'usafs groups fields stats values')
+
+_COORDINATES = {}
+_COORDINATES_LOCK = threading.Lock()
 
 # path to tmy3 data
 # default = ~/tmp3/
@@ -40,11 +69,69 @@ def tmybasename(usaf):
 
     Returns:
         (str)
+
+    Raises:
+        KeyError: usaf is not in the TMY3 catalog.
+    """
+    return TMY3_STATIONS[usaf]['filename']
+
+
+def _coordinates():
+    """usaf -> (latitude, longitude), built once per process.
+
+    eere_meta.csv is preferred to the less precise old NOAA list.
+    """
+    if not _COORDINATES:
+        with _COORDINATES_LOCK:
+            if not _COORDINATES:
+                found = {}
+                for row in noaa_stations():
+                    found[row['station_code']] = (row['LAT'], row['LON'])
+                for row in reversed(EERE_META.rows()):
+                    found[row['station_code']] = (float(row['latitude']),
+                                                  float(row['longitude']))
+                _COORDINATES.update(found)
+    return _COORDINATES
+
+
+def station(usaf):
+    """TMY3 catalog entry.
+
+    Args:
+        usaf (str): USAF code
+
+    Returns:
+        dict: filename, usaf, name, latitude and longitude, coordinates
+        None if no catalog has them.
+
+    Raises:
+        KeyError: usaf is not in the TMY3 catalog.
+    """
+    found = TMY3_STATIONS[usaf]
+    found['latitude'], found['longitude'] = _coordinates().get(
+        usaf, (None, None))
+    return found
+
+
+def search(name):
+    """TMY3 catalog entries with name in the station name, see station."""
+    return [station(i['usaf']) for i in TMY3_STATIONS.search('name', name)]
+
+
+def coordinates(usafs):
+    """latitude and longitude arrays for many USAF codes, NaN if unknown.
+
+    Raises:
+        KeyError: a code is not in the TMY3 catalog.
     """
-    url_file = open(env.SRC_PATH + '/tmy3.csv')
-    for line in url_file.readlines():
-        if line.find(usaf) is not -1:
-            return line.rstrip().partition(',')[0]
+    known = _coordinates()
+    lats = np.empty(len(usafs))
+    lons = np.empty(len(usafs))
+    for i, usaf in enumerate(usafs):
+        if usaf not in TMY3_STATIONS:
+            raise KeyError('station not found')
+        lats[i], lons[i] = known.get(usaf, (np.nan, np.nan))
+    return lats, lons
 
 
 def _tmy_url(usaf):
@@ -67,6 +154,30 @@ def strptime(string, timezone=0):
         datetime.timedelta(hours=timezone)
 
 
+def _parse_tmy3(filename):
+    """TMY3 csv fields and local 'datetime' as columns.
+
+    Date, time and source flag columns are strings, the rest float32.
+    """
+    with open(filename) as tmy_file:
+        tmy_file.readline()
+        fieldnames = tmy_file.readline().rstrip('\r\n').split(',')
+        text = tmy_file.read()
+    strings = [i for i, name in enumerate(fieldnames)
+               if name in DATE_FIELDS or 'source' in name]
+    numeric = [i for i in range(len(fieldnames)) if i not in strings]
+    parsed = csv_columns(text, numeric, strings)
+    columns = {}
+    for i, name in enumerate(fieldnames):
+        if i in strings:
+            columns[name] = parsed[i]
+        else:
+            columns[name] = parsed[i].astype(np.float32)
+    columns['datetime'] = timeaxis.strptimes(
+        columns['Date (MM/DD/YYYY)'], times=columns['Time (HH:MM)'])
+    return columns
+
+
 def normalize_date(tmy_date, year):
     """change TMY3 date to an arbitrary year.
 
@@ -107,6 +218,7 @@ class data(object):
             (object)
         """
         filename = env.WEATHER_DATA_PATH + '/' + usaf + 'TYA.csv'
+        self.filename = filename
         self.csvfile = None
         try:
             self.csvfile = open(filename)
@@ -133,18 +245,133 @@ class data(object):
         record['datetime'] = strptime(_sd)
         return record
 
+    def to_arrays(self, fields=None, cache=True):
+        """Whole file as columns, without building a record per hour.
+
+        Reads the file independently of iteration.  With cache, later
+        calls memory-map the columns from a sidecar cache, see
+        `caelum.cache`.
+
+        Args:
+            fields (list): TMY3 fields to return. Default all.
+            cache (bool): use and fill the binary column cache.
+
+        Returns:
+            dict: field -> array (float32, str for date, time and source
+            flags) plus datetime64[m] 'datetime' and 'utc_datetime'.
+            Cached arrays are read only.
+        """
+        wanted = None
+        if fields is not None:
+            wanted = list(fields) + ['datetime']
+        if cache:
+            parsed = cached(self.filename, _parse_tmy3, TMY3_CACHE_VERSION,
+                            wanted)
+        else:
+            parsed = _parse_tmy3(self.filename)
+        if fields is None:
+            fields = [i for i in parsed if i != 'datetime']
+        columns = dict((i, parsed[i]) for i in fields)
+        columns['datetime'] = parsed['datetime']
+        columns['utc_datetime'] = timeaxis.to_utc(parsed['datetime'],
+                                                  self.tz)
+        return columns
+
     def __del__(self):
         """del."""
-        self.csvfile.close()
+        if getattr(self, 'csvfile', None) is not None:
+            self.csvfile.close()
+
+
+def _groups(by, dates, times):
+    """group labels and each hour's group index for a TMY3 file.
+
+    Groups come from the date and time strings, so the 24:00 hour stays
+    in its own day, month and year.
+    """
+    if by == 'year':
+        return np.array(['TMY']), np.zeros(len(dates), dtype=np.int64)
+    if by == 'hour-of-day':
+        hour = timeaxis._fields(timeaxis._chars(times, 2), ((0, 2),))[0]
+        return np.arange(24), hour - 1
+    month, day = timeaxis._fields(timeaxis._chars(dates, 5),
+                                  ((0, 2), (3, 5)))
+    if by == 'month':
+        return np.arange(1, 13), month - 1
+    if by == 'day':
+        return np.arange(1, 366), DAY_OF_YEAR[month - 1] + day - 1
+    raise ValueError('unknown grouping %r' % (by,))
+
+
+def _reduce(padded, stat):
+    """stat over axis 2 of NaN padded (station, group, hour, field)."""
+    if stat in REDUCERS:
+        return REDUCERS[stat](padded, axis=2)
+    if stat.startswith('p'):
+        try:
+            percent = float(stat[1:])
+        except ValueError:
+            percent = None
+        if percent is not None and 0 <= percent <= 100:
+            return np.nanpercentile(padded, percent, axis=2)
+    raise ValueError('unknown statistic %r' % (stat,))
+
+
+def aggregate(usaf, fields=('GHI (W/m^2)',), by='year', stats=('sum',),
+              cache=True):
+    """Statistics of TMY3 fields by year, month, day or hour of day.
+
+    Each station's columns are read once (see data.to_arrays) and every
+    field and statistic is computed over all stations together.
+
+    Args:
+        usaf (str or list): USAF code or codes.
+        fields (list): numeric TMY3 fields.
+        by (str): 'year', 'month', 'day' (of year) or 'hour-of-day'
+            (hour starting, local standard time).
+        stats (list): 'sum', 'mean', 'min', 'max' or percentiles such as
+            'p50' and 'p90'.
+        cache (bool): use the binary column cache.
+
+    Returns:
+        Aggregate: usafs, groups (labels), fields, stats and values shaped
+        (station, group, field, stat).
+    """
+    usafs = [usaf] if isinstance(usaf, basestring) else list(usaf)
+    fields = list(fields)
+    stats = list(stats)
+    members = []
+    groups = None
+    for code in usafs:
+        columns = data(code).to_arrays(fields + DATE_FIELDS, cache)
+        groups, index = _groups(by, columns[DATE_FIELDS[0]],
+                                columns[DATE_FIELDS[1]])
+        values = np.column_stack([np.asarray(columns[i], dtype=np.float64)
+                                  for i in fields])
+        members.append((index, values))
+    if groups is None:
+        groups = _groups(by, [], [])[0]
+    size = 0
+    for index, _ in members:
+        size = max([size] + np.bincount(index, minlength=len(groups))
+                   .tolist())
+    padded = np.empty((len(usafs), len(groups), size, len(fields)))
+    padded.fill(np.nan)
+    for k, (index, values) in enumerate(members):
+        order = np.argsort(index, kind='mergesort')
+        index = index[order]
+        starts = np.searchsorted(index, np.arange(len(groups)))
+        padded[k, index, np.arange(len(index)) - starts[index]] = \
+            values[order]
+    result = np.empty((len(usafs), len(groups), len(fields), len(stats)))
+    for j, stat in enumerate(stats):
+        result[..., j] = _reduce(padded, stat)
+    return Aggregate(usafs, groups, fields, stats, result)
 
 
 def total(usaf, field='GHI (W/m^2)'):
     """total annual insolation, defaults to GHI."""
-    running_total = 0
-    usafdata = data(usaf)
-    for record in usafdata:
-        running_total += float(record[field])
-    return running_total/1000.
+    return aggregate(usaf, [field]).values[0, 0, 0, 0]/1000.
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -1,12 +1,22 @@
 """Helper functions."""
+import collections
 import csv
+import httplib
 import os
-import urllib2
+import re
+import shutil
+import socket
+import time
+import urlparse
 import zipfile
 import tempfile
+import threading
 import logging
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from scipy.spatial import cKDTree
 from . import env
-from geopy.distance import great_circle
+from geopy.distance import EARTH_RADIUS
 
 SRC_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -14,36 +24,615 @@ SLON = {'W': -1.0,
         'E': 1.0}
 SLAT = {'N': 1.0,
         'S': -1.0}
+KM_PER_MILE = 1.609344
+POW10 = 10.0 ** np.arange(32)
+# csv_columns lookup tables by character code
+DIGIT_VALUE = np.zeros(256)
+DIGIT_VALUE[48:58] = np.arange(10)
+IS_DIGIT = np.zeros(256, np.intp)
+IS_DIGIT[48:58] = 1
+# points, signs and other characters counted in 16 bit fields
+CHAR_FLAGS = np.full(256, 1 << 32, np.int64)
+CHAR_FLAGS[48:58] = 0
+CHAR_FLAGS[[10, 44]] = 0
+CHAR_FLAGS[46] = 1
+CHAR_FLAGS[[43, 45]] = 1 << 16
 logger = logging.getLogger(__name__)
 
 
+class StationRegistry(object):
+
+    """Lazily loaded, indexed station catalog.
+
+    The catalog file is parsed once, on first use, and shared by every
+    caller in the process.  Stations are keyed by `key`; when a key repeats
+    (e.g. a station with both ETMY and IWEC data) the first row wins for
+    keyed lookups, as with the old linear scans, while the secondary
+    indexes and `variants` keep every row.
+
+    Args:
+        filename (str): path to csv catalog.
+        key (str): unique station field.
+        indexes (tuple): fields with a secondary index.
+        fieldnames (list): column names for catalogs without a header.
+        pattern (str): regular expression station codes must match; other
+            rows, such as stray markup, are skipped.
+    """
+
+    def __init__(self, filename, key='station_code', indexes=(),
+                 fieldnames=None, pattern=None):
+        self.filename = filename
+        self.key = key
+        self.index_fields = tuple(indexes)
+        self.fieldnames = fieldnames
+        self.pattern = re.compile(pattern) if pattern else None
+        self._stations = None
+        self._rows = None
+        self._variants = None
+        self._order = None
+        self._indexes = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """parse catalog on first use."""
+        if self._stations is None:
+            with self._lock:
+                if self._stations is None:
+                    self._build()
+        return self._stations
+
+    def _build(self):
+        """build primary and secondary indexes."""
+        stations = {}
+        rows = []
+        variants = {}
+        order = []
+        indexes = dict((field, {}) for field in self.index_fields)
+        with open(self.filename) as catalog:
+            for row in csv.DictReader(catalog, fieldnames=self.fieldnames):
+                code = row[self.key]
+                if code is None or (self.pattern is not None and
+                                    not self.pattern.match(code)):
+                    continue
+                rows.append(row)
+                if code not in stations:
+                    stations[code] = row
+                    order.append(code)
+                variants.setdefault(code, []).append(row)
+                for field in self.index_fields:
+                    indexes[field].setdefault(row[field], []).append(row)
+        logger.debug('Indexed %s stations from %s', len(order),
+                     self.filename)
+        self._rows = rows
+        self._variants = variants
+        self._order = order
+        self._indexes = indexes
+        self._stations = stations
+
+    def __getitem__(self, station_code):
+        """Station information.
+
+        Args:
+            station_code (str): station code.
+
+        Returns (dict): copy of station row.
+        """
+        try:
+            return dict(self._load()[station_code])
+        except KeyError:
+            raise KeyError('station not found')
+
+    def __contains__(self, station_code):
+        return station_code in self._load()
+
+    def __iter__(self):
+        """station codes in catalog order."""
+        self._load()
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._load())
+
+    def get(self, station_code, default=None):
+        """Station information or default."""
+        try:
+            return self[station_code]
+        except KeyError:
+            return default
+
+    def rows(self):
+        """All catalog rows, including repeated station codes.
+
+        Returns (list): station rows, in catalog order.
+        """
+        self._load()
+        return [dict(row) for row in self._rows]
+
+    def variants(self, station_code):
+        """All catalog rows for a station code.
+
+        Returns (list): station rows, in catalog order.
+        """
+        self._load()
+        return [dict(row) for row in self._variants.get(station_code, [])]
+
+    def lookup(self, field, value):
+        """Stations with an indexed field equal to value.
+
+        Args:
+            field (str): indexed field, eg. 'country'.
+            value (str): value to match.
+
+        Returns (list): station rows, in catalog order.
+        """
+        self._load()
+        if field not in self._indexes:
+            raise KeyError('%s is not indexed' % field)
+        return [dict(row) for row in self._indexes[field].get(value, [])]
+
+    def search(self, field, text):
+        """Stations with text in a field, ignoring case.
+
+        Args:
+            field (str): field to search, eg. 'name'.
+            text (str): text to find.
+
+        Returns (list): station rows, in catalog order.
+        """
+        self._load()
+        text = text.lower()
+        return [dict(self._stations[code]) for code in self._order
+                if text in (self._stations[code][field] or '').lower()]
+
+
+EERE_STATIONS = StationRegistry(env.SRC_PATH + '/eere.csv',
+                                indexes=('country', 'region', 'data_format'))
+EERE_META = StationRegistry(env.SRC_PATH + '/eere_meta.csv',
+                            indexes=('state',))
+TMY3_STATIONS = StationRegistry(env.SRC_PATH + '/tmy3.csv', key='usaf',
+                                fieldnames=['filename', 'usaf', 'name'],
+                                pattern='\\d{6}$')
+
+
+def csv_columns(text, numeric=(), strings=()):
+    """Vectorized parse of comma separated rows into columns.
+
+    Numeric fields are decoded straight from the bytes, one character
+    position at a time from the right for all fields at once, with no
+    Python call per value.  Plain decimals (optional leading sign and
+    point) take this path; columns with any other field, eg. exponents,
+    are converted with float().  Either way a value is what float() gives
+    and empty fields are NaN.  Trailing blank lines are ignored.
+
+    Args:
+        text (str): rows with the same number of fields.
+        numeric (list): column positions to decode as float64.
+        strings (list): column positions to return as string arrays.
+
+    Returns:
+        dict: column position -> array
+
+    Raises:
+        ValueError: ragged rows or fields float() rejects.
+    """
+    text = text.replace('\r', '')
+    if not text.endswith('\n') or text.endswith('\n\n'):
+        text = text.rstrip('\n') + '\n'
+    if text == '\n':
+        return dict((i, np.empty(0)) for i in list(numeric) + list(strings))
+    ncols = text.count(',', 0, text.index('\n')) + 1
+    # a leading newline is the separator before the first field
+    text = '\n' + text
+    buf = np.frombuffer(text, np.uint8)
+    bounds = np.flatnonzero((buf == 44) | (buf == 10))
+    nrows = (len(bounds) - 1) // ncols
+    separators = buf.take(bounds[1:])
+    if len(bounds) != nrows * ncols + 1 or \
+            (separators[ncols - 1::ncols] != 10).any() or \
+            np.count_nonzero(separators == 10) != nrows:
+        raise ValueError('rows have differing numbers of fields')
+    before = bounds[:-1].reshape(nrows, ncols)
+    ends = bounds[1:].reshape(nrows, ncols)
+    columns = {}
+    for col in strings:
+        columns[col] = np.array(_fields(text, before[:, col], ends[:, col]))
+    numeric = list(numeric)
+    if not numeric:
+        return columns
+    # one row per column, widest first, so the columns still being
+    # decoded at each position are a leading slice
+    before = before[:, numeric].T
+    last = ends[:, numeric].T - 1
+    widths = (last - before).max(axis=1)
+    order = np.argsort(-widths, kind='mergesort')
+    last = last[order]
+    before = before[order]
+    widths = widths[order]
+    mantissa = np.zeros(last.shape)
+    digits = np.zeros(last.shape, np.intp)
+    point = np.zeros(last.shape, np.intp)
+    flags = np.zeros(last.shape, np.int64)
+    for k in range(widths[0]):
+        n = np.count_nonzero(widths > k)
+        # positions left of a field read the separator before it
+        chars = buf.take(np.maximum(last[:n] - k, before[:n]))
+        mantissa[:n] += DIGIT_VALUE.take(chars) * POW10.take(digits[:n])
+        point[:n] += (chars == 46) * digits[:n]
+        digits[:n] += IS_DIGIT.take(chars)
+        flags[:n] += CHAR_FLAGS.take(chars)
+    first = buf.take(before + 1)
+    empty = last == before
+    values = mantissa / POW10.take(point)
+    values[first == 45] *= -1
+    values[empty] = np.nan
+    # only characters of plain decimals, a sign only as first character,
+    # at most one point and, unless the field is empty, at least one digit
+    plain = ~(((flags >> 32) != 0) | ((flags & 0xffff) > 1) |
+              ((flags >> 16) & 0xffff != (first == 43) | (first == 45)) |
+              ((digits == 0) & ~empty)).any(axis=1)
+    for i, col in enumerate(order):
+        if not plain[i]:
+            values[i] = [float(j) if j else np.nan for j in
+                         _fields(text, before[i], last[i] + 1)]
+        columns[numeric[col]] = values[i]
+    return columns
+
+
+def _fields(text, before, ends):
+    """strings between separator positions."""
+    return [text[i + 1:j] for i, j in zip(before.tolist(), ends.tolist())]
+
+
+USER_AGENT = 'caelum/0.1 +https://github.com/nrcharles/caelum'
+TIMEOUT = 30.0
+RETRIES = 3
+BACKOFF = 0.5
+WORKERS = 8
+BLOCK_SIZE = 2 ** 16
+RETRY_STATUS = (429, 500, 502, 503, 504)
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+# statuses whose body is written to out by default
+STREAM_STATUS = (200, 206)
+
+Response = collections.namedtuple('Response', 'url status headers body')
+
+
+class FetchError(IOError):
+
+    """HTTP request failed after any retries.
+
+    Attributes:
+        url (str): requested url.
+        status (int): last HTTP status, None for connection errors.
+    """
+
+    def __init__(self, message, url, status=None):
+        IOError.__init__(self, '%s: %s' % (message, url))
+        self.url = url
+        self.status = status
+
+
+class ConnectionPool(object):
+
+    """Idle keep-alive connections by scheme and host.
+
+    Args:
+        timeout (float): socket timeout in seconds.
+        size (int): idle connections kept per host.
+    """
+
+    def __init__(self, timeout=TIMEOUT, size=WORKERS):
+        self.timeout = timeout
+        self.size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """(connection, reused) for a host."""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def put(self, scheme, netloc, connection):
+        """return a connection for reuse."""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """close idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class Fetcher(object):
+
+    """HTTP GETs over pooled keep-alive connections.
+
+    Connection errors, timeouts and 429/5xx responses are retried with
+    exponential backoff; redirects are followed.  A request that failed on
+    a reused connection, which the server may have closed, is repeated
+    once on a new connection without counting as a retry.
+
+    Args:
+        timeout (float): socket timeout in seconds.
+        retries (int): retries after the first attempt.
+        backoff (float): seconds before the first retry, doubled after
+            each one.
+        workers (int): threads used by fetch_many.
+        max_redirects (int): redirects followed per request.
+    """
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 workers=WORKERS, max_redirects=5):
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+        self.max_redirects = max_redirects
+        self.pool = ConnectionPool(timeout, workers)
+
+    def _request(self, url, headers, out, expect=STREAM_STATUS):
+        """one attempt on a pooled connection."""
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection, reused = self.pool.get(parts.scheme, parts.netloc)
+        start = out.tell() if out is not None else None
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            if out is not None and response.status in expect:
+                body = None
+                block = response.read(BLOCK_SIZE)
+                while block:
+                    out.write(block)
+                    block = response.read(BLOCK_SIZE)
+            elif out is not None and response.status < 300:
+                # a body out must not get, eg. a whole file for a Range,
+                # dropped with the connection instead of read
+                connection.close()
+                return Response(url, response.status,
+                                dict(response.getheaders()), None)
+            else:
+                body = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if reused:
+                if out is not None:
+                    out.seek(start)
+                    out.truncate()
+                return self._request(url, headers, out, expect)
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(parts.scheme, parts.netloc, connection)
+        return Response(url, response.status,
+                        dict(response.getheaders()), body)
+
+    def fetch(self, url, headers=None, out=None, expect=None):
+        """GET url.
+
+        Args:
+            url (str): http or https url.
+            headers (dict): extra request headers, eg. Range.
+            out (file): write the body here in blocks instead of holding
+                it in memory.
+            expect (tuple): success statuses whose body is written to
+                out, eg. (206,) for a Range.  Default 200 and 206.
+
+        Returns:
+            Response: url, status, headers (lower case names), body (None
+            if out is given).
+
+        Raises:
+            FetchError: error or unexpected status, or retries exhausted.
+        """
+        expect = expect or STREAM_STATUS
+        request_headers = {'User-Agent': USER_AGENT}
+        request_headers.update(headers or {})
+        start = out.tell() if out is not None else None
+        redirects = 0
+        attempt = 0
+        while True:
+            logger.debug('GET %s', url)
+            try:
+                response = self._request(url, request_headers, out, expect)
+                error = None
+            except (httplib.HTTPException, socket.error) as err:
+                response = None
+                error = err
+            if response is not None and \
+                    response.status in REDIRECT_STATUS and \
+                    'location' in response.headers:
+                redirects += 1
+                if redirects > self.max_redirects:
+                    raise FetchError('Too many redirects', url,
+                                     response.status)
+                url = urlparse.urljoin(url, response.headers['location'])
+                continue
+            if response is not None and \
+                    response.status not in RETRY_STATUS:
+                if response.status >= 400:
+                    raise FetchError('HTTP %s' % response.status, url,
+                                     response.status)
+                if out is not None and response.status not in expect:
+                    raise FetchError('Unexpected HTTP %s' % response.status,
+                                     url, response.status)
+                return response
+            if attempt >= self.retries:
+                if error is not None:
+                    raise FetchError(str(error), url)
+                raise FetchError('HTTP %s' % response.status, url,
+                                 response.status)
+            delay = self.backoff * 2 ** attempt
+            attempt += 1
+            logger.info('Retrying %s in %.1fs', url, delay)
+            if out is not None:
+                out.seek(start)
+                out.truncate()
+            time.sleep(delay)
+
+    def fetch_many(self, requests, out=None, done=None, limit=None):
+        """GET many urls concurrently over at most `workers` threads.
+
+        A failing request does not cancel the others; every request is
+        finished before the first error is raised.
+
+        Args:
+            requests (list): urls, or (url, headers) or (url, headers,
+                expect) tuples.
+            out (list): files for each body, as in fetch.
+            done (function): called as done(position, response) from the
+                worker thread as each request completes.
+            limit (RateLimit): spaces the start of requests.
+
+        Returns:
+            list: Response for each request, in order.
+
+        Raises:
+            FetchError: from the first failing request.
+        """
+        jobs = []
+        for i, request in enumerate(requests):
+            if isinstance(request, basestring):
+                request = (request,)
+            url, headers, expect = (tuple(request) + (None, None))[:3]
+            jobs.append((i, url, headers, out[i] if out else None, expect))
+
+        def run(job):
+            if limit is not None:
+                limit.wait()
+            response = self.fetch(*job[1:])
+            if done is not None:
+                done(job[0], response)
+            return response
+
+        if len(jobs) < 2:
+            return [run(i) for i in jobs]
+        pool = ThreadPool(min(self.workers, len(jobs)))
+        try:
+            return pool.map(run, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+
+FETCHER = Fetcher()
+
+
+def fetch(url, headers=None, out=None, expect=None):
+    """GET url with the shared Fetcher, see Fetcher.fetch."""
+    return FETCHER.fetch(url, headers, out, expect)
+
+
+def fetch_many(requests, out=None, done=None, limit=None):
+    """GET urls concurrently with the shared Fetcher."""
+    return FETCHER.fetch_many(requests, out, done, limit)
+
+
+class RateLimit(object):
+
+    """Spaces calls at least 1 / rate seconds apart across threads.
+
+    Args:
+        rate (float): calls per second, None or 0 for no limit.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = 0.
+
+    def wait(self):
+        """block until the next call may start."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + 1. / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+# read once, the umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def write_atomic(filename, write):
+    """atomically create or replace filename.
+
+    write(file) fills a temporary file in the same directory, which is
+    then renamed to filename, so readers never see a partial file.  The
+    file gets the permissions open() would give it, not the owner only
+    mode of temporary files.
+    """
+    handle, temp = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(filename),
+        dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            write(temp_file)
+        os.chmod(temp, 0666 & ~UMASK)
+        os.rename(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
 def download(url, filename):
-    """download and extract file."""
+    """stream url to filename."""
     logger.info("Downloading %s", url)
-    request = urllib2.Request(url)
-    request.add_header('User-Agent',
-                       'caelum/0.1 +https://github.com/nrcharles/caelum')
-    opener = urllib2.build_opener()
-    local_file = open(filename, 'w')
-    local_file.write(opener.open(request).read())
-    local_file.close()
+    write_atomic(filename, lambda local_file: fetch(url, out=local_file))
+
 
+def download_extract(url, extensions=None):
+    """download zip archive and extract files.
+
+    The archive is streamed to a temporary file, never held in memory,
+    and each member is extracted atomically into WEATHER_DATA_PATH.
+
+    Args:
+        url (str): zip archive url.
+        extensions (list): extract only these file extensions, eg.
+            ['epw', 'ddy'].  Default all.
 
-def download_extract(url):
-    """download and extract file."""
+    Returns:
+        list: extracted paths
+    """
     logger.info("Downloading %s", url)
-    request = urllib2.Request(url)
-    request.add_header('User-Agent',
-                       'caelum/0.1 +https://github.com/nrcharles/caelum')
-    opener = urllib2.build_opener()
+    extracted = []
     with tempfile.TemporaryFile(suffix='.zip', dir=env.WEATHER_DATA_PATH) \
             as local_file:
         logger.debug('Saving to temporary file %s', local_file.name)
-        local_file.write(opener.open(request).read())
+        fetch(url, out=local_file)
         compressed_file = zipfile.ZipFile(local_file, 'r')
-        logger.debug('Extracting %s', compressed_file)
-        compressed_file.extractall(env.WEATHER_DATA_PATH)
-        local_file.close()
+        for member in compressed_file.infolist():
+            name = os.path.basename(member.filename)
+            if not name or (extensions is not None and
+                            name.rsplit('.', 1)[-1] not in extensions):
+                continue
+            logger.debug('Extracting %s', name)
+            path = os.path.join(env.WEATHER_DATA_PATH, name)
+            with compressed_file.open(member) as source:
+                write_atomic(path, lambda target: shutil.copyfileobj(
+                    source, target, BLOCK_SIZE))
+            extracted.append(path)
+        compressed_file.close()
+    return extracted
 
 
 def _mlat(tlat):
@@ -76,35 +665,284 @@ def parse_noaa_line(line):
     return station
 
 
-def closest_noaa(latitude, longitude):
-    """Find closest station from the old list."""
+def noaa_stations():
+    """Stations from the old NOAA list, in file order.
+
+    Returns (list): station dicts from `parse_noaa_line`
+    """
+    stations = []
     with open(env.SRC_PATH + '/inswo-stns.txt') as index:
         index.readline()  # header
         index.readline()  # whitespace
-        min_dist = 9999
-        station_name = ''
-        station_name = ''
         for line in index:
             try:
-                i = parse_noaa_line(line)
-                new_dist = great_circle((latitude, longitude),
-                                        (float(i['LAT']),
-                                         float(i['LON']))).miles
-
+                stations.append(parse_noaa_line(line))
             except:
                 logger.error(line)
                 raise IOError('Inventory Issue')
+    return stations
+
+
+def great_circle_km(lat1, lon1, lat2, lon2):
+    """Vectorized great circle distance in kilometers.
+
+    Same spherical formula and radius as `geopy.distance.great_circle`,
+    broadcast over NumPy arrays of degrees.
+    """
+    lat1, lon1 = np.radians(lat1), np.radians(lon1)
+    lat2, lon2 = np.radians(lat2), np.radians(lon2)
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_lat2, cos_lat2 = np.sin(lat2), np.cos(lat2)
+    delta_lon = lon2 - lon1
+    cos_delta_lon, sin_delta_lon = np.cos(delta_lon), np.sin(delta_lon)
+    d = np.arctan2(np.sqrt((cos_lat2 * sin_delta_lon) ** 2 +
+                           (cos_lat1 * sin_lat2 -
+                            sin_lat1 * cos_lat2 * cos_delta_lon) ** 2),
+                   sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lon)
+    return EARTH_RADIUS * d
+
+
+def _unit_vectors(lats, lons):
+    """lat/lon degrees to points on the unit sphere."""
+    lats, lons = np.radians(lats), np.radians(lons)
+    cos_lat = np.cos(lats)
+    return np.column_stack((cos_lat * np.cos(lons), cos_lat * np.sin(lons),
+                            np.sin(lats)))
+
+
+class SpatialIndex(object):
+
+    """KD-tree over station coordinates on the unit sphere.
+
+    Chord length is monotonic in great circle distance, so the tree
+    candidates are exact; a few spare candidates are re-ranked with
+    `great_circle_km` to reproduce the tie breaking of the linear scans.
+
+    Args:
+        codes (list): station codes.
+        names (list): station names.
+        lats (list): latitudes in degrees.
+        lons (list): longitudes in degrees.
+        last_wins (bool): on equal distance prefer the later station.
+        formats (list): space separated data formats per station.
+    """
+
+    spare = 8
+
+    def __init__(self, codes, names, lats, lons, last_wins=False,
+                 formats=None):
+        self.codes = np.array(codes)
+        self.names = np.array(names)
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.last_wins = last_wins
+        self.formats = None
+        self._format_masks = {}
+        if formats is not None:
+            self.formats = [frozenset(i.split()) for i in formats]
+        self.tree = cKDTree(_unit_vectors(self.lats, self.lons))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def query(self, lats, lons, k=1):
+        """k closest stations for many points.
+
+        Args:
+            lats (array): latitudes in degrees.
+            lons (array): longitudes in degrees.
+            k (int): number of stations per point.
+
+        Returns:
+            tuple (positions, km): arrays of shape (n, k), closest first.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        candidates = min(k + self.spare, len(self))
+        _, positions = self.tree.query(_unit_vectors(lats, lons),
+                                       k=candidates)
+        positions = positions.reshape(len(lats), candidates)
+        km = great_circle_km(lats[:, None], lons[:, None],
+                             self.lats[positions], self.lons[positions])
+        tie = -positions if self.last_wins else positions
+        order = np.lexsort((tie, km), axis=-1)[:, :k]
+        rows = np.arange(len(lats))[:, None]
+        return positions[rows, order], km[rows, order]
+
+    def closest(self, lats, lons, k=1):
+        """codes, names and distances in miles of the k closest stations.
+
+        Arrays have shape (n,) if k is 1, else (n, k).
+        """
+        positions, km = self.query(lats, lons, k)
+        if k == 1:
+            positions, km = positions[:, 0], km[:, 0]
+        return self.codes[positions], self.names[positions], \
+            km / KM_PER_MILE
+
+    def format_mask(self, formats):
+        """stations with data in any of formats."""
+        if self.formats is None:
+            raise ValueError('station list has no data formats')
+        formats = frozenset(formats)
+        if formats not in self._format_masks:
+            self._format_masks[formats] = np.array(
+                [not formats.isdisjoint(i) for i in self.formats], dtype=bool)
+        return self._format_masks[formats]
 
-            if new_dist < min_dist:
-                min_dist = new_dist
-                station_name = i['station_name']
-                station_code = i['station_code']
-        index.close()
-        return station_code, station_name
-    raise KeyError('station not found')
+    def nearest(self, latitude, longitude, k=1, max_km=None, mask=None):
+        """Nearest distinct stations with distance filtering.
 
+        Distances to every station are computed in one vectorized pass.
 
-def closest_eere(latitude, longitude):
+        Args:
+            latitude (float): degrees
+            longitude (float): degrees
+            k (int): maximum number of stations, None for all.
+            max_km (float): drop stations further than this.
+            mask (array): bool array of eligible stations.
+
+        Returns:
+            tuple (positions, km): arrays, closest first.
+        """
+        km = great_circle_km(latitude, longitude, self.lats, self.lons)
+        eligible = np.ones(len(self), dtype=bool) if mask is None else mask
+        if max_km is not None:
+            eligible = eligible & (km <= max_km)
+        positions = np.flatnonzero(eligible)
+        tie = -positions if self.last_wins else positions
+        positions = positions[np.lexsort((tie, km[positions]))]
+        # repeated rows for one station only count once
+        seen = set()
+        keep = []
+        for i in positions:
+            if k is not None and len(keep) == k:
+                break
+            if self.codes[i] not in seen:
+                seen.add(self.codes[i])
+                keep.append(i)
+        positions = np.array(keep, dtype=int)
+        return positions, km[positions]
+
+
+_SPATIAL = {}
+_SPATIAL_LOCK = threading.Lock()
+
+
+def _spatial_index(name, build):
+    """build a spatial index once per process."""
+    if name not in _SPATIAL:
+        with _SPATIAL_LOCK:
+            if name not in _SPATIAL:
+                _SPATIAL[name] = build()
+    return _SPATIAL[name]
+
+
+def _build_eere_index():
+    """index every row of eere_meta.csv."""
+    rows = EERE_META.rows()
+    return SpatialIndex([i['station_code'] for i in rows],
+                        [i['weather_station'] for i in rows],
+                        [float(i['latitude']) for i in rows],
+                        [float(i['longitude']) for i in rows],
+                        last_wins=True,
+                        formats=[i['data_formats'] for i in rows])
+
+
+def _build_noaa_index():
+    """index the old NOAA list."""
+    rows = noaa_stations()
+    return SpatialIndex([i['station_code'] for i in rows],
+                        [i['station_name'] for i in rows],
+                        [i['LAT'] for i in rows],
+                        [i['LON'] for i in rows])
+
+
+def eere_index():
+    """process wide SpatialIndex of eere_meta.csv."""
+    return _spatial_index('eere', _build_eere_index)
+
+
+def noaa_index():
+    """process wide SpatialIndex of the old NOAA list."""
+    return _spatial_index('noaa', _build_noaa_index)
+
+
+def closest_noaa_many(lats, lons, k=1):
+    """Find closest stations from the old list for many points.
+
+    Args:
+        lats (array): latitudes
+        lons (array): longitudes
+        k (int): stations per point
+
+    Returns:
+        tuple (station_codes, station_names, miles) of arrays
+    """
+    return noaa_index().closest(lats, lons, k)
+
+
+def nearest_stations(latitude, longitude, k=5, max_km=None, formats=None,
+                     source='eere'):
+    """Nearest stations, for picking fallbacks when one has bad data.
+
+    Args:
+        latitude (float)
+        longitude (float)
+        k (int): maximum number of stations, None for all.
+        max_km (float): maximum distance in kilometers.
+        formats (list): EERE data formats, eg. ['TMY3', 'IWEC'].
+        source (str): 'eere' (eere_meta.csv) or 'noaa' (old list).
+
+    Returns:
+        list of tuples (station_code (str), station_name (str), km (float)),
+        closest first; empty if no station matches.
+    """
+    if source == 'eere':
+        index = eere_index()
+    elif source == 'noaa':
+        index = noaa_index()
+    else:
+        raise ValueError('unknown station source %s' % source)
+    mask = None
+    if formats is not None:
+        mask = index.format_mask(formats)
+    positions, km = index.nearest(latitude, longitude, k, max_km, mask)
+    return [(str(index.codes[i]), str(index.names[i]), float(dist))
+            for i, dist in zip(positions, km)]
+
+
+def closest_noaa(latitude, longitude, max_km=None):
+    """Find closest station from the old list.
+
+    Raises KeyError if no station is within max_km.
+    """
+    if max_km is not None:
+        stations = nearest_stations(latitude, longitude, 1, max_km,
+                                    source='noaa')
+        if not stations:
+            raise KeyError('station not found')
+        return stations[0][:2]
+    codes, names, _ = closest_noaa_many([latitude], [longitude])
+    return str(codes[0]), str(names[0])
+
+
+def closest_eere_many(lats, lons, k=1):
+    """Find closest stations from the new(er) list for many points.
+
+    Args:
+        lats (array): latitudes
+        lons (array): longitudes
+        k (int): stations per point
+
+    Returns:
+        tuple (station_codes, station_names, miles) of arrays with shape
+        (n,) if k is 1 else (n, k)
+    """
+    return eere_index().closest(lats, lons, k)
+
+
+def closest_eere(latitude, longitude, max_km=None, formats=None):
     """Find closest station from the new(er) list.
 
     Warning: There may be some errors with smaller non US stations.
@@ -112,26 +950,23 @@ def closest_eere(latitude, longitude):
     Args:
         latitude (float)
         longitude (float)
+        max_km (float): maximum distance in kilometers.
+        formats (list): acceptable data formats, eg. ['TMY3', 'IWEC'].
 
     Returns:
         tuple (station_code (str), station_name (str))
 
+    Raises:
+        KeyError: no station matches max_km and formats.
+
     """
-    with open(env.SRC_PATH + '/eere_meta.csv') as eere_meta:
-        stations = csv.DictReader(eere_meta)
-        d = 9999
-        station_code = ''
-        station_name = ''
-        for station in stations:
-            new_dist = great_circle((latitude, longitude),
-                                    (float(station['latitude']),
-                                     float(station['longitude']))).miles
-            if new_dist <= d:
-                d = new_dist
-                station_code = station['station_code']
-                station_name = station['weather_station']
-        return station_code, station_name
-    raise KeyError('station not found')
+    if max_km is not None or formats is not None:
+        stations = nearest_stations(latitude, longitude, 1, max_km, formats)
+        if not stations:
+            raise KeyError('station not found')
+        return stations[0][:2]
+    codes, names, _ = closest_eere_many([latitude], [longitude])
+    return str(codes[0]), str(names[0])
 
 
 def eere_station(station_code):
@@ -142,12 +977,7 @@ def eere_station(station_code):
 
     Returns (dict): station information
     """
-    with open(env.SRC_PATH + '/eere_meta.csv') as eere_meta:
-        stations = csv.DictReader(eere_meta)
-        for station in stations:
-            if station['station_code'] == station_code:
-                return station
-    raise KeyError('station not found')
+    return EERE_META[station_code]
 
 if __name__ == '__main__':
     print(closest_noaa(52.208364, 5.320569))
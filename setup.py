@@ -22,7 +22,7 @@ setup(
     url="https://github.com/nrcharles/caelum",
     packages=find_packages(),
     long_description=read('README.rst'),
-    install_requires=['geopy'],
+    install_requires=['geopy', 'numpy', 'scipy'],
     package_data={'': ['*.csv', '*.txt', '*.rst']},
     test_suite='tests.unit',
     classifiers=[
@@ -0,0 +1,524 @@
+"""Benchmarks.
+
+Run all with ``python -m tests.bench`` or pick some by name, eg.
+``python -m tests.bench station_lookup``.
+"""
+import csv
+import sys
+import timeit
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """register benchmark."""
+    BENCHMARKS.append(func)
+    return func
+
+
+def _report(label, seconds, number=1):
+    """print per-call timing."""
+    per_call = seconds / number
+    if per_call < 1e-3:
+        print '    %-44s %10.2f us' % (label, per_call * 1e6)
+    else:
+        print '    %-44s %10.2f ms' % (label, per_call * 1e3)
+
+
+@benchmark
+def station_lookup():
+    """eere.csv lookup: linear csv scan vs StationRegistry."""
+    from caelum import env
+    from caelum.tools import StationRegistry
+
+    def linear(station_code):
+        with open(env.SRC_PATH + '/eere.csv') as url_file:
+            for line in csv.DictReader(url_file):
+                if line['station_code'] == station_code:
+                    return line
+
+    registry = StationRegistry(env.SRC_PATH + '/eere.csv',
+                               indexes=('country', 'region', 'data_format'))
+    build = timeit.timeit(lambda: registry['063800'], number=1)
+    codes = ['603900', '724666', '063800']
+    number = 30
+    _report('linear scan', timeit.timeit(
+        lambda: [linear(i) for i in codes], number=number), number * 3)
+    _report('registry build (once)', build)
+    number = 30000
+    _report('registry lookup', timeit.timeit(
+        lambda: [registry[i] for i in codes], number=number), number * 3)
+
+
+@benchmark
+def closest_station():
+    """closest_eere: geopy scan per point vs batched KD-tree, 100k points."""
+    import numpy as np
+    from geopy.distance import great_circle
+    from caelum import tools
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(-90, 90, 100000)
+    lons = rng.uniform(-180, 180, 100000)
+    stations = tools.EERE_META.rows()
+
+    def brute(lat, lon):
+        best = (9999, '')
+        for i in stations:
+            new_dist = great_circle((lat, lon), (float(i['latitude']),
+                                                 float(i['longitude']))).miles
+            if new_dist <= best[0]:
+                best = (new_dist, i['station_code'])
+        return best
+
+    number = 10
+    _report('brute force per point', timeit.timeit(
+        lambda: [brute(lats[i], lons[i]) for i in range(number)],
+        number=1), number)
+    _report('index build (once)', timeit.timeit(tools.eere_index, number=1))
+    elapsed = timeit.timeit(lambda: tools.closest_eere_many(lats, lons),
+                            number=1)
+    _report('closest_eere_many, 100k points', elapsed)
+    _report('closest_eere_many per point', elapsed, len(lats))
+
+
+class _LocalData(object):
+
+    """synthetic EPW file in a temporary WEATHER_DATA_PATH."""
+
+    def __enter__(self):
+        import tempfile
+        from caelum import env
+        from tests.unit import write_epw
+        self.weather_data_path = env.WEATHER_DATA_PATH
+        env.WEATHER_DATA_PATH = tempfile.mkdtemp()
+        write_epw(env.WEATHER_DATA_PATH + '/NLD_Beek.063800_IWEC.epw')
+        return env.WEATHER_DATA_PATH
+
+    def __exit__(self, *args):
+        import shutil
+        from caelum import env
+        shutil.rmtree(env.WEATHER_DATA_PATH)
+        env.WEATHER_DATA_PATH = self.weather_data_path
+
+
+@benchmark
+def epw_columns():
+    """annual GHI: EPWdata iteration vs to_arrays, parsed and cached."""
+    from caelum import eere
+
+    def ghi(**kwargs):
+        return eere.EPWdata('063800').to_arrays(['GHI (W/m^2)'], **kwargs)
+
+    def best(func, number):
+        return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+    with _LocalData():
+        iterate = best(lambda: sum([int(i['GHI (W/m^2)'])
+                                    for i in eere.EPWdata('063800')]), 3)
+        _report('iterate records', iterate)
+        _report('to_arrays, first cached load', timeit.timeit(
+            lambda: ghi()['GHI (W/m^2)'].sum(), number=1))
+        for label, func, number in [
+                ('to_arrays, parse all fields',
+                 lambda: eere.EPWdata('063800').to_arrays(cache=False), 3),
+                ('to_arrays, parse GHI only',
+                 lambda: ghi(cache=False)['GHI (W/m^2)'].sum(), 3),
+                ('to_arrays, memory-mapped cache',
+                 lambda: ghi()['GHI (W/m^2)'].sum(), 100)]:
+            seconds = best(func, number)
+            _report(label, seconds)
+            print '    %-44s %10.1fx' % ('  faster than iterating',
+                                        iterate / seconds)
+
+
+@benchmark
+def epw_records():
+    """EPWdata iteration: full dict records vs lean projected records."""
+    from caelum import eere
+    fields = ['GHI (W/m^2)', 'Dry-bulb (C)']
+
+    def sizeof(record):
+        """shallow size of a record and its values."""
+        values = record.values() if isinstance(record, dict) else record
+        return sys.getsizeof(record) + sum(sys.getsizeof(i) for i in values)
+
+    with _LocalData():
+        for label, kwargs in [('dict, all fields', {}),
+                              ('dict, 2 fields', {'fields': fields}),
+                              ('tuple, 2 fields', {'fields': fields,
+                                                   'record': 'tuple'}),
+                              ('namedtuple, 2 fields + datetime',
+                               {'fields': fields + ['datetime'],
+                                'record': 'namedtuple'})]:
+            number = 3
+            rows = len(list(eere.EPWdata('063800', **kwargs)))
+            elapsed = timeit.timeit(
+                lambda: list(eere.EPWdata('063800', **kwargs)),
+                number=number) / number
+            record = eere.EPWdata('063800', **kwargs).next()
+            print '    %-32s %8.0f rows/s %6d bytes/row' % (
+                label, rows / elapsed, sizeof(record))
+
+
+@benchmark
+def tmy3_aggregate():
+    """20 TMY3 stations: total() record loops vs one aggregate call."""
+    from caelum import tmy3
+    from tests.unit import write_tmy3
+
+    def legacy_total(usaf, field):
+        running_total = 0
+        for record in tmy3.data(usaf):
+            running_total += float(record[field])
+        return running_total / 1000.
+
+    codes = ['7246%02d' % i for i in range(20)]
+    fields = ['GHI (W/m^2)', 'DNI (W/m^2)', 'Dry-bulb (C)']
+    with _LocalData() as path:
+        for i, code in enumerate(codes):
+            write_tmy3('%s/%sTYA.csv' % (path, code), year=1987, seed=i)
+        _report('record loops, annual sums of 3 fields', timeit.timeit(
+            lambda: [legacy_total(i, j) for i in codes for j in fields],
+            number=1))
+        _report('aggregate, first call (parse and cache)', timeit.timeit(
+            lambda: tmy3.aggregate(codes, fields), number=1))
+        number = 5
+        _report('aggregate, annual sums', timeit.timeit(
+            lambda: tmy3.aggregate(codes, fields), number=number), number)
+        _report('aggregate, monthly sum/mean/min/max/p90', timeit.timeit(
+            lambda: tmy3.aggregate(codes, fields, 'month', [
+                'sum', 'mean', 'min', 'max', 'p90']), number=number), number)
+        _report('aggregate, hour of day mean', timeit.timeit(
+            lambda: tmy3.aggregate(codes, fields, 'hour-of-day', ['mean']),
+            number=number), number)
+
+
+@benchmark
+def nsrdb_years():
+    """20 NSRDB station years: monthly() per year vs stacked load."""
+    import tempfile
+    import shutil
+    from multiprocessing import cpu_count
+    from caelum import nsrdb
+    from tests.unit import write_nsrdb
+
+    def legacy_monthly(year):
+        months = [0.] * 12
+        for record in nsrdb.Data('724666', year):
+            months[record['datetime'].month - 1] += float(
+                record['Glo Mod (Wh/m^2)'])
+        return months
+
+    path = tempfile.mkdtemp()
+    saved = nsrdb.PATH
+    nsrdb.PATH = [path]
+    try:
+        for year in nsrdb.YEARS:
+            write_nsrdb(path + '/' + nsrdb.BASENAME % (year, year, '724666'),
+                        year, year)
+        _report('Data iteration per year', timeit.timeit(
+            lambda: [legacy_monthly(i) for i in nsrdb.YEARS], number=1))
+        number = 3
+        _report('load, 1 process', timeit.timeit(
+            lambda: nsrdb.load('724666', processes=1), number=number),
+            number)
+        _report('load, default', timeit.timeit(
+            lambda: nsrdb.load('724666'), number=number), number)
+        _report('load, process per cpu', timeit.timeit(
+            lambda: nsrdb.load('724666', processes=cpu_count()),
+            number=number), number)
+        stack = nsrdb.load('724666')
+        number = 100
+        _report('monthly totals and statistics', timeit.timeit(
+            lambda: (nsrdb.monthly_totals(stack), nsrdb.statistics(stack)),
+            number=number), number)
+    finally:
+        nsrdb.PATH = saved
+        shutil.rmtree(path)
+
+
+@benchmark
+def nsrdb_index():
+    """10k NSRDB files in 100 dirs: walk per file vs persistent index."""
+    import os
+    import tempfile
+    import shutil
+    from caelum import nsrdb
+
+    def walk(basename, paths):
+        for root in paths:
+            for dirpath, _, filenames in os.walk(root):
+                if basename in filenames:
+                    return os.path.join(dirpath, basename)
+
+    path = tempfile.mkdtemp()
+    try:
+        root = path + '/data'
+        for i in range(100):
+            folder = '%s/%02d/%s' % (root, i // 10, i)
+            os.makedirs(folder)
+            for usaf in range(5):
+                for year in nsrdb.YEARS:
+                    open(folder + '/' + nsrdb.BASENAME % (
+                        year, year, '72%02d%02d' % (i, usaf)), 'w').close()
+        wanted = [('72%02d%02d' % (i, i % 5), 2000) for i in range(0, 100, 5)]
+        _report('os.walk per file', timeit.timeit(
+            lambda: [walk(nsrdb.BASENAME % (y, y, u), [root])
+                     for u, y in wanted], number=1), len(wanted))
+
+        def build():
+            if os.path.exists(path + '/index.json'):
+                os.remove(path + '/index.json')
+            return nsrdb.FileIndex([root], path + '/index.json').years('x')
+
+        _report('index, first scan', timeit.timeit(build, number=1))
+        number = 5
+        _report('index, reload and refresh unchanged', timeit.timeit(
+            lambda: nsrdb.FileIndex([root], path + '/index.json')
+            .years('x'), number=number), number)
+        index = nsrdb.FileIndex([root], path + '/index.json')
+        number = 10000
+        _report('index lookup', timeit.timeit(
+            lambda: [index.filename(u, y) for u, y in wanted],
+            number=number), number * len(wanted))
+    finally:
+        shutil.rmtree(path)
+
+
+@benchmark
+def design_lookup():
+    """minimum() and twopercent(): file scans vs design condition index."""
+    from caelum import design, eere, env
+    from tests.unit import write_ddy, write_stat
+
+    def scan(station_code):
+        """parse both files as the old functions did."""
+        return design.parse(
+            '%s/%s' % (env.WEATHER_DATA_PATH, eere._basename(station_code,
+                                                             'ddy')),
+            '%s/%s' % (env.WEATHER_DATA_PATH, eere._basename(station_code,
+                                                             'stat')))
+
+    def indexed(station_code):
+        """index lookup with an empty memo, as in a new process."""
+        eere._DESIGN.clear()
+        return eere.design_conditions([station_code])
+
+    with _LocalData() as path:
+        write_ddy(path + '/NLD_Beek.063800_IWEC.ddy')
+        write_stat(path + '/NLD_Beek.063800_IWEC.stat')
+        number = 1000
+        _report('parse ddy and stat', timeit.timeit(
+            lambda: scan('063800'), number=number), number)
+        _report('first lookup, parse and index', timeit.timeit(
+            lambda: indexed('063800'), number=1))
+        _report('sqlite index lookup', timeit.timeit(
+            lambda: indexed('063800'), number=number), number)
+        _report('memoized lookup', timeit.timeit(
+            lambda: eere.design_conditions(['063800']), number=number),
+            number)
+
+
+@benchmark
+def gfs_ranges():
+    """5 GFS offsets, 100 ranges each, 20 ms latency: serial vs parallel."""
+    import datetime
+    import glob
+    import os
+    import shutil
+    import tempfile
+    import urllib2
+    from caelum import gfs
+    from tests.stub import StubServer
+    from tests.unit import gfs_file
+    routes = {}
+    for offset in range(0, 15, 3):
+        body, idx, _ = gfs_file(600, seed=offset)
+        name = '/gfs.2015010100/gfs.t00z.pgrb2.1p00.f%03d' % offset
+        routes[name] = body
+        routes[name + '.idx'] = idx
+    path = tempfile.mkdtemp() + '/'
+    baseurl = gfs.BASEURL
+    run_time = datetime.datetime(2015, 1, 1)
+
+    def serial():
+        """previous implementation, one new connection per range."""
+        for offset in range(0, 15, 3):
+            url = gfs.baseurl(*gfs._run(run_time, gfs.pgrb2, offset))
+            index = gfs.Inventory.parse(
+                urllib2.urlopen(url + '.idx').read())
+            segments = index.segments(['TMP'], ['surface'])
+            with open(path + 'serial', 'w') as gribfile:
+                for start, end in segments:
+                    request = urllib2.Request(url)
+                    request.headers['Range'] = 'bytes=%s' % gfs._range(
+                        start, end)
+                    gribfile.write(urllib2.build_opener().open(
+                        request).read())
+
+    try:
+        with StubServer(routes) as server:
+            gfs.BASEURL = server.url('/gfs.%s/%s')
+            for name in routes:
+                server.delays[name] = 0.02
+            _report('serial, new connection per range',
+                    timeit.timeit(serial, number=1))
+            for multirange, resume in [(1, False), (8, False), (32, False),
+                                       (32, True)]:
+                del server.requests[:]
+                if not resume:
+                    for manifest in glob.glob(path + '*/*.manifest'):
+                        os.remove(manifest)
+                elapsed = timeit.timeit(lambda: gfs.download_many(
+                    [run_time], range(0, 15, 3), products=['TMP'],
+                    levels=['surface'], path=path, multirange=multirange,
+                    request_cost=0),
+                    number=1)
+                _report('download_many, %s%s ranges/request, %s requests'
+                        % ('resumed, ' if resume else '', multirange,
+                           len(server.requests)), elapsed)
+    finally:
+        gfs.BASEURL = baseurl
+        shutil.rmtree(path)
+
+
+@benchmark
+def grib2_points():
+    """decode a 1 degree field and interpolate it at 10k points."""
+    import numpy as np
+    from caelum import grib2
+    from tests.unit import grib2_message
+    rng = np.random.RandomState(0)
+    values = rng.uniform(200, 320, (181, 360))
+    grid = {'la1': 90, 'lo1': 0, 'di': 1, 'dj': 1, 'values': values}
+    lats = rng.uniform(-90, 90, 10000)
+    lons = rng.uniform(-180, 180, 10000)
+    number = 20
+    for bits in [16, 12]:
+        message = grib2_message([dict(grid, bits=bits, decimal=2)])
+        _report('decode, %s bit packing' % bits, timeit.timeit(
+            lambda: grib2.decode(message), number=number), number)
+    complex_message = grib2_message([dict(grid, values=values.round(1),
+                                          template=3, decimal=1)])
+    _report('decode, complex packing (5.3)',
+            timeit.timeit(lambda: grib2.decode(complex_message),
+                          number=number), number)
+    field = grib2.decode(message)[0]
+    number = 20
+    _report('bilinear weights, 10k points', timeit.timeit(
+        lambda: grib2.bilinear(field, lats, lons), number=number), number)
+    weights = grib2.bilinear(field, lats, lons)
+    _report('interpolate with cached weights, 10k points', timeit.timeit(
+        lambda: grib2.interpolate(field, lats, lons, weights),
+        number=number), number)
+
+
+@benchmark
+def gfs_plan():
+    """fetch planner: requests vs over-fetched bytes on a pgrb2-like file."""
+    import numpy as np
+    from caelum import gfs
+    rng = np.random.RandomState(0)
+    variables = ['TMP', 'RH', 'UGRD', 'VGRD', 'HGT', 'TCDC', 'DSWRF', 'ABSV',
+                 'VVEL', 'CLWMR']
+    levels = ['%s mb' % i for i in range(100, 1001, 50)] + ['surface']
+    lines = []
+    offset = 0
+    for i in range(600):
+        lines.append('%s:%s:d=2015010100:%s:%s:anl:' % (
+            i + 1, offset, variables[rng.randint(len(variables))],
+            levels[rng.randint(len(levels))]))
+        offset += int(rng.lognormal(11.5, 0.5))
+    index = gfs.Inventory.parse('\n'.join(lines))
+    print '    %-14s %9s %12s %9s %14s' % (
+        'request_cost', 'requests', 'bytes', 'overhead',
+        'est. time (s)')
+    for cost in [0, 2 ** 14, 2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22]:
+        planned = gfs.plan(index, ['TMP', 'UGRD', 'VGRD'],
+                           ['surface', '500 mb', '850 mb'], cost)
+        # 8 connections, 50 ms per request, 10 MB/s
+        seconds = planned.requests * 0.05 / 8 + planned.bytes / 1e7
+        print '    %-14s %9s %12s %8.1f%% %14.2f' % (
+            cost, planned.requests, planned.bytes,
+            100. * (planned.bytes - planned.wanted) / planned.wanted,
+            seconds)
+
+
+@benchmark
+def ndfd_parse():
+    """NDFD DWML for 200 points, 56 steps: eval per value vs parse."""
+    import datetime
+    import xml.etree.ElementTree as ElementTree
+    from caelum import noaa
+    from tests.unit import ndfd_response
+
+    def legacy(xml):
+        """the old forecast parsing, per location."""
+        root = ElementTree.fromstring(xml)
+        times = [datetime.datetime.strptime(i.text[:19],
+                                            '%Y-%m-%dT%H:%M:%S') -
+                 datetime.timedelta(hours=eval(i.text[19:22]))
+                 for i in root.findall('./data/time-layout')[0]
+                 .iterfind('start-valid-time')]
+        columns = []
+        for parameters in root.findall('./data/parameters'):
+            columns.append({
+                'start-valid-time': times,
+                'windSpeed': [eval(i.text) * 1.15 for i in parameters.find(
+                    'wind-speed').iterfind('value')],
+                'cloudCover': [eval(i.text) / 100.0 for i in parameters.find(
+                    'cloud-amount').iterfind('value')],
+                'temperature': [eval(i.text) for i in parameters.find(
+                    'temperature').iterfind('value')]})
+        return columns
+
+    places = [(30 + i * 0.1, -120 + i * 0.1) for i in range(200)]
+    xml = ndfd_response(places, steps=56)
+    print '    %.1f MB, %s values' % (len(xml) / 1e6, xml.count('<value'))
+    number = 3
+    _report('ElementTree + eval', timeit.timeit(lambda: legacy(xml),
+                                                number=number), number)
+    _report('noaa.parse', timeit.timeit(lambda: noaa.parse(xml),
+                                        number=number), number)
+    _report('noaa.parse_dwml', timeit.timeit(lambda: noaa.parse_dwml(xml),
+                                             number=number), number)
+
+
+@benchmark
+def tmy3_lookup():
+    """tmybasename: readlines substring scan vs TMY3 catalog."""
+    from caelum import env, tmy3
+
+    def scan(usaf):
+        url_file = open(env.SRC_PATH + '/tmy3.csv')
+        for line in url_file.readlines():
+            if line.find(usaf) is not -1:
+                return line.rstrip().partition(',')[0]
+
+    codes = ['722287', '724666', '726665']
+    number = 300
+    _report('readlines scan', timeit.timeit(
+        lambda: [scan(i) for i in codes], number=number), number * 3)
+    _report('catalog build (once)', timeit.timeit(
+        lambda: tmy3.tmybasename('724666'), number=1))
+    number = 30000
+    _report('catalog lookup', timeit.timeit(
+        lambda: [tmy3.tmybasename(i) for i in codes], number=number),
+        number * 3)
+    _report('coordinates join (once)', timeit.timeit(
+        lambda: tmy3.station('724666'), number=1))
+    number = 300
+    _report('name search', timeit.timeit(
+        lambda: tmy3.search('denver'), number=number), number)
+
+
+def main(names):
+    """run benchmarks."""
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        print '%s: %s' % (func.__name__, func.__doc__)
+        func()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
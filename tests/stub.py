@@ -0,0 +1,168 @@
+"""Local stand-in HTTP server for fetch tests.
+
+Serves bodies from memory over HTTP/1.1 keep-alive connections, honours
+byte ranges (several as multipart/byteranges) and ETag revalidation, and
+can be told to fail, delay or redirect a path.
+
+Example:
+    with StubServer({'/a': 'data'}) as server:
+        tools.fetch(server.url('/a')).body
+"""
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import time
+
+BOUNDARY = 'STUB_BYTERANGES'
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """serve StubServer routes."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+            self.server.stub.open.append((self.connection,
+                                          threading.current_thread()))
+
+    def _send(self, status, body='', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        with stub.lock:
+            stub.requests.append((self.path, dict(self.headers)))
+            key = (self.path, self.headers.get('Range'))
+            if key not in stub.failures:
+                key = self.path
+            failures = stub.failures.get(key, 0)
+            if failures:
+                stub.failures[key] = failures - 1
+        time.sleep(stub.delays.get(self.path, 0))
+        if failures:
+            return self._send(503, 'unavailable')
+        if self.path in stub.redirects:
+            return self._send(302, headers={
+                'Location': stub.redirects[self.path]})
+        body = stub.routes.get(self.path,
+                               stub.routes.get(self.path.split('?')[0]))
+        if body is None:
+            return self._send(404, 'not found')
+        if callable(body):
+            body = body(self.path)
+        etag = '"%x"' % (hash(body) & 0xffffffff)
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, headers={'ETag': etag})
+        ranges = _parse_ranges(self.headers.get('Range'), len(body))
+        if not ranges or not stub.ranges or \
+                (len(ranges) > 1 and not stub.multirange):
+            return self._send(200, body, {'ETag': etag})
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            return self._send(206, body[start:end + 1], {
+                'Content-Range': 'bytes %s-%s/%s' % (start, end, len(body))})
+        parts = []
+        for start, end in ranges:
+            parts.append('--%s\r\nContent-Type: application/octet-stream'
+                         '\r\nContent-Range: bytes %s-%s/%s\r\n\r\n%s\r\n'
+                         % (BOUNDARY, start, end, len(body),
+                            body[start:end + 1]))
+        self._send(206, ''.join(parts) + '--%s--\r\n' % BOUNDARY, {
+            'Content-Type': 'multipart/byteranges; boundary=%s' % BOUNDARY})
+
+    def log_message(self, *args):
+        pass
+
+
+def _parse_ranges(header, size):
+    """[(first, last)] bytes of a 'bytes=' header, None if invalid."""
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header[6:].split(','):
+        first, dash, last = spec.strip().partition('-')
+        if not dash or not first.isdigit() or int(first) >= size:
+            return None
+        if last == '':
+            last = size - 1
+        elif not last.isdigit() or int(last) < int(first):
+            return None
+        ranges.append((int(first), min(int(last), size - 1)))
+    return ranges
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """clients that time out and hang up are expected."""
+        pass
+
+
+class StubServer(object):
+
+    """HTTP server on a free localhost port.
+
+    Args:
+        routes (dict): path -> body, or a function of the request path
+            and query returning the body.
+
+    Attributes:
+        failures (dict): path or (path, Range header) -> number of 503
+            responses before success.
+        delays (dict): path -> seconds to wait before responding.
+        redirects (dict): path -> 302 location.
+        ranges (bool): honour Range headers, else always answer with
+            the whole body.
+        multirange (bool): answer multi-range requests with
+            multipart/byteranges, else with the whole body.
+        requests (list): (path, headers) received.
+        connections (int): TCP connections accepted.
+    """
+
+    def __init__(self, routes=None):
+        self.routes = dict(routes or {})
+        self.failures = {}
+        self.delays = {}
+        self.redirects = {}
+        self.ranges = True
+        self.multirange = True
+        self.requests = []
+        self.connections = 0
+        self.open = []
+        self.lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.stub = self
+        self.thread = None
+
+    def url(self, path):
+        """url of path on this server."""
+        return 'http://127.0.0.1:%s%s' % (self.server.server_port, path)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        for connection, thread in self.open:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join()
@@ -1,7 +1,342 @@
 """Unit tests."""
+import calendar
+import csv
+import datetime
+import glob
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
 
+def write_epw(filename, year=1999, tz=1.0, seed=0):
+    """write a synthetic year of EPW data."""
+    rnd = random.Random(seed)
+    with open(filename, 'w') as epw:
+        epw.write('LOCATION,BEEK,-,NLD,IWEC Data,063800,50.92,5.78,%s,116.0'
+                  '\r\n' % tz)
+        for i in range(7):
+            epw.write('HEADER %s\r\n' % i)
+        for day in range(365):
+            date = datetime.date(year, 1, 1) + datetime.timedelta(days=day)
+            for hour in range(1, 25):
+                ghi = 0
+                if 6 < hour < 19:
+                    ghi = max(0, int(rnd.gauss(300, 300)))
+                epw.write(
+                    '%s,%s,%s,%s,60,A7A7A7A7*0?9?9?9?9?9?9?9A7A7A7A7A7A7*0E8'
+                    '*0*0,%.1f,%.1f,%d,%d,0,1415,264,%d,%d,%d,0,0,0,0,%d,%.1f,'
+                    '10,10,7.0,77777,9,999999999,0,0.0660,0,88,0.000,0.0,0.0'
+                    '\r\n' % (date.year, date.month, date.day, hour,
+                              rnd.uniform(-10, 30), rnd.uniform(-15, 20),
+                              rnd.randint(20, 100),
+                              rnd.randint(95000, 103000), ghi, ghi // 2,
+                              ghi // 3, rnd.randint(0, 360),
+                              rnd.uniform(0, 15)))
+
+
+TMY3_FIELDS = ['Date (MM/DD/YYYY)', 'Time (HH:MM)', 'ETR (W/m^2)',
+               'ETRN (W/m^2)', 'GHI (W/m^2)', 'GHI source', 'GHI uncert (%)',
+               'DNI (W/m^2)', 'DNI source', 'DNI uncert (%)', 'Dry-bulb (C)',
+               'Dry-bulb source', 'Dry-bulb uncert (code)']
+
+
+def write_tmy3(filename, year=1988, tz=-7.0, seed=0):
+    """write a synthetic year of TMY3 data."""
+    rnd = random.Random(seed)
+    with open(filename, 'w') as tmy:
+        tmy.write('724666,"DENVER/CENTENNIAL [GOLDEN - NREL]",CO,%s,39.742,'
+                  '-105.179,1829\r\n' % tz)
+        tmy.write(','.join(TMY3_FIELDS) + '\r\n')
+        for day in range(365):
+            date = datetime.date(year, 1, 1) + datetime.timedelta(days=day)
+            for hour in range(1, 25):
+                ghi = 0
+                if 6 < hour < 19:
+                    ghi = max(0, int(rnd.gauss(300, 300)))
+                tmy.write('%s,%02d:00,1415,1321,%d,1,8,%d,1,15,%.1f,%s,7\r\n'
+                          % (date.strftime('%m/%d/%Y'), hour, ghi,
+                             ghi // 2, rnd.uniform(-10, 30),
+                             rnd.choice('AE')))
+
+
+def write_nsrdb(filename, year, seed=0, missing=()):
+    """write a synthetic NSRDB station year, -9900 GHI at missing hours."""
+    rnd = random.Random(seed)
+    days = 366 if calendar.isleap(year) else 365
+    with open(filename, 'w') as nsrdb:
+        nsrdb.write('YYYY-MM-DD,HH:MM (LST),Zenith (deg),Azimuth (deg),'
+                    'ETR (Wh/m^2),ETRN (Wh/m^2),Glo Mod (Wh/m^2),'
+                    'Glo Mod Unc (%),Glo Mod Source,Dir Mod (Wh/m^2),'
+                    'Dir Mod Unc (%),Dir Mod Source,Dif Mod (Wh/m^2),'
+                    'Dif Mod Unc (%),Dif Mod Source\n')
+        for day in range(days):
+            date = datetime.date(year, 1, 1) + datetime.timedelta(days=day)
+            for hour in range(1, 25):
+                ghi = 0
+                if 6 < hour < 19:
+                    ghi = max(0, int(rnd.gauss(300, 300)))
+                if day * 24 + hour - 1 in missing:
+                    ghi = -9900
+                nsrdb.write('%s,%02d:00,99.0,0.0,0,0,%d,8,1,%d,8,1,%d,8,1\n'
+                            % (date.strftime('%Y-%m-%d'), hour, ghi,
+                               max(ghi, 0) // 2, max(ghi, 0) // 3))
+
+
+def gfs_file(count=30, date='2015010100', seed=0):
+    """synthetic GFS grib2 bytes and .idx inventory.
+
+    Returns:
+        tuple: (body, idx text, messages as (variable, level, bytes))
+    """
+    rnd = random.Random(seed)
+    messages = []
+    for i in range(count):
+        variable = ['TMP', 'UGRD', 'VGRD'][i % 3]
+        level = ['surface', '2 m above ground'][i % 2]
+        messages.append((variable, level, ('GRIB%04d' % i) *
+                         rnd.randint(10, 500)))
+    lines = []
+    offset = 0
+    for i, (variable, level, data) in enumerate(messages):
+        lines.append('%s:%s:d=%s:%s:%s:anl:' % (i + 1, offset, date,
+                                                  variable, level))
+        offset += len(data)
+    return ''.join(i[2] for i in messages), '\n'.join(lines) + '\n', messages
+
+
+def grib2_message(fields):
+    """synthetic GRIB2 message, one data section per field.
+
+    Args:
+        fields (list): dicts of values (nj, ni), la1, lo1, di, dj and
+            optional scan, bits, binary, decimal, bitmap (bool array),
+            template (0, 2 or 3) and order (spatial differencing of 5.3).
+            Complex packing marks NaN values missing.
+    """
+    import struct
+    import numpy as np
+
+    def signed(value, bits):
+        return abs(value) | (1 << (bits - 1) if value < 0 else 0)
+
+    def width(value):
+        return int(value).bit_length()
+
+    def pack(values, widths):
+        bits = ''.join(bin(i)[2:].zfill(j) if j else '' for i, j in
+                       zip(values, widths))
+        if not bits:
+            return ''
+        return np.packbits(np.frombuffer(bits, np.uint8) - 48).tostring()
+
+    def complex_data(packed, missing, order):
+        """template 5.2 or 5.3 section 5 fields and section 7 data."""
+        present = packed[~missing]
+        first = [int(i) for i in present[:order]]
+        if order:
+            for _ in range(order):
+                present = np.diff(present)
+            minimum = int(present.min())
+            present = np.concatenate(([0] * order, present - minimum))
+            first.append(minimum)
+        packed = packed.copy()
+        packed[~missing] = present
+        lengths = []
+        while sum(lengths) < len(packed):
+            lengths.append([7, 13, 29][len(lengths) % 3])
+        lengths[-1] -= sum(lengths) - len(packed)
+        references, widths, values, value_widths = [], [], [], []
+        position = 0
+        for length in lengths:
+            group = packed[position:position + length]
+            lost = missing[position:position + length]
+            position += length
+            if lost.all():
+                references.append(None)
+                widths.append(0)
+                continue
+            low = int(group[~lost].min())
+            group = group - low
+            size = width(group[~lost].max() + missing.any())
+            group[lost] = (1 << size) - 1
+            references.append(low)
+            widths.append(size)
+            values += group.tolist()
+            value_widths += [size] * length
+        # all ones is kept free for missing values
+        bits = width(max(i for i in references if i is not None) +
+                     missing.any())
+        references = [(1 << bits) - 1 if i is None else i
+                      for i in references]
+        length_bits = width(max(lengths[:-1] or [7]) - 7)
+        fields = struct.pack('>BBBIIIBBIBIB', 0, 1, int(missing.any()), 0,
+                             0, len(lengths), min(widths),
+                             width(max(widths) - min(widths)), 7, 1,
+                             lengths[-1], length_bits)
+        data = ''.join(struct.pack('>I', signed(i, 32)) for i in first) + \
+            pack(references, [bits] * len(lengths)) + \
+            pack([i - min(widths) for i in widths],
+                 [width(max(widths) - min(widths))] * len(lengths)) + \
+            pack([i - 7 for i in lengths[:-1]] + [0],
+                 [length_bits] * len(lengths)) + pack(values, value_widths)
+        if order:
+            fields += struct.pack('>BB', order, 4)
+        return bits, fields, data
+
+    sections = [struct.pack('>IB', 21, 1) + '\0' * 16]
+    for field in fields:
+        values = np.asarray(field['values'], dtype=np.float64)
+        nj, ni = values.shape
+        scan = field.get('scan', 0)
+        flat = values.T.ravel() if scan & 0x20 else values.ravel()
+        bitmap = field.get('bitmap')
+        if bitmap is not None:
+            flat = flat[bitmap]
+        bits = field.get('bits', 16)
+        binary = field.get('binary', 0)
+        decimal = field.get('decimal', 0)
+        missing = np.isnan(flat)
+        reference = float(np.float32(flat[~missing].min() * 10 ** decimal))
+        packed = np.round((np.where(missing, reference, flat) *
+                           10 ** decimal - reference) /
+                          2.0 ** binary).astype(np.int64)
+        template = field.get('template', 0)
+        grid = struct.pack('>IBBIBBH', 72, 3, 0, ni * nj, 0, 0, 0) + \
+            '\0' * 16 + struct.pack(
+                '>6IB4IB', ni, nj, 0, 0xffffffff,
+                signed(int(round(field['la1'] * 1e6)), 32),
+                signed(int(round(field['lo1'] * 1e6)), 32), 48, 0, 0,
+                int(round(field['di'] * 1e6)),
+                int(round(field['dj'] * 1e6)), scan)
+        product = struct.pack('>IBHH', 34, 4, 0, 0) + '\0' * 25
+        extra = '\0'
+        if template:
+            bits, extra, data = complex_data(
+                packed, missing, field.get('order', 2) if template == 3
+                else 0)
+        elif bits:
+            matrix = (packed[:, None] >> np.arange(bits - 1, -1, -1)) & 1
+            data = np.packbits(matrix.astype(np.uint8).ravel()).tostring()
+        else:
+            data = ''
+        packing = struct.pack('>IBIHfHHB', 20 + len(extra), 5, len(flat),
+                              template, reference, signed(binary, 16),
+                              signed(decimal, 16), bits) + extra
+        if bitmap is None:
+            bitmap_section = struct.pack('>IBB', 6, 6, 255)
+        else:
+            mask = np.packbits(np.asarray(bitmap, dtype=np.uint8)).tostring()
+            bitmap_section = struct.pack('>IBB', 6 + len(mask), 6, 0) + mask
+        sections += [grid, product, packing, bitmap_section,
+                     struct.pack('>IB', 5 + len(data), 7) + data]
+    body = ''.join(sections)
+    return 'GRIB\0\0\0\2' + struct.pack('>Q', 16 + len(body) + 4) + body + \
+        '7777'
+
+
+def write_ddy(filename, extreme_min=-12.3, twopercent=25.6):
+    """write synthetic .ddy design condition comments."""
+    with open(filename, 'w') as ddy:
+        ddy.write('! Beek Extreme Annual Wind Speeds, 1%=11.2m/s\n')
+        if extreme_min is not None:
+            ddy.write('! Beek Extreme Annual Temperatures, Max Drybulb=%s'
+                      '\xb0C Min Drybulb=30.9\xb0C\n' % extreme_min)
+        ddy.write('! Beek Annual Heating Design Conditions, Heating 99.6%, '
+                  'MaxDB=-10.5\xb0C\n')
+        ddy.write('! Beek Annual Heating Design Conditions, Heating 99%, '
+                  'MaxDB=-7.9\xb0C\n')
+        ddy.write('! Beek Annual Cooling Design Conditions, '
+                  'Cooling (DB=>MWB) .4%, MaxDB=29.5\xb0C MWB=19.9\xb0C\n')
+        ddy.write('! Beek Annual Cooling Design Conditions, '
+                  'Cooling (DB=>MWB) 1%, MaxDB=27.4\xb0C MWB=19.1\xb0C\n')
+        if twopercent is not None:
+            ddy.write('! Beek Annual Cooling Design Conditions, Cooling '
+                      '(DB=>MWB) 2%%, MaxDB=%s\xb0C MWB=18.4\xb0C\n'
+                      % twopercent)
+
+
+def write_stat(filename, minimum=-16.9, twopercent=27.0):
+    """write synthetic .stat design condition lines."""
+    with open(filename, 'w') as stat:
+        stat.write(' - Minimum Dry Bulb temperature of   %s\xb0C on Jan  2\n'
+                   % minimum)
+        stat.write('\tHottest\t2%\n\t\tDB\n')
+        stat.write('\tCooling\tJul\t11.3\t30.0\t%s\t18.6\n' % twopercent)
+
+
+def ndfd_response(places, steps=8, nil=()):
+    """synthetic NDFD DWML time series for places.
+
+    Temperature, wind speed and humidity are 3 hourly and cloud amount is
+    hourly from 2015-01-01T06:00:00-07:00.  Temperature at step i is
+    int(lat) + i, values at steps in nil are nil.
+    """
+    def layout(key, hours, count):
+        times = ''.join(
+            '<start-valid-time>2015-01-01T%02d:00:00-07:00'
+            '</start-valid-time>' % (6 + i * hours) if 6 + i * hours < 24
+            else '<start-valid-time>2015-01-%02dT%02d:00:00-07:00'
+            '</start-valid-time>' % (1 + (6 + i * hours) // 24,
+                                     (6 + i * hours) % 24)
+            for i in range(count))
+        return '<time-layout time-coordinate="local" summarization="none">' \
+            '<layout-key>%s</layout-key>%s</time-layout>' % (key, times)
+
+    def parameter(tag, kind, key, values):
+        return '<%s type="%s" time-layout="%s"><name>%s</name>%s</%s>' % (
+            tag, kind, key, tag, ''.join(
+                '<value xsi:nil="true"/>' if i in nil else
+                '<value>%s</value>' % value
+                for i, value in enumerate(values)), tag)
+
+    xml = ['<?xml version="1.0"?><dwml version="1.0" '
+           'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><head>'
+           '<product><creation-date refresh-frequency="PT1H">'
+           '2015-01-01T13:00:00Z</creation-date></product></head><data>']
+    for i, (lat, lon) in enumerate(places):
+        xml.append('<location><location-key>point%s</location-key><point '
+                   'latitude="%.2f" longitude="%.2f"/></location>'
+                   % (i + 1, lat, lon))
+    xml.append(layout('k-p3h-n%s-1' % steps, 3, steps))
+    xml.append(layout('k-p1h-n%s-2' % (steps * 3), 1, steps * 3))
+    for i, (lat, lon) in enumerate(places):
+        xml.append('<parameters applicable-location="point%s">' % (i + 1))
+        xml.append(parameter('temperature', 'hourly', 'k-p3h-n%s-1' % steps,
+                             [int(lat) + j for j in range(steps)]))
+        xml.append(parameter('wind-speed', 'sustained',
+                             'k-p3h-n%s-1' % steps,
+                             [j * 2 for j in range(steps)]))
+        xml.append(parameter('cloud-amount', 'total',
+                             'k-p1h-n%s-2' % (steps * 3),
+                             [j for j in range(steps * 3)]))
+        xml.append(parameter('humidity', 'relative', 'k-p3h-n%s-1' % steps,
+                             [50] * steps))
+        xml.append('<weather time-layout="k-p3h-n%s-1"><name>Weather</name>'
+                   '<weather-conditions/></weather></parameters>' % steps)
+    xml.append('</data></dwml>')
+    return ''.join(xml)
+
+
+class LocalDataTest(unittest.TestCase):
+
+    """Base for tests against synthetic files in a temporary data path."""
+
+    def setUp(self):
+        from caelum import env
+        self.weather_data_path = env.WEATHER_DATA_PATH
+        env.WEATHER_DATA_PATH = tempfile.mkdtemp()
+        self.path = env.WEATHER_DATA_PATH
+        write_epw(self.path + '/NLD_Beek.063800_IWEC.epw')
+        write_tmy3(self.path + '/724666TYA.csv')
+
+    def tearDown(self):
+        from caelum import env
+        env.WEATHER_DATA_PATH = self.weather_data_path
+        shutil.rmtree(self.path)
+
+
 class BaseEERETest(unittest.TestCase):
 
     """Annual GHI."""
@@ -33,6 +368,1424 @@ class eereDesign(unittest.TestCase):
         self.assertAlmostEquals(eere.minimum(SCODE), -22.9)
         self.assertAlmostEquals(eere.twopercent(SCODE), 30.2)
 
+
+class StationRegistryTest(unittest.TestCase):
+
+    """Indexed station catalogs."""
+
+    def runTest(self):
+        """Registry matches a linear scan of the catalog."""
+        from caelum import env, eere, tools
+        with open(env.SRC_PATH + '/eere.csv') as url_file:
+            rows = list(csv.DictReader(url_file))
+        first = {}
+        for row in rows:
+            if row['station_code'] is not None:
+                first.setdefault(row['station_code'], row)
+        for code in ['603900', '624140', '724666', '063800']:
+            self.assertEqual(eere._station_info(code), first[code])
+        self.assertEqual(eere._basename('063800'),
+                         'NLD_Beek.063800_IWEC.epw')
+        self.assertEqual(eere._basename('063800', 'ddy'),
+                         'NLD_Beek.063800_IWEC.ddy')
+        self.assertEqual(len(tools.EERE_STATIONS), len(first))
+        self.assertEqual(
+            tools.EERE_STATIONS.lookup('data_format', 'IWEC'),
+            [row for row in rows if row['data_format'] == 'IWEC'])
+        self.assertEqual(len(tools.EERE_STATIONS.variants('624140')), 2)
+        self.assertEqual(tools.eere_station('724666')['state'], 'CO')
+        self.assertRaises(KeyError, eere._station_info, '000000')
+        self.assertRaises(KeyError, tools.eere_station, '000000')
+
+
+class TMY3CatalogTest(unittest.TestCase):
+
+    """TMY3 catalog keyed exactly by USAF."""
+
+    def runTest(self):
+        """exact keys, name search, joined coordinates and misses."""
+        import numpy as np
+        from caelum import env, tmy3, tools
+        with open(env.SRC_PATH + '/tmy3.csv') as catalog:
+            lines = [i.rstrip().split(',') for i in catalog
+                     if i[:6].isdigit()]
+        self.assertEqual(len(tools.TMY3_STATIONS), len(lines))
+        self.assertEqual(list(tools.TMY3_STATIONS)[:2], ['722287', '722284'])
+        self.assertEqual(tmy3.tmybasename('724666'), '724666TYA.csv')
+        self.assertTrue(tmy3._tmy_url('725650').endswith('/725650TYA.csv'))
+        for missing in ['999999', '72466', 'Denver', 'TYA', 'CLASS="hide']:
+            self.assertRaises(KeyError, tmy3.tmybasename, missing)
+            self.assertRaises(KeyError, tmy3._tmy_url, missing)
+        self.assertEqual(tmy3.station('724666'), {
+            'filename': '724666TYA.csv', 'usaf': '724666',
+            'name': 'Denver/Centennial [Golden - NREL]',
+            'latitude': 39.742, 'longitude': -105.179})
+        self.assertEqual([i['usaf'] for i in tmy3.search('DENVER')],
+                         ['725650', '724666'])
+        self.assertEqual(tmy3.search('no such place'), [])
+        self.assertEqual([i['usaf'] for i in tmy3.search('Orr, MN')],
+                         ['726544'])
+        lats, lons = tmy3.coordinates(['724666', '725650'])
+        self.assertTrue(np.allclose(lats, [39.742, 39.833]))
+        self.assertTrue(np.allclose(lons, [-105.179, -104.65]))
+        self.assertRaises(KeyError, tmy3.coordinates, ['724666', '000000'])
+        for line in lines[::50]:
+            self.assertEqual(tools.eere_station(line[1])['latitude'],
+                             repr(tmy3.station(line[1])['latitude']))
+
+
+class ClosestStationTest(unittest.TestCase):
+
+    """Spatial index vs brute force great circle scan."""
+
+    def runTest(self):
+        """Closest EERE and NOAA stations."""
+        import numpy as np
+        from geopy.distance import great_circle
+        from caelum import tools
+        rng = np.random.RandomState(42)
+        lats = rng.uniform(-90, 90, 20)
+        lons = rng.uniform(-180, 180, 20)
+        codes, names, miles = tools.closest_eere_many(lats, lons)
+        stations = tools.EERE_META.rows()
+        for lat, lon, code, name, dist in zip(lats, lons, codes, names,
+                                              miles):
+            best = (9999, '', '')
+            for i in stations:
+                new_dist = great_circle((lat, lon),
+                                        (float(i['latitude']),
+                                         float(i['longitude']))).miles
+                if new_dist <= best[0]:
+                    best = (new_dist, i['station_code'],
+                            i['weather_station'])
+            self.assertEqual((code, name), best[1:])
+            self.assertAlmostEqual(dist, best[0], 6)
+        codes, names, miles = tools.closest_noaa_many(lats, lons, k=3)
+        self.assertEqual(codes.shape, (20, 3))
+        self.assertTrue((np.diff(miles, axis=1) >= 0).all())
+        self.assertEqual(tools.closest_noaa(52.208364, 5.320569),
+                         ('062600', 'DE BILT'))
+        self.assertEqual(tools.closest_eere(39.742, -105.179)[0], '724666')
+
+
+class NearestStationsTest(unittest.TestCase):
+
+    """k nearest and radius station queries."""
+
+    def runTest(self):
+        """Filtering by distance and data format."""
+        from caelum import tools
+        stations = tools.nearest_stations(39.742, -105.179, k=5)
+        self.assertEqual(len(stations), 5)
+        self.assertEqual(stations[0][0], '724666')
+        distances = [i[2] for i in stations]
+        self.assertEqual(distances, sorted(distances))
+        near = tools.nearest_stations(39.742, -105.179, k=None, max_km=50)
+        self.assertTrue(all(i[2] <= 50 for i in near))
+        self.assertEqual(near, stations[:len(near)])
+        # repeated catalog rows count once
+        aswan = tools.nearest_stations(24.09, 32.9, k=3)
+        self.assertEqual(len(set(i[0] for i in aswan)), 3)
+        for code, _, _ in tools.nearest_stations(39.742, -105.179,
+                                                 formats=['TMY2']):
+            self.assertTrue('TMY2' in [i['data_format'] for i in
+                                       tools.EERE_STATIONS.variants(code)])
+        self.assertEqual(tools.nearest_stations(0, -150, max_km=10), [])
+        self.assertRaises(KeyError, tools.closest_eere, 0, -150, 10)
+        self.assertEqual(tools.nearest_stations(52.208364, 5.320569, k=1,
+                                                source='noaa')[0][0],
+                         '062600')
+
+
+class CSVColumnsTest(unittest.TestCase):
+
+    """Vectorized csv parsing."""
+
+    def runTest(self):
+        """Same values as float()."""
+        from caelum import tools
+        rows = [['-3.25', '12', 'A?9', '0.0660'],
+                ['100', '-0', 'B', '7.'],
+                ['1.5', '+4', 'C*0', '']]
+        text = '\r\n'.join(','.join(i) for i in rows)
+        columns = tools.csv_columns(text, [0, 1, 3], [2])
+        self.assertEqual(list(columns[0]), [-3.25, 100, 1.5])
+        self.assertEqual(list(columns[1]), [12, 0, 4])
+        self.assertEqual(list(columns[2]), ['A?9', 'B', 'C*0'])
+        self.assertEqual(list(columns[3][:2]), [0.066, 7.])
+        self.assertTrue(columns[3][2] != columns[3][2])
+        self.assertRaises(ValueError, tools.csv_columns, text, [2])
+        self.assertRaises(ValueError, tools.csv_columns, '1,2\n3\n', [0])
+        self.assertRaises(ValueError, tools.csv_columns, '1,2\n\n3,4\n', [0])
+        columns = tools.csv_columns('1,2\r\n3,4\r\n\r\n\n', [0, 1])
+        self.assertEqual(list(columns[0]), [1, 3])
+        self.assertEqual(list(columns[1]), [2, 4])
+        self.assertEqual(list(tools.csv_columns('\n\n', [0])[0]), [])
+        columns = tools.csv_columns('1e3,1.5\n-2.5E-1,\n,7\n', [0, 1])
+        self.assertEqual(list(columns[0][:2]), [1000, -0.25])
+        self.assertTrue(columns[0][2] != columns[0][2])
+        self.assertEqual(list(columns[1][[0, 2]]), [1.5, 7])
+        for bad in ['1.5.3', '1-2', '3-', '+', '1+2', '-', '.', '--1']:
+            self.assertRaises(ValueError, float, bad)
+            self.assertRaises(ValueError, tools.csv_columns,
+                              '%s,1\n2,3\n' % bad, [0, 1])
+
+
+class TimeAxisTest(unittest.TestCase):
+
+    """Vectorized time axes against the per record functions."""
+
+    def runTest(self):
+        """Random dates, hour 24 and time zones."""
+        import calendar
+        from caelum import eere, timeaxis, tmy3
+        rnd = random.Random(6)
+        records = []
+        for _ in range(2000):
+            year = rnd.randint(1901, 2099)
+            month = rnd.randint(1, 12)
+            records.append({'Year': year, 'Month': month,
+                            'Day': rnd.randint(
+                                1, calendar.monthrange(year, month)[1]),
+                            'Hour': rnd.choice([0, 1, 12, 23, 24,
+                                                rnd.randint(0, 24)]),
+                            'Minute': rnd.choice([0, 30, 59, 60])})
+        local = timeaxis.epw_times(*[[i[j] for i in records] for j in
+                                     eere.EPW_FIELDS[:5]])
+        self.assertEqual(local.astype(object).tolist(),
+                         [eere._muck_w_date(i) for i in records])
+        strings = ['%02d/%02d/%04d %02d:%02d' % (
+            i['Month'], i['Day'], i['Year'], i['Hour'], i['Minute'] % 60)
+                   for i in records]
+        for timezone in [0, -7, 5.5, rnd.uniform(-12, 14)]:
+            self.assertEqual(
+                timeaxis.strptimes(strings, timeaxis.TMY3, timezone)
+                .astype(object).tolist(),
+                [tmy3.strptime(i, round(timezone * 60) / 60.)
+                 for i in strings])
+        self.assertEqual(
+            timeaxis.strptimes([i[:10] for i in strings], timeaxis.TMY3,
+                               times=[i[11:] for i in strings]).tolist(),
+            timeaxis.strptimes(strings).tolist())
+        nsrdb_strings = [i[6:10] + '-' + i[0:2] + '-' + i[3:5] + i[10:]
+                         for i in strings]
+        self.assertEqual(
+            timeaxis.strptimes(nsrdb_strings, timeaxis.NSRDB).tolist(),
+            timeaxis.strptimes(strings).tolist())
+        self.assertRaises(ValueError, timeaxis.strptimes, ['1/1/1999 1:00'])
+
+
+class ResampleTest(unittest.TestCase):
+
+    """Vectorized resampling on a regular time grid."""
+
+    def runTest(self):
+        """methods, NaN samples, horizons and out of range handling."""
+        import numpy as np
+        from caelum import timeaxis
+        times = np.datetime64('2015-01-01T06:00') + \
+            np.arange(0, 24, 3).astype('timedelta64[h]')
+        x = np.arange(0, 24, 3.)
+        values = np.column_stack([2 * x + 1, x ** 3 - x, np.sign(x - 10)])
+        grid, linear = timeaxis.resample(times, values)
+        hours = np.arange(22.)
+        self.assertEqual(grid[0], times[0])
+        self.assertEqual(grid[-1], times[-1])
+        self.assertTrue(np.allclose(linear[:, 0], 2 * hours + 1))
+        grid, cubic = timeaxis.resample(times, values, '30min', 'cubic')
+        self.assertEqual(len(grid), 43)
+        self.assertTrue(np.allclose(cubic[:, 1], (np.arange(43) / 2.) ** 3 -
+                                    np.arange(43) / 2.))
+        pchip = timeaxis.resample(times, values, '1H', 'pchip')[1][:, 2]
+        self.assertTrue((np.abs(pchip) <= 1 + 1e-12).all())
+        self.assertTrue((np.diff(pchip) >= -1e-12).all())
+
+        values[2, 0] = np.nan
+        values[-1, 0] = np.nan
+        grid, found = timeaxis.resample(times, values, horizon='48H')
+        self.assertEqual(len(grid), 48)
+        self.assertTrue(np.allclose(found[:19, 0], 2 * hours[:19] + 1))
+        self.assertTrue(np.isnan(found[19:, 0]).all())
+        self.assertTrue(np.isnan(found[22:, 1:]).all())
+        clipped = timeaxis.resample(times, values, 'H', horizon='48H',
+                                    out_of_range='clip')[1]
+        self.assertTrue((clipped[19:, 0] == 37).all())
+        extended = timeaxis.resample(times, values, horizon='24H',
+                                     out_of_range='extrapolate')[1]
+        self.assertTrue(np.allclose(extended[:, 0], 2 * np.arange(24.) + 1))
+        self.assertRaises(ValueError, timeaxis.resample, times, values,
+                          horizon='1D', out_of_range='raise')
+        grid, found = timeaxis.resample(
+            times, values, start=times[0] - np.timedelta64(1, 'h'))
+        self.assertEqual(grid[0], times[0] - np.timedelta64(1, 'h'))
+        self.assertTrue(np.isnan(found[0]).all())
+        self.assertTrue(np.isfinite(found[1]).all())
+
+        sites = np.array([values, values * 2])
+        grid, found = timeaxis.resample(times, sites, '90min', axis=1)
+        self.assertEqual(found.shape, (2, 15, 3))
+        self.assertTrue(np.allclose(found[1, :, 1], 2 * found[0, :, 1]))
+        self.assertEqual(timeaxis.timedelta(datetime.timedelta(minutes=15)),
+                         timeaxis.timedelta('15T'))
+        self.assertRaises(ValueError, timeaxis.timedelta, '1 fortnight')
+        self.assertRaises(ValueError, timeaxis.resample, times, values,
+                          method='quadratic')
+        self.assertRaises(ValueError, timeaxis.resample, times[::-1], values)
+
+
+class NSRDBTimeAxisTest(unittest.TestCase):
+
+    """Vectorized NSRDB time axis against nsrdb.strptime."""
+
+    def runTest(self):
+        """Random NSRDB date strings."""
+        from caelum import timeaxis
+        try:
+            from caelum import nsrdb
+        except ImportError:
+            self.skipTest('caelum.nsrdb is not importable')
+        rnd = random.Random(6)
+        strings = ['%04d-%02d-%02d %02d:00' % (
+            rnd.randint(1991, 2010), rnd.randint(1, 12), rnd.randint(1, 28),
+            rnd.randint(1, 24)) for _ in range(2000)]
+        self.assertEqual(
+            timeaxis.strptimes(strings, timeaxis.NSRDB, -5)
+            .astype(object).tolist(),
+            [nsrdb.strptime(i, -5) for i in strings])
+
+
+class EPWArraysTest(LocalDataTest):
+
+    """Columnar EPW loader."""
+
+    def runTest(self):
+        """to_arrays matches the record iterator."""
+        import numpy as np
+        from caelum import eere
+        columns = eere.load_epw('063800')
+        records = list(eere.EPWdata('063800'))
+        self.assertEqual(len(columns['Year']), len(records))
+        for field in eere.EPW_FIELDS:
+            if eere.EPW_DTYPES.get(field) == str:
+                expected = [i[field] for i in records]
+            else:
+                expected = np.array([float(i[field]) for i in records],
+                                    dtype=columns[field].dtype)
+            self.assertEqual(list(columns[field]), list(expected), field)
+        for field in ['datetime', 'utc_datetime']:
+            self.assertEqual(columns[field].astype(object).tolist(),
+                             [i[field] for i in records])
+        ghi = eere.load_epw('063800', ['GHI (W/m^2)'])
+        self.assertEqual(sorted(ghi), ['GHI (W/m^2)', 'datetime',
+                                       'utc_datetime'])
+        self.assertEqual(ghi['GHI (W/m^2)'].sum(),
+                         sum(int(i['GHI (W/m^2)']) for i in records))
+
+
+
+class EPWRecordTest(LocalDataTest):
+
+    """Lean EPW records with field projection."""
+
+    def runTest(self):
+        """Projected, typed records match full records."""
+        from caelum import eere
+        full = list(eere.EPWdata('063800'))
+        fields = ['GHI (W/m^2)', 'Dry-bulb (C)', 'Hour']
+        lean = list(eere.EPWdata('063800', fields=fields, record='tuple'))
+        self.assertEqual(lean, [(float(i['GHI (W/m^2)']),
+                                 float(i['Dry-bulb (C)']), int(i['Hour']))
+                                for i in full])
+        named = eere.EPWdata('063800', fields=fields, record='namedtuple')
+        first = named.next()
+        self.assertEqual(first.GHI_W_m_2, lean[0][0])
+        self.assertEqual(first.Dry_bulb_C, lean[0][1])
+        timed = eere.EPWdata('063800', fields=['utc_datetime', 'DS',
+                                               'datetime'])
+        self.assertEqual(list(timed), [{'utc_datetime': i['utc_datetime'],
+                                        'DS': i['DS'],
+                                        'datetime': i['datetime']}
+                                       for i in full])
+        self.assertRaises(KeyError, eere.EPWdata, '063800', fields=['GHI'])
+        self.assertRaises(ValueError, eere.EPWdata, '063800',
+                          fields=fields, record='list')
+
+
+class ColumnCacheTest(LocalDataTest):
+
+    """Binary column cache."""
+
+    def runTest(self):
+        """Cached loads match parsing and are invalidated on change."""
+        import numpy as np
+        from caelum import cache, eere, tmy3
+        epw = self.path + '/NLD_Beek.063800_IWEC.epw'
+        parsed = eere.load_epw('063800')
+        self.assertTrue(os.path.isdir(cache.cache_path(epw)))
+        os.mkdir(self.path + '/plain')
+        self.assertEqual(os.stat(cache.cache_path(epw)).st_mode,
+                         os.stat(self.path + '/plain').st_mode)
+        os.rmdir(self.path + '/plain')
+        loaded = eere.load_epw('063800')
+        self.assertTrue(isinstance(loaded['GHI (W/m^2)'], np.memmap))
+        for field in parsed:
+            self.assertEqual(list(parsed[field]), list(loaded[field]))
+        self.assertEqual(cache.load(epw, eere.EPW_CACHE_VERSION + 1), None)
+        write_epw(epw, seed=1)
+        self.assertEqual(cache.load(epw, eere.EPW_CACHE_VERSION), None)
+        self.assertEqual(
+            list(eere.load_epw('063800')['Dry-bulb (C)']),
+            list(eere.EPWdata('063800').to_arrays(cache=False)
+                 ['Dry-bulb (C)']))
+
+        columns = tmy3.data('724666').to_arrays()
+        records = list(tmy3.data('724666'))
+        self.assertEqual(list(columns['GHI (W/m^2)']),
+                         [float(i['GHI (W/m^2)']) for i in records])
+        self.assertEqual(list(columns['Dry-bulb source']),
+                         [i['Dry-bulb source'] for i in records])
+        for field in ['datetime', 'utc_datetime']:
+            self.assertEqual(columns[field].astype(object).tolist(),
+                             [i[field] for i in records])
+        cached = tmy3.data('724666').to_arrays(['GHI (W/m^2)'])
+        self.assertTrue(isinstance(cached['GHI (W/m^2)'], np.memmap))
+
+
+class TMY3AggregateTest(LocalDataTest):
+
+    """Grouped TMY3 statistics against record iteration."""
+
+    def runTest(self):
+        """sums, means, extremes and percentiles for each grouping."""
+        import numpy as np
+        from caelum import tmy3
+        # TMY3 files have no leap day
+        write_tmy3(self.path + '/724666TYA.csv', year=1987)
+        write_tmy3(self.path + '/725650TYA.csv', year=1987, seed=1)
+        fields = ['GHI (W/m^2)', 'DNI (W/m^2)', 'Dry-bulb (C)']
+        stats = ['sum', 'mean', 'min', 'max', 'p90']
+        records = dict((i, list(tmy3.data(i))) for i in ['724666', '725650'])
+        keys = {'year': lambda r: 'TMY',
+                'month': lambda r: int(r['Date (MM/DD/YYYY)'][:2]),
+                'day': lambda r: datetime.date(
+                    2001, int(r['Date (MM/DD/YYYY)'][:2]),
+                    int(r['Date (MM/DD/YYYY)'][3:5])).timetuple().tm_yday,
+                'hour-of-day': lambda r: int(r['Time (HH:MM)'][:2]) - 1}
+        for by, key in keys.items():
+            found = tmy3.aggregate(['724666', '725650'], fields, by, stats)
+            self.assertEqual(found.usafs, ['724666', '725650'])
+            self.assertEqual(found.values.shape,
+                             (2, len(found.groups), 3, 5))
+            for k, usaf in enumerate(found.usafs):
+                for j, field in enumerate(fields):
+                    groups = {}
+                    for record in records[usaf]:
+                        groups.setdefault(key(record), []).append(
+                            float(np.float32(record[field])))
+                    self.assertEqual(sorted(groups), found.groups.tolist())
+                    for g, label in enumerate(found.groups):
+                        values = groups[label]
+                        self.assertTrue(np.allclose(
+                            found.values[k, g, j],
+                            [sum(values), np.mean(values), min(values),
+                             max(values), np.percentile(values, 90)]))
+        self.assertEqual(tmy3.total('724666'), sum(
+            float(i['GHI (W/m^2)']) for i in records['724666']) / 1000.)
+        self.assertEqual(tmy3.total('724666', 'DNI (W/m^2)'), sum(
+            float(i['DNI (W/m^2)']) for i in records['724666']) / 1000.)
+        self.assertRaises(ValueError, tmy3.aggregate, '724666', by='week')
+        self.assertRaises(ValueError, tmy3.aggregate, '724666',
+                          stats=['p101'])
+        self.assertRaises(ValueError, tmy3.aggregate, '724666',
+                          stats=['median'])
+
+
+class NSRDBLoadTest(LocalDataTest):
+
+    """Stacked multi-year NSRDB data against record iteration."""
+
+    def setUp(self):
+        from caelum import nsrdb
+        LocalDataTest.setUp(self)
+        self.nsrdb_path = nsrdb.PATH
+        nsrdb.PATH = [self.path + '/nsrdb']
+        os.makedirs(self.path + '/nsrdb/1992')
+        for year, seed in [(1991, 1), (1992, 2), (1993, 3), (1995, 5)]:
+            folder = '/nsrdb/1992' if year == 1992 else '/nsrdb'
+            write_nsrdb(self.path + folder + '/' + nsrdb.BASENAME % (
+                year, year, '724666'), year, seed, missing=[12, 13])
+
+    def tearDown(self):
+        from caelum import nsrdb
+        nsrdb.PATH = self.nsrdb_path
+        LocalDataTest.tearDown(self)
+
+    def runTest(self):
+        """values, monthly and annual totals, statistics and report."""
+        import numpy as np
+        from caelum import nsrdb
+        years = range(1991, 1996)
+        fields = ['GHI (W/m^2)', 'DNI (W/m^2)']
+        stack = nsrdb.load('724666', years, fields, processes=2)
+        self.assertEqual(stack.values.shape, (5, 8784, 2))
+        self.assertEqual(stack.years.tolist(), years)
+        self.assertTrue(np.isnan(stack.values[3]).all())
+        self.assertTrue(np.isnan(stack.values[0, 8760:]).all())
+        self.assertTrue(np.isfinite(stack.values[1, :, 1]).all())
+        self.assertTrue(np.isnan(stack.values[1, 12:14, 0]).all())
+        expected = {}
+        for i, year in enumerate([1991, 1992, 1993, 1995]):
+            data = nsrdb.Data('724666', year)
+            self.assertEqual(data.timezone, -7)
+            months = [0.] * 12
+            for k, record in enumerate(data):
+                ghi = float(record['Glo Mod (Wh/m^2)'])
+                if ghi != -9900:
+                    self.assertEqual(stack.values[years.index(year), k, 0],
+                                     ghi)
+                    months[int(record['YYYY-MM-DD'][5:7]) - 1] += ghi
+            expected[year] = months
+        monthly = nsrdb.monthly_totals(stack)
+        for year, months in expected.items():
+            self.assertTrue(np.allclose(monthly[years.index(year), :, 0],
+                                        np.array(months) / 1000.))
+            self.assertTrue(np.allclose(nsrdb.monthly('724666', year),
+                                        np.array(months) / 1000.))
+        self.assertTrue(np.isnan(monthly[3]).all())
+        annual = nsrdb.annual(stack)[:, 0]
+        self.assertTrue(np.allclose(annual[[0, 1, 2, 4]], [
+            sum(expected[i]) / 1000. for i in [1991, 1992, 1993, 1995]]))
+        stats = nsrdb.statistics(stack)
+        found = np.sort(annual[np.isfinite(annual)])
+        self.assertAlmostEqual(stats['mean'][0], found.mean())
+        self.assertAlmostEqual(stats['variability'][0],
+                               found.std(ddof=1) / found.mean())
+        self.assertAlmostEqual(stats['p90'][0], np.percentile(found, 10))
+        self.assertAlmostEqual(stats['high'][0], found[-2:].mean())
+        self.assertAlmostEqual(stats['low'][0], found[:2].mean())
+        self.assertTrue(stats['p90'][0] < stats['p50'][0])
+        pool = nsrdb.multiprocessing.Pool
+        nsrdb.multiprocessing.Pool = None
+        try:
+            self.assertTrue(np.allclose(
+                nsrdb.load('724666', years, fields).values, stack.values,
+                rtol=0, atol=0, equal_nan=True))
+        finally:
+            nsrdb.multiprocessing.Pool = pool
+        text = nsrdb.report('724666', years, processes=1)
+        self.assertTrue(text.startswith('DENVER/CENTENNIAL'))
+        self.assertTrue('TMY3/hist: ' in text)
+        self.assertTrue('P50/P90: %s/' % int(round(stats['p50'][0])) in text)
+        self.assertRaises(IOError, nsrdb.Data, '724666', 1994)
+
+        # zone names are standard time offsets, daylight saving removed
+        self.assertEqual(nsrdb.station_info('013110')['timezone'], -5)
+        self.assertEqual(nsrdb.station_info('717070')['timezone'], 10)
+        for usaf in ['013110', '010250']:
+            write_nsrdb(self.path + '/nsrdb/' + nsrdb.BASENAME % (
+                1991, 1991, usaf), 1991)
+        nsrdb.file_index().refresh()
+        record = nsrdb.Data('013110', 1991).next()
+        self.assertEqual(record['utc_datetime'],
+                         datetime.datetime(1991, 1, 1, 6))
+        # no guessed time zone for stations only in the NOAA list
+        self.assertEqual(nsrdb.station_info('010250')['timezone'], None)
+        self.assertRaises(KeyError, nsrdb.Data, '010250', 1991)
+
+
+class NSRDBFileIndexTest(LocalDataTest):
+
+    """Persistent, incrementally refreshed NSRDB file index."""
+
+    def runTest(self):
+        """years per station, saved index and mtime driven refresh."""
+        import json
+        from caelum import nsrdb
+        first = self.path + '/first'
+        second = self.path + '/second'
+        for folder in [first + '/1990s/a', first + '/2000s', second]:
+            os.makedirs(folder)
+
+        def touch(folder, usaf, year):
+            name = '%s/%s' % (folder, nsrdb.BASENAME % (year, year, usaf))
+            open(name, 'w').close()
+            return name
+
+        paths = {}
+        for year in [1991, 1992]:
+            paths[year] = touch(first + '/1990s/a', '724666', year)
+        touch(second, '724666', 1991)
+        other = touch(second, '725650', 2000)
+        open(second + '/NSRDB_StationData_notes.csv', 'w').close()
+        index = nsrdb.FileIndex([first, second], self.path + '/index.json')
+        self.assertEqual(index.years('724666'), [1991, 1992])
+        self.assertEqual(index.filename('724666', 1991), paths[1991])
+        self.assertEqual(index.filename('725650', '2000'), other)
+        self.assertEqual(index.stations(), {'724666': [1991, 1992],
+                                            '725650': [2000]})
+        with open(self.path + '/index.json') as saved:
+            self.assertEqual(len(json.load(saved)['dirs']), 5)
+
+        listed = []
+        listdir = os.listdir
+
+        def counting(path):
+            listed.append(path)
+            return listdir(path)
+
+        os.listdir = counting
+        try:
+            reloaded = nsrdb.FileIndex([first, second],
+                                       self.path + '/index.json')
+            self.assertEqual(reloaded.years('724666'), [1991, 1992])
+            self.assertEqual(listed, [])
+            added = touch(first + '/2000s', '724666', 2001)
+            for name in paths.values():
+                os.remove(name)
+            os.rmdir(first + '/1990s/a')
+            mtime = os.stat(first + '/2000s').st_mtime + 10
+            os.utime(first + '/2000s', (mtime, mtime))
+            os.utime(first + '/1990s', (mtime, mtime))
+            self.assertEqual(reloaded.filename('724666', 2001), None)
+            self.assertEqual(listed, [])
+            reloaded.refresh()
+            self.assertEqual(sorted(listed), [first + '/1990s',
+                                              first + '/2000s'])
+        finally:
+            os.listdir = listdir
+        self.assertEqual(reloaded.years('724666'), [1991, 2001])
+        self.assertEqual(reloaded.filename('724666', 2001), added)
+        self.assertEqual(reloaded.filename('724666', 1991),
+                         second + '/' + nsrdb.BASENAME % (1991, 1991,
+                                                          '724666'))
+
+        refresh = nsrdb.REFRESH
+        nsrdb.REFRESH = 0
+        try:
+            late = touch(second, '725650', 2001)
+            mtime = os.stat(second).st_mtime + 10
+            os.utime(second, (mtime, mtime))
+            self.assertEqual(reloaded.filename('725650', 2001), late)
+        finally:
+            nsrdb.REFRESH = refresh
+
+        saved_path = nsrdb.PATH
+        nsrdb.PATH = [second]
+        try:
+            self.assertEqual(nsrdb.available_years('725650'), [2000, 2001])
+            self.assertEqual(nsrdb.available_years('000000'), [])
+            self.assertTrue(os.path.exists(self.path + '/' + nsrdb.INDEX))
+        finally:
+            nsrdb.PATH = saved_path
+
+        shared = self.path + '/shared.json'
+        nsrdb.FileIndex([first], shared).refresh()
+        nsrdb.FileIndex([second], shared).refresh()
+        with open(shared) as saved:
+            self.assertEqual(sorted(json.load(saved)['dirs']),
+                             [first, first + '/1990s', first + '/2000s',
+                              second])
+        os.listdir = counting
+        del listed[:]
+        try:
+            self.assertEqual(nsrdb.FileIndex([first], shared).years('724666'),
+                             [2001])
+            self.assertEqual(listed, [])
+        finally:
+            os.listdir = listdir
+
+
+class DesignConditionsTest(LocalDataTest):
+
+    """Persistent design condition index."""
+
+    def runTest(self):
+        """Parsed once, indexed, reparsed on change, legacy fallbacks."""
+        from caelum import design, eere
+        ddy = self.path + '/NLD_Beek.063800_IWEC.ddy'
+        stat = self.path + '/NLD_Beek.063800_IWEC.stat'
+        write_ddy(ddy)
+        write_stat(stat)
+        conditions = eere.design_conditions(['063800'])['063800']
+        self.assertEqual(conditions['extreme_min'], -12.3)
+        self.assertEqual(conditions['extreme_max'], 30.9)
+        self.assertEqual(conditions['heating_99.6'], -10.5)
+        self.assertEqual(conditions['heating_99'], -7.9)
+        self.assertEqual(conditions['cooling_0.4'], 29.5)
+        self.assertEqual(conditions['mwb_1'], 19.1)
+        self.assertEqual(conditions['cooling_2'], 25.6)
+        self.assertEqual(conditions['stat_minimum'], -16.9)
+        self.assertEqual(conditions['stat_twopercent'], 27.0)
+        self.assertEqual(eere.minimum('063800'), -12.3)
+        self.assertEqual(eere.twopercent('063800'), 25.6)
+        index = design.DesignIndex(self.path + '/' + eere.DESIGN_INDEX)
+        self.assertEqual(index.codes(), ['063800'])
+
+        eere._DESIGN.clear()
+        os.remove(stat)
+        write_stat(stat, minimum=-20.0)
+        os.utime(stat, (1, 1))
+        write_ddy(ddy, extreme_min=None, twopercent=None)
+        os.utime(ddy, (1, 1))
+        self.assertEqual(eere.minimum('063800'), -20.0)
+        self.assertEqual(eere.twopercent('063800'), 27.0)
+        self.assertEqual(
+            eere.design_conditions(['063800', '724666']),
+            {'063800': dict(conditions, extreme_min=None, cooling_2=None,
+                            extreme_max=None, mwb_2=None,
+                            stat_minimum=-20.0),
+             '724666': design.parse()})
+
+
+class DesignTableTest(LocalDataTest):
+
+    """Bulk design condition table."""
+
+    def runTest(self):
+        """Pool parse, per station errors and resume."""
+        import numpy as np
+        from caelum import design, eere
+        for code, minimum in [('063800', -12.3), ('724666', -18.5)]:
+            ddy, stat = eere._design_paths(code)
+            write_ddy(ddy, extreme_min=minimum)
+            write_stat(stat)
+        codes = ['724666', '063800', '603900', 'nowhere']
+        output = self.path + '/design.npz'
+        table, errors = eere.build_design_table(codes, output, processes=2)
+        self.assertEqual(sorted(errors), ['603900', 'nowhere'])
+        self.assertEqual(list(table['station_code']), ['724666', '063800'])
+        self.assertEqual(list(table['extreme_min']), [-18.5, -12.3])
+        self.assertFalse(np.isnan(table['heating_99']).any())
+        saved = np.load(output)
+        for field in table:
+            self.assertEqual(list(saved[field]), list(table[field]))
+
+        parse = design.parse
+        design.parse = None
+        try:
+            resumed, errors = eere.build_design_table(codes, output,
+                                                      processes=1)
+        finally:
+            design.parse = parse
+        self.assertEqual(sorted(errors), ['603900', 'nowhere'])
+        self.assertEqual(list(resumed['cooling_2']), [25.6, 25.6])
+
+
+class FetchTest(unittest.TestCase):
+
+    """Pooled HTTP fetch layer against a local stub server."""
+
+    def runTest(self):
+        """keep-alive, retry, redirect, errors, timeouts and fetch_many."""
+        from caelum import tools
+        from tests.stub import StubServer
+        routes = dict(('/%s' % i, 'body %s' % i * 1000) for i in range(20))
+        fetcher = tools.Fetcher(timeout=5, retries=2, backoff=0.01,
+                                workers=4)
+        with StubServer(routes) as server:
+            for i in range(5):
+                response = fetcher.fetch(server.url('/1'))
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response.body, routes['/1'])
+            self.assertEqual(server.connections, 1)
+            self.assertEqual(server.requests[0][1]['user-agent'],
+                             tools.USER_AGENT)
+
+            server.failures['/2'] = 2
+            self.assertEqual(fetcher.fetch(server.url('/2')).body,
+                             routes['/2'])
+            server.failures['/2'] = 3
+            with self.assertRaises(tools.FetchError) as error:
+                fetcher.fetch(server.url('/2'))
+            self.assertEqual(error.exception.status, 503)
+            self.assertTrue(isinstance(error.exception, IOError))
+
+            count = len(server.requests)
+            self.assertRaises(tools.FetchError, fetcher.fetch,
+                              server.url('/missing'))
+            self.assertEqual(len(server.requests), count + 1)
+
+            server.redirects['/old'] = '/3'
+            response = fetcher.fetch(server.url('/old'))
+            self.assertEqual((response.url, response.body),
+                             (server.url('/3'), routes['/3']))
+
+            response = fetcher.fetch(server.url('/4'), {'Range': 'bytes=5-9'})
+            self.assertEqual((response.status, response.body),
+                             (206, routes['/4'][5:10]))
+            out = tempfile.TemporaryFile()
+            server.failures['/5'] = 1
+            self.assertEqual(fetcher.fetch(server.url('/5'), out=out).body,
+                             None)
+            out.seek(0)
+            self.assertEqual(out.read(), routes['/5'])
+            server.ranges = False
+            out = tempfile.TemporaryFile()
+            with self.assertRaises(tools.FetchError) as error:
+                fetcher.fetch(server.url('/5'), {'Range': 'bytes=5-9'}, out,
+                              expect=(206,))
+            self.assertEqual(error.exception.status, 200)
+            self.assertEqual(out.tell(), 0)
+            server.ranges = True
+
+            server.delays['/6'] = 0.5
+            slow = tools.Fetcher(timeout=0.1, retries=0)
+            self.assertRaises(tools.FetchError, slow.fetch, server.url('/6'))
+
+            urls = [server.url('/%s' % i) for i in range(20)]
+            connections = server.connections
+            self.assertEqual([i.body for i in fetcher.fetch_many(urls)],
+                             [routes['/%s' % i] for i in range(20)])
+            self.assertTrue(server.connections - connections <= 4)
+        fetcher.pool.close()
+
+
+class DownloadExtractTest(LocalDataTest):
+
+    """Streaming, atomic download and selective extraction."""
+
+    def runTest(self):
+        """only wanted members are extracted, no temporary files left."""
+        import StringIO
+        import zipfile
+        from caelum import tools
+        from tests.stub import StubServer
+        archive = StringIO.StringIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+            for name in ['BEEK.epw', 'BEEK.ddy', 'BEEK.stat', 'BEEK.pdf',
+                         'nested/BEEK.clm']:
+                zipped.writestr(name, name * 10000)
+        with StubServer({'/beek.zip': archive.getvalue(),
+                         '/beek.csv': 'a,b\r\n' * 1000}) as server:
+            before = set(os.listdir(self.path))
+            extracted = tools.download_extract(server.url('/beek.zip'),
+                                               ['epw', 'ddy', 'stat'])
+            self.assertEqual(sorted(os.path.basename(i) for i in extracted),
+                             ['BEEK.ddy', 'BEEK.epw', 'BEEK.stat'])
+            self.assertEqual(set(os.listdir(self.path)) - before,
+                             set(['BEEK.ddy', 'BEEK.epw', 'BEEK.stat']))
+            with open(self.path + '/BEEK.stat') as stat:
+                self.assertEqual(stat.read(), 'BEEK.stat' * 10000)
+            tools.download_extract(server.url('/beek.zip'))
+            self.assertTrue(os.path.exists(self.path + '/BEEK.clm'))
+
+            csv_file = self.path + '/beek.csv'
+            tools.download(server.url('/beek.csv'), csv_file)
+            self.assertRaises(tools.FetchError, tools.download,
+                              server.url('/missing.csv'), csv_file)
+            with open(csv_file) as downloaded:
+                self.assertEqual(downloaded.read(), 'a,b\r\n' * 1000)
+            # same permissions as a file made with open()
+            with open(self.path + '/plain', 'w'):
+                pass
+            for name in ['BEEK.epw', 'beek.csv']:
+                self.assertEqual(os.stat(self.path + '/' + name).st_mode,
+                                 os.stat(self.path + '/plain').st_mode)
+            os.remove(self.path + '/plain')
+            self.assertEqual([i for i in os.listdir(self.path)
+                              if i.startswith('.')], [])
+
+
+class GFSTest(unittest.TestCase):
+
+    """Base for tests against a stub GFS server in a temporary path."""
+
+    def setUp(self):
+        from caelum import gfs
+        self.baseurl = gfs.BASEURL
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        from caelum import gfs
+        gfs.BASEURL = self.baseurl
+        shutil.rmtree(self.path)
+
+
+class GFSDownloadTest(GFSTest):
+
+    """Parallel GFS range downloads against a local stub server."""
+
+    def runTest(self):
+        """files hold exactly the wanted messages, any ranges per request."""
+        import re
+        from caelum import gfs, tools
+        from tests.stub import StubServer
+        routes = {}
+        expected = {}
+        for offset in [0, 3]:
+            body, idx, messages = gfs_file(31, seed=offset)
+            name = '/gfs.2015010100/gfs.t00z.pgrb2.1p00.f%03d' % offset
+            routes[name] = body
+            routes[name + '.idx'] = idx
+            expected[name.rsplit('/', 1)[1]] = ''.join(
+                data for variable, level, data in messages
+                if variable == 'TMP' and level == 'surface')
+        with StubServer(routes) as server:
+            gfs.BASEURL = server.url('/gfs.%s/%s')
+            for multirange, server.multirange in [(1, True), (4, True),
+                                                  (4, False)]:
+                del server.requests[:]
+                for i in glob.glob(self.path + '/*/*.manifest'):
+                    os.remove(i)
+                filenames = gfs.download_many(
+                    [datetime.datetime(2015, 1, 1, 3)], [0, 3],
+                    products=['TMP'], levels=['surface'], path=self.path,
+                    multirange=multirange, request_cost=0)
+                self.assertEqual(len(filenames), 2)
+                for filename in filenames:
+                    with open(filename) as grib:
+                        self.assertEqual(
+                            grib.read(),
+                            expected[os.path.basename(filename)])
+                ranges = [i[1]['range'] for i in server.requests
+                          if 'range' in i[1]]
+                self.assertEqual(len(ranges), 2 * -(-6 // multirange))
+                for header in ranges:
+                    self.assertTrue(re.match('bytes=(\\d+-\\d*,?)+$',
+                                             header), header)
+            # a whole file answer is refused, not written at an offset
+            server.ranges = False
+            for i in glob.glob(self.path + '/*/*.manifest'):
+                os.remove(i)
+            self.assertRaises(tools.FetchError, gfs.download_many,
+                              [datetime.datetime(2015, 1, 1, 3)], [0, 3],
+                              products=['TMP'], levels=['surface'],
+                              path=self.path, request_cost=0)
+            for filename in filenames:
+                self.assertTrue(os.path.getsize(filename) <=
+                                len(expected[os.path.basename(filename)]))
+
+
+class GFSInventoryTest(GFSTest):
+
+    """Typed, cached GFS .idx inventories."""
+
+    def runTest(self):
+        """lookups match a scan, saved inventories are revalidated."""
+        from caelum import gfs
+        from tests.stub import StubServer
+        _, idx, messages = gfs_file(31)
+        index = gfs.Inventory.parse(idx)
+        self.assertEqual(len(index), 31)
+        first = index.messages[0]
+        self.assertEqual(first, ('1', 0, datetime.datetime(2015, 1, 1),
+                                 'TMP', 'surface', 'anl',
+                                 len(messages[0][2])))
+        self.assertEqual(index.messages[-1].end, None)
+        for products, levels in [(['TMP'], ['surface']), (['UGRD'], None),
+                                 (None, ['2 m above ground']), (None, None),
+                                 (['TMP', 'VGRD'], ['surface', 'none'])]:
+            self.assertEqual(
+                index.select(products, levels),
+                [i for i in index if (not products or i.variable in products)
+                 and (not levels or i.level in levels)])
+        self.assertEqual(index.segments(['TMP', 'UGRD', 'VGRD']),
+                         [(0, None)])
+        paired = gfs.Inventory.parse(
+            '1:0:d=2015010100:TMP:surface:anl:\n'
+            '2.1:100:d=2015010100:UGRD:10 m above ground:anl:\n'
+            '2.2:100:d=2015010100:VGRD:10 m above ground:anl:\n'
+            '3:250:d=2015010100:TMP:2 m above ground:anl:\n')
+        self.assertEqual([i.end for i in paired], [100, 250, 250, None])
+        self.assertEqual(paired.segments(['UGRD', 'VGRD']), [(100, 250)])
+
+        name = '/gfs.2015010100/gfs.t00z.pgrb2.1p00.f000.idx'
+        with StubServer({name: idx}) as server:
+            gfs.BASEURL = server.url('/gfs.%s/%s')
+            run = datetime.datetime(2015, 1, 1, 5)
+            self.assertEqual(gfs.inventory(run, path=self.path).messages,
+                             index.messages)
+            self.assertTrue(os.path.exists(self.path + '/2015010100/'
+                                           'gfs.t00z.pgrb2.1p00.f000.idx'))
+            gfs._INVENTORIES.clear()
+            gfs.inventory(run, path=self.path)
+            self.assertEqual(len(server.requests), 1)
+            gfs.inventory(run, path=self.path, ttl=0)
+            self.assertEqual(server.requests[-1][1]['if-none-match'],
+                             '"%x"' % (hash(idx) & 0xffffffff))
+            server.routes[name] = idx.replace('TMP', 'RH')
+            self.assertEqual(
+                len(gfs.inventory(run, path=self.path, ttl=0).variables['RH']),
+                11)
+            self.assertEqual(len(server.requests), 3)
+
+
+class GFSResumeTest(GFSTest):
+
+    """Resumable GFS downloads with a segment manifest."""
+
+    def setUp(self):
+        from caelum import tools
+        GFSTest.setUp(self)
+        self.backoff = tools.FETCHER.backoff
+        tools.FETCHER.backoff = 0
+
+    def tearDown(self):
+        from caelum import tools
+        tools.FETCHER.backoff = self.backoff
+        GFSTest.tearDown(self)
+
+    def runTest(self):
+        """only missing or damaged segments are fetched again."""
+        from caelum import gfs, tools
+        from tests.stub import StubServer
+        body, idx, messages = gfs_file(31)
+        name = '/gfs.2015010100/gfs.t00z.pgrb2.1p00.f000'
+        expected = ''.join(data for variable, level, data in messages
+                           if variable == 'TMP')
+        run = datetime.datetime(2015, 1, 1)
+        filename = self.path + '/2015010100/gfs.t00z.pgrb2.1p00.f000'
+        with StubServer({name: body, name + '.idx': idx}) as server:
+            gfs.BASEURL = server.url('/gfs.%s/%s')
+
+            def download():
+                del server.requests[:]
+                gfs.download(run, gfs.pgrb2, self.path, ['TMP'],
+                             request_cost=0)
+                return [i[1]['range'] for i in server.requests
+                        if i[0] == name]
+
+            segments = gfs.inventory(run, path=self.path).segments(['TMP'])
+            failing = 'bytes=' + gfs._range(*segments[3])
+            server.failures[(name, failing)] = 100
+            self.assertRaises(tools.FetchError, download)
+            del server.failures[(name, failing)]
+            self.assertEqual(download(), [failing])
+            with open(filename) as grib:
+                self.assertEqual(grib.read(), expected)
+            self.assertFalse(os.path.exists(self.path + '/gfs.t00z.pgrb2.'
+                                            '1p00.f000'))
+
+            self.assertEqual(download(), [])
+            with open(filename, 'r+b') as grib:
+                grib.seek(len(messages[0][2]) + 10)
+                grib.write('X')
+            self.assertEqual(download(), ['bytes=' + gfs._range(*segments[1])])
+            with open(filename) as grib:
+                self.assertEqual(grib.read(), expected)
+
+            del server.requests[:]
+            gfs.download(run, gfs.pgrb2, self.path, ['TMP', 'UGRD'],
+                         request_cost=0)
+            self.assertEqual(len(server.requests), 11)
+
+
+class GRIB2Test(GFSTest):
+
+    """GRIB2 decoding and point extraction."""
+
+    def runTest(self):
+        """decoded fields and interpolated points match the source grids."""
+        import struct
+        import numpy as np
+        from caelum import gfs, grib2
+        from tests.stub import StubServer
+        lats = np.arange(90, -91, -1.0)
+        lons = np.arange(0, 360, 1.0)
+        plane = lats[:, None] + lons[None, :] / 1000.
+        global_grid = {'la1': 90, 'lo1': 0, 'di': 1, 'dj': 1}
+        mask = np.arange(plane.size) % 7 != 0
+        fields = [
+            dict(global_grid, values=plane, bits=18, decimal=3),
+            dict(global_grid, values=plane * 2, bits=16, binary=-5),
+            dict(global_grid, values=plane, bits=12, decimal=1,
+                 bitmap=mask),
+            dict(global_grid, values=np.zeros((181, 360)) + 3, bits=0),
+            {'values': plane[:11, :21][::-1], 'la1': 80, 'lo1': 0,
+             'di': 1, 'dj': 1, 'scan': 0x40 | 0x20, 'decimal': 2},
+            {'values': plane[100:111, 10:31], 'la1': -10, 'lo1': 10,
+             'di': 1, 'dj': 1, 'decimal': 2}]
+        decoded = grib2.decode(grib2_message(fields[:2]))
+        self.assertEqual(len(decoded), 2)
+        self.assertTrue(np.allclose(decoded[0].values, plane, atol=1e-3))
+        self.assertTrue(np.allclose(decoded[1].values, plane * 2,
+                                    atol=2 ** -5))
+        self.assertEqual(list(decoded[0].lats), list(lats))
+        masked = grib2.decode(grib2_message(fields[2:3]))[0].values.ravel()
+        self.assertTrue(np.isnan(masked[~mask]).all())
+        self.assertTrue(np.allclose(masked[mask], plane.ravel()[mask],
+                                    atol=0.05))
+        self.assertEqual(grib2.decode(grib2_message(fields[3:4]))[0]
+                         .values.max(), 3)
+        rough = plane + np.sin(plane * 7)
+        rough[5, 10:200] = np.nan
+        rough[6:9] = np.nan
+        for field in [dict(global_grid, values=plane, template=3, decimal=3),
+                      dict(global_grid, values=rough, template=3, order=1,
+                           decimal=2, binary=1),
+                      dict(global_grid, values=rough, template=2, decimal=2),
+                      dict(global_grid, values=plane, template=3, decimal=1,
+                           bitmap=mask)]:
+            values = field['values'].copy()
+            if 'bitmap' in field:
+                values.ravel()[~mask] = np.nan
+            unpacked = grib2.decode(grib2_message([field]))[0].values
+            self.assertTrue((np.isnan(unpacked) == np.isnan(values)).all())
+            tolerance = 10. ** -field['decimal'] * 2 ** field.get('binary', 0)
+            self.assertTrue(np.nanmax(abs(unpacked - values)) <= tolerance)
+        jpeg = grib2_message(fields[:1])
+        jpeg = jpeg[:152] + struct.pack('>H', 40) + jpeg[154:]
+        self.assertRaises(NotImplementedError, grib2.decode, jpeg)
+        junk = tempfile.TemporaryFile()
+        junk.write('x' * 64)
+        self.assertRaises(ValueError, grib2.read, junk, 0)
+        north = grib2.decode(grib2_message(fields[4:5]))[0]
+        self.assertEqual((north.lats[0], north.lats[-1]), (80, 90))
+        self.assertTrue(np.allclose(north.values, plane[:11, :21][::-1],
+                                    atol=0.01))
+        south = grib2.decode(grib2_message(fields[5:6]))[0]
+        self.assertEqual((south.lats[0], south.lons[0]), (-10, 10))
+
+        points_lat = np.array([39.74, -33.9, 10.25, 89.5, -90])
+        points_lon = np.array([-105.18, 18.4, 359.5, 0.25, 180])
+        expected = points_lat + np.mod(points_lon, 360) / 1000.
+        expected[2] = 10.25 + 0.359 / 2
+        self.assertTrue(np.allclose(
+            grib2.interpolate(decoded[0], points_lat, points_lon),
+            expected, atol=1e-3))
+        regional = grib2.interpolate(south, [-15.5, 5, -15],
+                                     [12.25, 12, 40])
+        self.assertTrue(np.allclose(regional[0], -15.5 + 0.01225,
+                                    atol=0.01))
+        self.assertTrue(np.isnan(regional[1:]).all())
+
+        messages = [grib2_message(fields[:1]), grib2_message(fields[3:4]),
+                    grib2_message(fields[:2]), grib2_message(fields[5:6])]
+        idx = []
+        offset = 0
+        for number, variable, message in [
+                ('1', 'TMP', messages[0]), ('2', 'RH', messages[1]),
+                ('3.1', 'UGRD', messages[2]), ('3.2', 'VGRD', messages[2]),
+                ('4', 'TMP', messages[3])]:
+            if number != '3.2':
+                offset += 0 if number == '1' else len(last)
+            last = message
+            level = '2 m above ground' if number == '4' else 'surface'
+            idx.append('%s:%s:d=2015010100:%s:%s:anl:\n' % (
+                number, offset, variable, level))
+        name = '/gfs.2015010100/gfs.t00z.pgrb2.1p00.f000'
+        with StubServer({name: ''.join(messages),
+                         name + '.idx': ''.join(idx)}) as server:
+            gfs.BASEURL = server.url('/gfs.%s/%s')
+            filename, = gfs.download_many(
+                [datetime.datetime(2015, 1, 1)], [0], path=self.path,
+                products=['TMP', 'UGRD', 'VGRD'], levels=['surface'])
+        selected, values = gfs.extract_points(
+            filename, ['VGRD', 'UGRD', 'TMP'], ['surface'], points_lat,
+            points_lon)
+        self.assertEqual([i.variable for i in selected],
+                         ['TMP', 'UGRD', 'VGRD'])
+        self.assertEqual(values.shape, (5, 3))
+        self.assertTrue(np.allclose(values[:, 0], expected, atol=1e-3))
+        self.assertTrue(np.allclose(values[:, 2], expected * 2,
+                                    atol=2 ** -5))
+        self.assertRaises(KeyError, gfs.extract_points, filename, ['TMP'],
+                          None, points_lat, points_lon)
+
+
+class GFSPlanTest(unittest.TestCase):
+
+    """Byte versus request cost fetch planner."""
+
+    def runTest(self):
+        """gaps are over-fetched only when cheaper than a request."""
+        from caelum import gfs
+        sizes = [100, 50, 100, 1000, 100, 10, 100, 100]
+        variables = ['TMP', 'RH', 'TMP', 'RH', 'TMP', 'RH', 'TMP', 'TMP']
+        lines = []
+        offset = 0
+        for i, (size, variable) in enumerate(zip(sizes, variables)):
+            lines.append('%s:%s:d=2015010100:%s:surface:anl:' % (
+                i + 1, offset, variable))
+            offset += size
+        index = gfs.Inventory.parse('\n'.join(lines))
+        exact = gfs.plan(index, ['TMP'], request_cost=0)
+        self.assertEqual(exact, ([(0, 100), (150, 250), (1250, 1350),
+                                  (1360, None)], 400, 400, 4))
+        self.assertEqual(gfs.plan(index, ['TMP'], request_cost=60),
+                         ([(0, 250), (1250, None)], 460, 400, 2))
+        self.assertEqual(gfs.plan(index, ['TMP'], request_cost=2000),
+                         ([(0, None)], 1460, 400, 1))
+        self.assertEqual(gfs.plan(index, ['TMP'], request_cost=0,
+                                  multirange=3).requests, 2)
+        self.assertEqual(gfs.plan(index, ['RH'], request_cost=150),
+                         ([(100, 1360)], 1260, 1060, 1))
+        self.assertEqual(gfs.plan(index, ['none']), ([], 0, 0, 0))
+
+
+class GFSPointSeriesTest(GFSTest):
+
+    """Streaming point forecast series across offsets."""
+
+    def runTest(self):
+        """(site, time, variable) values, missing offsets NaN."""
+        import struct
+        import numpy as np
+        from caelum import gfs
+        from tests.stub import StubServer
+        lats = np.arange(90, -91, -1.0)
+        lons = np.arange(0, 360, 1.0)
+        plane = lats[:, None] + lons[None, :] / 1000.
+        grid = {'la1': 90, 'lo1': 0, 'di': 1, 'dj': 1, 'decimal': 3,
+                'bits': 24}
+        routes = {}
+        for offset in [0, 3, 9, 12]:
+            fields = [('TMP', 'surface', plane + offset),
+                      ('RH', 'surface', plane),
+                      ('TMP', '2 m above ground', plane - offset),
+                      ('UGRD', 'surface', plane * 0 + offset)]
+            body = ''
+            idx = ''
+            for i, (variable, level, values) in enumerate(fields):
+                idx += '%s:%s:d=2015010106:%s:%s:%s hour fcst:\n' % (
+                    i + 1, len(body), variable, level, offset)
+                message = grib2_message([dict(grid, values=values)])
+                if offset == 12:
+                    # JPEG2000 packing, which grib2 does not decode
+                    message = message[:152] + struct.pack('>H', 40) + \
+                        message[154:]
+                body += message
+            name = '/gfs.2015010106/gfs.t06z.pgrb2.1p00.f%03d' % offset
+            routes[name] = body
+            routes[name + '.idx'] = idx
+        places = [(39.74, -105.18), (-33.9, 18.4), (10.25, 359.5)]
+        expected = np.array([39.74 + 254.82 / 1000, -33.9 + 18.4 / 1000,
+                             10.25 + 0.359 / 2])
+        with StubServer(routes) as server:
+            gfs.BASEURL = server.url('/gfs.%s/%s')
+            series = gfs.point_series(
+                datetime.datetime(2015, 1, 1, 11), places, ['TMP', 'UGRD'],
+                ['surface', '2 m above ground'], [0, 3, 6, 9],
+                path=self.path, keep=False)
+            self.assertRaises(NotImplementedError, gfs.point_series,
+                              datetime.datetime(2015, 1, 1, 11), places,
+                              ['TMP'], ['surface'], [9, 12], path=self.path,
+                              keep=False)
+        self.assertEqual(series.values.shape, (3, 4, 4))
+        self.assertEqual(series.variables, [
+            ('TMP', 'surface'), ('TMP', '2 m above ground'),
+            ('UGRD', 'surface'), ('UGRD', '2 m above ground')])
+        self.assertEqual(series.times.astype(object).tolist(), [
+            datetime.datetime(2015, 1, 1, i) for i in [6, 9, 12, 15]])
+        for k, offset in [(0, 0), (1, 3), (3, 9)]:
+            self.assertTrue(np.allclose(series.values[:, k, 0],
+                                        expected + offset, atol=1e-3))
+            self.assertTrue(np.allclose(series.values[:, k, 1],
+                                        expected - offset, atol=1e-3))
+            self.assertTrue(np.allclose(series.values[:, k, 2], offset))
+        self.assertTrue(np.isnan(series.values[:, 2, :]).all())
+        self.assertTrue(np.isnan(series.values[:, :, 3]).all())
+        self.assertEqual(glob.glob(self.path + '/2015010106/*.f00?'), [])
+        hourly = gfs.resample(series, '1H')
+        self.assertEqual(hourly.values.shape, (3, 10, 4))
+        self.assertTrue(np.allclose(hourly.values[:, 1, 2], 1))
+        self.assertTrue(np.isnan(hourly.values[:, :, 3]).all())
+
+
+class NDFDParseTest(unittest.TestCase):
+
+    """NDFD DWML parsing by time layout."""
+
+    def runTest(self):
+        """layouts, parameters, nil values and UTC times."""
+        import numpy as np
+        from caelum import noaa, timeaxis
+        places = [(39.74, -105.18), (38.9, -77.04)]
+        response = noaa.parse_dwml(ndfd_response(places, steps=4, nil=[1]))
+        self.assertEqual(response.locations, [('point1', 39.74, -105.18),
+                                              ('point2', 38.9, -77.04)])
+        self.assertEqual(sorted(response.layouts), ['k-p1h-n12-2',
+                                                    'k-p3h-n4-1'])
+        layout = response.layouts['k-p3h-n4-1']
+        self.assertEqual(layout.strings[1], '2015-01-01T09:00:00-07:00')
+        self.assertEqual(layout.times.tolist(), [
+            datetime.datetime(2015, 1, 1, 13) + datetime.timedelta(hours=i)
+            for i in range(0, 12, 3)])
+        self.assertEqual(
+            [(i.location, i.name, i.kind) for i in
+             response.parameters['k-p3h-n4-1']],
+            [('point1', 'temperature', 'hourly'),
+             ('point1', 'wind-speed', 'sustained'),
+             ('point1', 'humidity', 'relative'),
+             ('point2', 'temperature', 'hourly'),
+             ('point2', 'wind-speed', 'sustained'),
+             ('point2', 'humidity', 'relative')])
+        temperature = response.parameters['k-p3h-n4-1'][3]
+        self.assertTrue(np.isnan(temperature.values[1]))
+        self.assertEqual(temperature.values[[0, 2, 3]].tolist(),
+                         [38, 40, 41])
+        cloud = response.parameters['k-p1h-n12-2'][0]
+        self.assertEqual(len(cloud.values), 12)
+        self.assertEqual(cloud.values[0], 0)
+
+        columns = noaa.parse(ndfd_response(places, steps=4))[0]
+        self.assertEqual(columns['utc_datetime'].tolist(),
+                         layout.times.tolist())
+        self.assertEqual(columns['cloudCover'].tolist(),
+                         [0, 0.03, 0.06, 0.09])
+        self.assertEqual(noaa.parse(ndfd_response([], steps=4)), [])
+
+        strings = ['2015-06-30T23:15:42%+03d:%02d' % (i, j)
+                   for i in range(-12, 15) for j in [0, 30]]
+        self.assertEqual(
+            timeaxis.isotimes(strings).tolist(),
+            [datetime.datetime.strptime(i[:19], '%Y-%m-%dT%H:%M:%S') -
+             datetime.timedelta(hours=int(i[19:22]),
+                                minutes=int(i[19] + i[23:25]))
+             for i in strings])
+        self.assertEqual(timeaxis.isotimes(['2015-01-01T00:00:00Z'])[0],
+                         np.datetime64('2015-01-01T00:00:00'))
+        self.assertRaises(ValueError, timeaxis.isotimes,
+                          ['2015-01-01 00:00:00 07:00'])
+
+
+class NDFDForecastTest(unittest.TestCase):
+
+    """Cached, batched NDFD forecasts."""
+
+    def setUp(self):
+        from caelum import noaa
+        self.url = noaa.URL
+        noaa.clear_cache()
+
+    def tearDown(self):
+        from caelum import noaa
+        noaa.URL = self.url
+        noaa.clear_cache()
+
+    def runTest(self):
+        """one list query for many places, then cache hits."""
+        import urlparse
+        import numpy as np
+        from caelum import noaa
+        from tests.stub import StubServer
+
+        def respond(path):
+            query = urlparse.parse_qs(urlparse.urlparse(path).query)
+            self.assertEqual(query['whichClient'], ['NDFDgenLatLonList'])
+            places = [[float(j) for j in i.split(',')]
+                      for i in query['listLatLon'][0].split()]
+            return ndfd_response(places, nil=[2])
+
+        places = [(39.74, -105.18), (38.9, -77.04), (47.61, -122.33)]
+        with StubServer({'/ndfd': respond}) as server:
+            noaa.URL = server.url('/ndfd')
+            columns = noaa.forecast_many(places)
+            self.assertEqual(len(server.requests), 1)
+            for (lat, _), found in zip(places, columns):
+                temperature = int(lat) + np.arange(8.)
+                temperature[2] = np.nan
+                self.assertTrue(np.allclose(found['temperature'],
+                                            temperature, equal_nan=True))
+            found = columns[1]
+            self.assertEqual(found['start-valid-time'][:2].tolist(), [
+                '2015-01-01T06:00:00-07:00', '2015-01-01T09:00:00-07:00'])
+            self.assertEqual(found['start-valid-time'][-1],
+                             '2015-01-02T03:00:00-07:00')
+            self.assertTrue(np.allclose(found['cloudCover'],
+                                        np.arange(0, 24, 3) / 100.))
+            self.assertAlmostEqual(found['windSpeed'][1], 2 * 1.15)
+            self.assertTrue(np.isnan(found['relativeHumidity'][2]))
+            self.assertRaises(ValueError, found['temperature'].fill, 0)
+
+            self.assertEqual(noaa.forecast((39.741, -105.179), series=False),
+                             {'cloudCover': 0.0, 'temperature': 39.0,
+                              'windSpeed': 0.0,
+                              'start-valid-time': '2015-01-01T06:00:00-07:00'})
+            self.assertEqual(noaa.forecast(places[2])['temperature'][:2],
+                             [47.0, 48.0])
+            self.assertEqual(len(noaa.herp_derp_interp(places[0])), 22)
+            self.assertEqual(len(server.requests), 1)
+
+            noaa.forecast_many(places[:1] + [(21.3, -157.86)])
+            self.assertEqual(len(server.requests), 2)
+            self.assertEqual(server.requests[1][0].count(','), 1)
+            noaa.forecast_many(places, ttl=0)
+            self.assertEqual(len(server.requests), 3)
+
+class ForecastIOTest(unittest.TestCase):
+
+    """Shared forecast.io response cache and columnar hourly data."""
+
+    def setUp(self):
+        from caelum import forecast
+        self.saved = forecast.BASEURL, forecast.APIKEY, forecast.LIMIT.rate
+        forecast.clear_cache()
+
+    def tearDown(self):
+        from caelum import forecast
+        forecast.BASEURL, forecast.APIKEY, forecast.LIMIT.rate = self.saved
+        forecast.clear_cache()
+
+    def runTest(self):
+        """one call per place for data, hourly and current."""
+        import json
+        import time
+        import numpy as np
+        from caelum import forecast
+        from tests.stub import StubServer
+
+        def response(lat):
+            hours = [{'time': 1420070400 + 3600 * i, 'temperature': lat + i,
+                      'summary': 'Clear', 'cloudCover': 0.1 * i}
+                     for i in range(4)]
+            hours[1]['solar'] = {'ghi': 500, 'dni': 700, 'dhi': 80,
+                                 'etr': 1000}
+            hours[2]['precipType'] = 'rain'
+            del hours[3]['cloudCover']
+            return json.dumps({'hourly': {'data': hours},
+                               'currently': hours[1]})
+
+        places = [(40.0, -78.0), (39.74, -105.18), (47.61, -122.33),
+                  (21.3, -157.86), (38.9, -77.04), (35.0, -90.0)]
+        routes = dict(('/forecast/KEY/%s,%s' % place, response(place[0]))
+                      for place in places)
+        forecast.APIKEY = 'KEY'
+        with StubServer(routes) as server:
+            forecast.BASEURL = server.url('/forecast/%s/%s,%s?solar')
+            hours = forecast.hourly(places[0])
+            current = forecast.current(places[0])
+            self.assertEqual(forecast.data(places[0])['currently']['time'],
+                             1420074000)
+            self.assertEqual(len(server.requests), 1)
+            self.assertEqual(current['GHI (W/m^2)'], 500)
+            self.assertEqual(current['utc_datetime'],
+                             datetime.datetime(2015, 1, 1, 1))
+            self.assertEqual(len(hours), 4)
+            changed = forecast.data(places[0])
+            changed['currently']['time'] = 0
+            del changed['hourly']
+            self.assertEqual(forecast.data(places[0]), json.loads(
+                routes['/forecast/KEY/%s,%s' % places[0]]))
+
+            forecast.LIMIT.rate = 20
+            start = time.time()
+            columns = forecast.hourly_many(places[:5] + [places[0]])
+            self.assertTrue(time.time() - start >= 0.15)
+            self.assertEqual(len(server.requests), 5)
+            self.assertEqual(len(columns), 6)
+            found = columns[0]
+            for i, hour in enumerate(hours):
+                for name, value in hour.items():
+                    if name == 'utc_datetime':
+                        self.assertEqual(found[name][i].item(), value)
+                    elif isinstance(value, float):
+                        self.assertAlmostEqual(found[name][i], value)
+                    else:
+                        self.assertEqual(found[name][i], value)
+            self.assertTrue(np.isnan(found['cloudCover'][3]))
+            self.assertEqual(found['precipType'].tolist(),
+                             [None, None, 'rain', None])
+            self.assertEqual(found['DNI (W/m^2)'].tolist(), [0, 700, 0, 0])
+            self.assertEqual(columns[3]['temperature'][0], 21.3)
+
+            forecast.LIMIT.rate = None
+            start = time.time()
+            forecast.hourly_many(places, ttl=0, rate=20)
+            self.assertTrue(time.time() - start >= 0.25)
+            self.assertEqual(len(server.requests), 11)
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(BaseEERETest)
     unittest.TextTestRunner(verbosity=2).run(suite)